@@ -1,22 +1,36 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google import genai
 from google.genai import types
 from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
 import time
 import re
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Tuple
 from dotenv import load_dotenv
+from google.api_core.exceptions import AlreadyExists, NotFound
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 from datetime import datetime, timedelta, timezone
 from dateutil import parser as dateutil_parser # Added for reminder date parsing
 from dateutil.relativedelta import relativedelta # Added for recurrence
 import unicodedata
-import pytz
+from zoneinfo import ZoneInfo
 import random
-import calendar
+import string
+import tempfile
+import hashlib
+import heapq
+import io
+import mimetypes
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from itertools import product
 
 # Forçar timezone do ambiente (não altera o sistema, só o processo Python)
 os.environ['TZ'] = 'America/Sao_Paulo'
@@ -28,13 +42,45 @@ time.tzset() if hasattr(time, 'tzset') else None
 # Carrega variáveis do .env
 load_dotenv()
 
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Mimetype por extensão, para mídias que chegam sem mimetype (o restante cai em mimetypes.guess_type)
+_EXT_TO_MIME = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".mp3": "audio/mp3", ".oga": "audio/ogg", ".opus": "audio/opus", ".wav": "audio/wav", # .oga é comum para PTT
+    ".mp4": "video/mp4", ".pdf": "application/pdf",
+}
+
+# Tabela para remover acentos e passar para minúsculas em uma única passada
+# (letras acentuadas do português e afins, maiúsculas ou não, e A-Z)
+_ACCENTED_CHARS = {
+    'a': 'àáâãäå', 'e': 'èéêë', 'i': 'ìíîï', 'o': 'òóôõö',
+    'u': 'ùúûü', 'c': 'ç', 'n': 'ñ', 'y': 'ýÿ'
+}
+_ACCENT_FOLD_TABLE = str.maketrans({
+    **{upper: upper.lower() for upper in string.ascii_uppercase},
+    **{
+        accented: base
+        for base, accents in _ACCENTED_CHARS.items()
+        for accented in accents + accents.upper()
+    },
+})
+
+@lru_cache(maxsize=4096) # Chamada repetidamente com as mesmas palavras curtas (limpeza de lembretes)
 def normalizar_texto(texto):
-    texto = unicodedata.normalize('NFD', texto)
-    texto = texto.encode('ascii', 'ignore').decode('utf-8')
-    texto = texto.lower()
-    texto = re.sub(r'\s+', ' ', texto)
-    texto = texto.strip()
-    return texto
+    texto = texto.translate(_ACCENT_FOLD_TABLE) # Já sai em minúsculas quando o resultado é ASCII
+    if not texto.isascii(): # Outros caracteres não ASCII (emojis, etc.): decomposição completa, como antes
+        texto = unicodedata.normalize('NFD', texto)
+        texto = texto.encode('ascii', 'ignore').decode('utf-8').lower()
+    # Colapsa espaços e remove os das pontas (split() usa a mesma definição de espaço que \s)
+    return ' '.join(texto.split())
+
+def hash_texto(texto: str) -> str:
+    """Hash determinístico de um texto (estável entre processos, ao contrário de hash()).
+       blake2b é da stdlib e implementado em C: para prompts de poucos KB, hashes SIMD de terceiros
+       (xxhash/BLAKE3) não trariam ganho mensurável e mudariam os valores já gravados em reengagement_logs.
+    """
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()
 
 # Configuração de logs
 logging.basicConfig(
@@ -47,9 +93,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class RequestCache:
+    """Cache de leituras do Firestore válido durante uma única interação (turno do usuário)."""
+
+    def __init__(self):
+        self._docs: Dict[str, Any] = {}
+
+    def get_or_fetch(self, doc_ref):
+        """Retorna o snapshot do documento, lendo do Firestore apenas na primeira vez."""
+        if doc_ref.path not in self._docs:
+            self._docs[doc_ref.path] = doc_ref.get()
+        return self._docs[doc_ref.path]
+
+    def invalidate(self, doc_ref):
+        """Descarta o snapshot de um documento que acabou de ser escrito."""
+        self._docs.pop(doc_ref.path, None)
+
+class DelayQueue:
+    """
+    Fila de envio com limite de taxa (no máximo burst_limit chamadas a cada time_limit_ms).
+    Todas as chamadas são executadas por uma única thread, na ordem em que foram enfileiradas.
+    """
+
+    def __init__(self, burst_limit: int = 18, time_limit_ms: int = 1000):
+        self.burst_limit = burst_limit
+        self.time_limit = time_limit_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._sent_at: deque = deque(maxlen=burst_limit) # Instantes (perf_counter) dos últimos envios
+        self._thread = threading.Thread(target=self._dispatch_loop, name="WhapiDelayQueue", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """Enfileira a chamada e retorna um Future com o seu resultado."""
+        future: Future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _dispatch_loop(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            if len(self._sent_at) == self.burst_limit:
+                wait = self.time_limit - (time.perf_counter() - self._sent_at[0])
+                if wait > 0:
+                    time.sleep(wait)
+            self._sent_at.append(time.perf_counter())
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
 class WhatsAppGeminiBot:
     PENDING_CHECK_INTERVAL = 2
+    PENDING_CHATS_MAX_WORKERS = 8 # Chats com mensagens pendentes processados em paralelo (Firestore + Gemini)
     REENGAGEMENT_TIMEOUT = (60 * 60 * 24 * 2)  # 2 dias em segundos
+    REENGAGEMENT_CHECK_INTERVAL_SECONDS = 60 * 60  # Ajuste o intervalo conforme necessidade
+    REENGAGEMENT_MIN_INTERVAL_SECONDS = (60 * 60 * 23)  # Não reenviar reengajamento antes de 23 horas (evita spam diário)
+    REENGAGEMENT_NEVER_ATTEMPTED = datetime(1970, 1, 1, tzinfo=timezone.utc)  # Valor de last_reengagement_attempt sem tentativa
+    REENGAGEMENT_MAX_WORKERS = 8  # Chats reengajados em paralelo (Firestore + Gemini); o envio segue pela fila com limite de taxa
     # REENGAGEMENT_MESSAGES não será mais usado para a lógica principal,
     # mas pode ser um fallback se a geração do Gemini falhar.
     FALLBACK_REENGAGEMENT_MESSAGES = [
@@ -57,21 +157,100 @@ class WhatsAppGeminiBot:
         "Oi! Como posso ajudar você hoje?",
     ]
 
+    GOOGLE_SEARCH_TOOL = Tool(google_search=GoogleSearch()) # Imutável: reaproveitada em todas as configs com busca
+    # Instrução fixa do prompt de reengajamento (prefixo idêntico em todas as chamadas)
+    REENGAGEMENT_INSTRUCTION = (
+        "O usuário deste chat não interage há algum tempo (cerca de 36 horas ou mais). "
+        "Seu objetivo é gerar uma mensagem de reengajamento curta, amigável e personalizada, focando em despertar o interesse do usuário e incentivá-lo a retomar a conversa. "
+        "Siga as seguintes diretrizes, priorizando as opções de reengajamento mais relevantes e interessantes:"
+        "\n\n"
+        "1. **Análise do histórico:** Primeiramente, examine o histórico de conversa do usuário e/ou o resumo da conversa (se disponível). "
+        "   - **Tópico recente:** Se houver um tópico recente claramente definido, comece por perguntar se ele ainda precisa de ajuda ou se gostaria de continuar a discussão sobre esse assunto. "
+        "   - **Interesses inferidos:** Tente identificar interesses ou temas recorrentes no histórico de conversa. Use esses insights para sugerir tópicos relacionados ou informações adicionais que possam ser do seu interesse."
+        "\n\n"
+        "2. **Pesquisa web para assuntos relacionados:** Se o histórico de conversa permitir a identificação de tópicos ou interesses, faça uma pesquisa web para encontrar notícias recentes, curiosidades ou desenvolvimentos relevantes sobre esses temas. "
+        "   - Apresente uma breve e intrigante informação encontrada, convidando o usuário a explorar mais."
+        "\n\n"
+        "3. **Criatividade e assuntos aleatórios:** Se não houver histórico de conversa substancial ou se os interesses do usuário não forem claros, use sua criatividade para puxar um assunto aleatório, mas que seja potencialmente interessante. "
+        "   - Você pode: "
+        "     - Mencionar uma notícia popular ou um evento atual (se relevante e não sensível). "
+        "     - Fazer uma pergunta curiosa sobre um tema geral (tecnologia, ciência, cultura, etc.). "
+        "     - Sugerir uma nova funcionalidade ou capacidade do Gemini (se aplicável). "
+        "\n\n"
+        "4. **Abertura geral:** Se as opções acima não se aplicarem ou não forem eficazes, ou se você precisar de uma alternativa mais genérica, envie uma saudação amigável perguntando simplesmente como pode ser útil hoje ou como o usuário está. "
+        "\n\n"
+        "5. **Tom e concisão:** Mantenha a mensagem concisa, natural e convidativa. Evite parecer robótico ou excessivamente formal. O objetivo é reaquecer a interação de forma orgânica. "
+        "   - Exemplo de saudação amigável: 'Oi! Já faz um tempinho que não conversamos. Como posso te ajudar hoje?'"
+    )
+
+    # Prompt de resumo; apenas {conversation} muda a cada chamada
+    SUMMARY_PROMPT_TEMPLATE = (
+        "Você é um assistente encarregado de resumir conversas. Abaixo está um trecho das interações do usuário. "
+        "Seu objetivo é criar um resumo conciso que capture os pontos principais, decisões tomadas, informações importantes compartilhadas (nomes, locais, datas, preferências, problemas, soluções), "
+        "e o sentimento geral ou intenção da conversa. O resumo será usado para dar contexto a futuras interações, use o minimo possível de palavras e seja vem objetivo.\n\n"
+        "CONVERSA:\n"
+        "{conversation}\n\n"
+    )
+
+    # Instrução fixa do refinamento de lembretes: vai primeiro, idêntica em toda chamada, e só a frase muda
+    REMINDER_REFINEMENT_INSTRUCTION = (
+        "Transforme a seguinte frase em um lembrete conciso e acionável. Extraia a tarefa principal. "
+        "Por exemplo, de 'r la pelas horas que preciso separar umas roupas pra minha sogra?' extraia 'separar umas roupas para a sogra'. "
+        "De 'me lembra de comprar leite horas' extraia 'comprar leite'.\n\n"
+    )
+
+    # Prompts fixos de descrição/transcrição de mídia por tipo de mensagem
+    MEDIA_DESCRIPTION_PROMPT = "Descreva este arquivo de forma concisa e detalhada e retorne apenas a descrição, nada além disso, nenhuma palavra a mais."
+    MEDIA_DESCRIPTION_PROMPTS = {
+        'audio': "Transcreva este audio, exatamente como está e me retorne apenas a transcriçao nenhuma palavra a mais, apenas a transcriçao.",
+        'voice': "Transcreva este audio, exatamente como está e me retorne apenas a transcriçao nenhuma palavra a mais, apenas a transcriçao.",
+        'document': "Descreva este arquivo pdf de forma concisa e objetiva. Anote todas as informações relevantes e me retorne apenas a descrição, nada além disso.",
+    }
+
+    # Respostas diretas para mensagens triviais (saudações, agradecimentos), sem chamar o Gemini.
+    # Cada regra casa com a mensagem inteira, para não interceptar pedidos reais.
+    QUICK_REPLY_RULES = [
+        (re.compile(r"^\s*(?:oi+e?|ol[aá]|opa|e a[ií]|bom dia|boa tarde|boa noite)[\s!.,]*$", re.IGNORECASE), [
+            "Olá! Como posso te ajudar?",
+            "Oi! Em que posso ajudar hoje?",
+        ]),
+        (re.compile(r"^\s*(?:muito\s+)?(?:obrigad[oa]|brigad[oa]|valeu|vlw)[\s!.,]*$", re.IGNORECASE), [
+            "Por nada! Se precisar de algo, é só chamar.",
+            "Disponha! Estou por aqui se precisar.",
+        ]),
+    ]
+
     # Reminder feature constants
-    # Lists for cleaning reminder content
-    leading_words_to_strip_normalized = [
+    # Word tables for cleaning reminder content
+    # Normalized once at class load (normalizar_texto), so lookups compare like with like
+    # Ordered: stripped one after another from the start of the payload
+    leading_words_to_strip_normalized = tuple(dict.fromkeys(normalizar_texto(w) for w in (
         "de", "para", "que", "sobre", "do", "da", "dos", "das",
         "me", "mim", "nos", "pra", "pro", "pros", "pras"
-    ]
+    )))
 
-    trailing_phrases_to_strip_normalized = [
+    # Membership-only: frozenset for O(1) lookups
+    trailing_phrases_to_strip_normalized = frozenset(normalizar_texto(w) for w in (
         "as", "às", "hs", "hrs", "horas", "hora",
         "em", "no", "na", "nos", "nas",
         "para", "de", "do", "da", "dos", "das",
         "pelas", "pelos", "a", "o", "amanha",
         "hoje", "la", "lá", "por", "volta",
         "depois", "antes", "proximo", "proxima"
-    ]
+    ))
+
+    # Content consisting of a single one of these words is not a valid reminder
+    filler_words_normalized = trailing_phrases_to_strip_normalized | frozenset(leading_words_to_strip_normalized)
+
+    # Single pattern with one optional "word " group per leading word, in table order:
+    # each word is stripped at most once, in the same order as the table
+    LEADING_WORDS_RE = re.compile(
+        r"^\s*" + "".join(r"(?:" + re.escape(word) + r"\s+)?" for word in leading_words_to_strip_normalized),
+        re.IGNORECASE
+    )
+
+    # Words dropped from long content extracted from Gemini's reply
+    REMINDER_CONTENT_STOPWORDS = frozenset(('o', 'a', 'de', 'para', 'que', 'lembrete', 'agendado', 'está', 'foi'))
 
     GEMINI_REMINDER_CONFIRMATION_REGEX = r"""(?ix)
 (
@@ -106,15 +285,59 @@ class WhatsAppGeminiBot:
     )
 )
 """
+    GEMINI_REMINDER_CONFIRMATION_RE = re.compile(GEMINI_REMINDER_CONFIRMATION_REGEX, re.IGNORECASE)
+    # Todo ramo do regex acima contém um destes radicais (minúsculos). Sem nenhum deles na resposta,
+    # o regex (que tem ramos iniciados por ".+?") nem precisa rodar.
+    GEMINI_REMINDER_CONFIRMATION_LITERALS = (
+        "lembr", "avis", "alerto", "notifico", "confirmado", "anot", "agend", "marc", "esquecer", "deixa"
+    )
+
+    # Padrões para extrair o conteúdo do lembrete da resposta do Gemini (em ordem de prioridade).
+    # Cada padrão vem com os literais (minúsculos) sem os quais ele não pode casar: se nenhum
+    # aparece no texto, o re.search é pulado.
+    # Só o conteúdo entre aspas é extraído: os padrões por palavra-chave ("lembrete ...", "X às Y")
+    # eram escritos com "\\s" e nunca casavam. Casando, pegariam palavras da própria confirmação
+    # ("agendado", "configurado") como conteúdo; sem match, vale o texto do usuário.
+    REMINDER_CONTENT_RES = [(literals, re.compile(p, re.IGNORECASE)) for literals, p in (
+        (('"',), r'"([^"]+)"'),
+        (("'",), r"'([^']+)'"),
+    )]
 
     REMINDER_STATE_AWAITING_CONTENT = "awaiting_content"
     REMINDER_STATE_AWAITING_DATETIME = "awaiting_datetime"
     REMINDER_STATE_AWAITING_RECURRENCE = "awaiting_recurrence" # Not actively used for asking, but for session state
     REMINDER_STATE_AWAITING_TIME = "awaiting_time"  # New state for when only time is missing
     REMINDER_STATE_AWAITING_CANCELLATION_CHOICE = "awaiting_cancellation_choice" # For cancellation flow
+    # Pergunta enviada por _ask_for_missing_reminder_info para cada estado da sessão de criação
+    _STATE_QUESTIONS = {
+        REMINDER_STATE_AWAITING_CONTENT: "Ok! Qual é o conteúdo do lembrete? (O que devo te lembrar?)",
+        REMINDER_STATE_AWAITING_DATETIME: "Entendido. Para quando devo agendar este lembrete? (Ex: amanhã às 10h, 25/12/2024 15:00, hoje 18:30)",
+        # Optional: not currently triggered unless logic changes
+        REMINDER_STATE_AWAITING_RECURRENCE: "Este lembrete deve se repetir? (Ex: diariamente, semanalmente, ou não)",
+    }
     REMINDER_SESSION_TIMEOUT_SECONDS = 300  # 5 minutes for pending reminder creation session
     REMINDER_CANCELLATION_SESSION_TIMEOUT_SECONDS = 300 # 5 minutes for pending cancellation session
-    REMINDER_CHECK_INTERVAL_SECONDS = 60 # Check for due reminders every 60 seconds
+    # Intervalos de recorrência: fixos (timedelta) ou em meses (relativedelta)
+    RECURRENCE_FIXED_STRIDES = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+    RECURRENCE_MONTH_STRIDES = {"monthly": 1, "yearly": 12}
+    # Variações para cada parte da mensagem de lembrete enviada ao usuário
+    REMINDER_SAUDACOES = ("Olá", "Ei", "Oii", "Oie", "Oi", "E aí")
+    REMINDER_MENSAGENS = ("estou passando para te lembrar", "só um lembrete rápido", "passando para avisar", "queria te lembrar", "lembrete importante")
+    REMINDER_INTRODUCOES = ("Não esqueça de", "Lembre-se de", "Por favor, não esqueça de")
+    REMINDER_DESPEDIDAS = ("Até logo", "Até mais", "Até breve", "Tchau")
+    REMINDER_EMOJIS = ("🙂", "😊", "👍", "🌟", "✨", "🙌", "⏰")
+    # Todas as combinações montadas uma vez (6*5*3*4*7 = 2520); no envio basta escolher uma e preencher o conteúdo
+    REMINDER_MESSAGE_TEMPLATES = tuple(
+        f"{saudacao}, {mensagem}!\n\n{introducao}: {{content}}\n\n{despedida} {emoji}"
+        for saudacao, mensagem, introducao, despedida, emoji in product(
+            REMINDER_SAUDACOES, REMINDER_MENSAGENS, REMINDER_INTRODUCOES, REMINDER_DESPEDIDAS, REMINDER_EMOJIS)
+    )
+    DUE_REMINDER_FIELDS = ["chat_id", "content", "recurrence", "original_message_id",
+                           "reminder_time_utc", "original_hour_utc", "original_minute_utc"]
+    REMINDER_SEND_RETRY_SECONDS = 60 # Espera antes de reenviar um lembrete cujo envio falhou
+    # O heap é recarregado do Firestore periodicamente: lembretes gravados fora deste processo
+    # (outra instância durante um deploy, console, outros serviços) entram no máximo após esse intervalo
+    REMINDER_HEAP_RELOAD_SECONDS = 300
     TARGET_TIMEZONE_NAME = 'America/Sao_Paulo'
 
     REMINDER_CONFIRMATION_TEMPLATES = [
@@ -124,6 +347,25 @@ class WhatsAppGeminiBot:
         "Perfeito! Lembrete definido para {datetime_str}:\n\n*{content}*",
         "Confirmado! Agendei seu lembrete para {datetime_str}:\n\n*{content}*"
     ]
+    # Templates já divididos em (literal, campo) na carga da classe, sem reinterpretar o formato a cada uso
+    REMINDER_CONFIRMATION_PARTS = [
+        tuple((literal, field_name) for literal, field_name, _, _ in string.Formatter().parse(template))
+        for template in REMINDER_CONFIRMATION_TEMPLATES
+    ]
+
+    REMINDER_REQUEST_KEYWORDS_REGEX = r"""(?ix)
+    \b(?:
+        (?:me\s+)?(?:lembr(?:e|a|ar)|avis(?:e|a|ar))(?:-me)?      # "me lembra", "lembre-me", "me avisa"
+        (?:\s+(?:de|que|para|pra|sobre))?                       # Optional: "de", "que"...
+    |
+        (?:cri(?:e|a|ar)|agend(?:e|a|ar)|marc(?:e|a|ar)|coloc(?:a|ar|que))\s+
+        (?:um\s+)?lembrete(?:\s+(?:de|para|pra|sobre))?          # "cria um lembrete de"
+    |
+        n[aã]o\s+(?:me\s+)?deix(?:e|a)\s+(?:eu\s+)?esquecer
+        (?:\s+(?:de|que))?                                      # "não me deixe esquecer de"
+    )\b
+"""
+    REMINDER_REQUEST_KEYWORDS_RE = re.compile(REMINDER_REQUEST_KEYWORDS_REGEX, re.IGNORECASE)
 
     REMINDER_CANCEL_KEYWORDS_REGEX = r"""(?ix)
     (?:cancelar|cancela|excluir|exclui|remover|remove)\s+
@@ -134,13 +376,55 @@ class WhatsAppGeminiBot:
     (?:cancelar|cancela|excluir|exclui|remover|remove)\s+
     todos\s+(?:os\s+)?(?:meus\s+)?lembretes
 """
+    REMINDER_CANCEL_KEYWORDS_RE = re.compile(REMINDER_CANCEL_KEYWORDS_REGEX, re.IGNORECASE)
+    # Toda alternativa do regex acima começa por um destes radicais; sem nenhum deles não há match
+    REMINDER_CANCEL_VERB_STEMS = ("cancel", "exclu", "remov")
+    CANCEL_ALL_RE = re.compile(r'\btodos\b', re.IGNORECASE)
+
+    # Respostas curtas do usuário nas sessões pendentes (comparadas com o texto normalizado)
+    SESSION_CANCEL_WORDS = frozenset(("cancelar", "cancela", "nenhum", "nao"))
+    SESSION_YES_WORDS = frozenset(("sim", "1", "s"))
+    REMINDER_CREATION_CANCEL_WORDS = frozenset(("cancelar", "cancela"))
+
+    # Palavras que indicam um dia (não só um horário) no texto a ser parseado
+    WORD_TOKEN_RE = re.compile(r'\w+')
+    DAY_WORDS_EN = frozenset(('today', 'tomorrow', 'next', 'monday', 'tuesday', 'wednesday',
+                              'thursday', 'friday', 'saturday', 'sunday'))
+    DAY_WORDS_PT = frozenset(('hoje', 'amanha', 'amanhã', 'proximo', 'próximo', 'segunda', 'terça', 'quarta',
+                              'quinta', 'sexta', 'sabado', 'sábado', 'domingo'))
+    DAY_MONTH_FRAGMENT_RE = re.compile(r'\d{1,2}[-/]\d{1,2}') # "25/12", "25-12"
+
+    # "as N" só é horário com marcador de hora ("h", "horas") ou quando o número fecha a expressão (fim do texto,
+    # pontuação, preposição, dia ou data a seguir). "as 3 contas" é artigo + número, não 03:00.
+    AS_HOUR_END_LOOKAHEAD = (
+        r'(?=\s*(?:h|hs|hrs|horas?)\b|\s*(?:$|[.,;:!?)])|\s+\d{4}-\d{2}-\d{2}\b|'
+        r'\s+(?:de|da|do|das|dos|para|pra|pro|e|que|sobre|em|no|na|hoje|amanh[ãa]|depois|next|'
+        r'monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b)'
+    )
+
+    # Caminho rápido para data/hora na resposta do Gemini ("amanhã às 10h"), antes do dateutil fuzzy
+    GEMINI_TIME_RE = re.compile(r'\b(?:às|as)\s*(\d{1,2})(?:\s*(?::|h)\s*(\d{2}))?(?!\d)' + AS_HOUR_END_LOOKAHEAD, re.IGNORECASE)
+    GEMINI_DAY_OFFSET_RE = re.compile(r'\b(depois de amanhã|amanhã|hoje)\b', re.IGNORECASE)
+    GEMINI_DAY_OFFSETS = {"hoje": 0, "amanhã": 1, "depois de amanhã": 2}
+    # Datas explícitas ("25/12", "dia 7", "7 de junho", dias da semana) continuam indo para o dateutil
+    GEMINI_EXPLICIT_DATE_RE = re.compile(
+        r'\d{1,2}[-/]\d{1,2}|\bdia\s+\d{1,2}\b|\b\d{1,2}\s+de\s+[a-zç]+|'
+        r'\b(?:segunda|terça|terca|quarta|quinta|sexta|sábado|sabado|domingo)\b',
+        re.IGNORECASE
+    )
 
     PORTUGUESE_DAYS_FOR_PARSING = {
         "segunda": "monday", "terça": "tuesday", "quarta": "wednesday",
         "quinta": "thursday", "sexta": "friday", "sábado": "saturday", "domingo": "sunday",
         "segunda-feira": "monday", "terça-feira": "tuesday", "quarta-feira": "wednesday",
-        "quinta-feira": "thursday", "sexta-feira": "friday"
+        "quinta-feira": "thursday", "sexta-feira": "friday",
+        "terca": "tuesday", "sabado": "saturday", "terca-feira": "tuesday" # Escritos sem acento
     }
+    # Todos os dias em uma única alternação (mais longos primeiro: "segunda-feira" antes de "segunda")
+    PORTUGUESE_DAYS_RE = re.compile(
+        r'\b(' + '|'.join(re.escape(day) for day in sorted(PORTUGUESE_DAYS_FOR_PARSING, key=len, reverse=True)) + r')\b',
+        re.IGNORECASE
+    )
 
     MONTHLY_DAY_SPECIFIC_REGEX = r"""(?ix)
     \b(?:
@@ -153,6 +437,21 @@ class WhatsAppGeminiBot:
         (?:todo\s+m[eê]s|mensalmente)\s+dia\s+(\d{1,2}) # "todo mes dia 10"
     )\b
     """
+    MONTHLY_DAY_SPECIFIC_RE = re.compile(MONTHLY_DAY_SPECIFIC_REGEX)
+
+    # Caminho rápido para o texto já limpo por _clean_text_for_parsing ("2024-06-07 ... 10:00:00 tarefa")
+    FAST_DATE_RE = re.compile(r'\b(\d{4})-(\d{2})-(\d{2})\b')
+    FAST_TIME_RE = re.compile(r'\b(\d{1,2}):(\d{2})(?::(\d{2}))?\b')
+    DATEUTIL_PARSER_INFO = dateutil_parser.parserinfo() # Vocabulário do dateutil (meses, dias, am/pm...)
+
+    # Substituições de _clean_text_for_parsing (pré-compiladas)
+    PARSE_HOJE_RE = re.compile(r'\bhoje\b', re.IGNORECASE)
+    PARSE_AMANHA_RE = re.compile(r'\bamanh[ãa]\b', re.IGNORECASE)
+    PARSE_DEPOIS_DE_AMANHA_RE = re.compile(r'\bdepois de amanh[ãa]\b', re.IGNORECASE)
+    PARSE_HOUR_E_MINUTE_RE = re.compile(r'(\d{1,2})\s*e\s*(\d{1,2})') # "HH e MM"
+    PARSE_AS_HOUR_RE = re.compile(r'\b(?:as|às)\s+(\d{1,2})(?!\d|:)\b' + AS_HOUR_END_LOOKAHEAD, re.IGNORECASE) # "as HH"
+    PARSE_HHMM_WITHOUT_SECONDS_RE = re.compile(r'(\d{1,2}:\d{2})(?!:\d{2})')
+    PARSE_PROXIMO_RE = re.compile(r'pr[óo]xim[ao]\s+', re.IGNORECASE) # "próxima segunda" -> "next monday"
 
     RECURRENCE_KEYWORDS = {
         "diariamente": "daily", "todo dia": "daily", "todos os dias": "daily",
@@ -160,30 +459,168 @@ class WhatsAppGeminiBot:
         "mensalmente": "monthly", "todo mes": "monthly", "todos os meses": "monthly", # "mes" without accent for easier regex
         "anualmente": "yearly", "todo ano": "yearly", "todos os anos": "yearly"
     }
+    # Mesmas frases já normalizadas (calculado uma vez, na carga da classe)
+    RECURRENCE_KEYWORDS_NORMALIZED = {normalizar_texto(phrase): key for phrase, key in RECURRENCE_KEYWORDS.items()}
+    # Todas as frases de recorrência em uma única alternação (mais longas primeiro)
+    RECURRENCE_PHRASES_RE = re.compile(
+        r'\b(?:' + '|'.join(re.escape(phrase) for phrase in sorted(RECURRENCE_KEYWORDS, key=len, reverse=True)) + r')\b',
+        re.IGNORECASE
+    )
+
+    CONTEXT_HISTORY_LIMIT = 25 # Mensagens não resumidas enviadas ao Gemini; 0 = apenas o resumo
+    SUMMARY_CHUNK_MESSAGES = 25 # Mensagens não resumidas necessárias para gerar um novo trecho de resumo
+    MAX_SUMMARY_CHARS = 4000 # Acima disso o resumo acumulado é reescrito pelo Gemini em vez de só concatenado
+    SUMMARY_CACHE_MAX_ENTRIES = 500 # Quantidade máxima de resumos mantidos em memória (LRU)
+    SUMMARY_CACHE_TTL_SECONDS = 900 # Resumo em memória é relido do Firestore após 15 minutos
+    PROCESSED_IDS_CACHE_MAX_ENTRIES = 10000 # IDs de mensagens já processadas mantidos em memória (LRU)
+    HISTORY_CACHE_MAX_CHATS = 500 # Chats com histórico recente mantido em memória (LRU)
+    FIRESTORE_BATCH_MAX_WRITES = 500 # Limite de escritas por WriteBatch do Firestore
+    MEDIA_PROCESSING_MAX_WORKERS = 8 # Mídias de um mesmo lote baixadas/descritas em paralelo
+    MEDIA_INLINE_MAX_BYTES = 15 * 1024 * 1024 # Acima disso a mídia vai pela Files API (requisição inline limitada a 20 MB)
+    MEDIA_DOWNLOAD_CHUNK_BYTES = 64 * 1024 # Mídias são baixadas em blocos; as grandes vão direto para um arquivo temporário
+    MEDIA_FILE_ACTIVE_TIMEOUT_SECONDS = 300 # Espera máxima até um arquivo da Files API sair de PROCESSING
+    MEDIA_FILE_POLL_INTERVAL_SECONDS = 2
+    REFINED_CONTENT_CACHE_MAX_ENTRIES = 2048 # Conteúdos de lembrete já refinados pelo Gemini (LRU)
+    # Conteúdo curto e sem "enchimento" (ex.: "comprar leite") já é um lembrete conciso: não vai ao Gemini
+    REMINDER_REFINEMENT_SKIP_MAX_WORDS = 6
+    REMINDER_REFINEMENT_FILLER_WORDS = frozenset({"lembra", "lembrar", "lembrete", "favor", "pelas", "horas"})
+    MAX_PENDING_SESSIONS = 10000 # Por tipo de sessão (lembrete/cancelamento); as mais antigas são descartadas
+    GEMINI_CACHE_TTL_SECONDS = 3600 # Validade do cache de contexto (system_instruction) no Gemini
+    GEMINI_CACHE_REFRESH_MARGIN_SECONDS = 300 # Renova o cache com essa antecedência antes de expirar
+
+    @cached_property
+    def db(self) -> firestore.Client:
+        """Cliente do Firestore, criado no primeiro uso (a busca de credenciais fica fora da inicialização)."""
+        return firestore.Client(project="voola-ai") # Seu projeto
 
     def __init__(self):
         self.reload_env()
-        self.db = firestore.Client(project="voola-ai") # Seu projeto
         self.pending_timeout = 30  # Timeout para mensagens pendentes (em segundos)
 
         # FORÇAR o uso do timezone de São Paulo independente do servidor
-        import pytz
-        self.target_timezone = pytz.timezone('America/Sao_Paulo')
+        # (zoneinfo: sem o localize()/normalize() do pytz, e datetime.now(tz) mais barato)
+        self.target_timezone = ZoneInfo(self.TARGET_TIMEZONE_NAME)
 
         # Verificar e log do timezone atual
-        logger.info(f"=== INICIALIZAÇÃO TIMEZONE ===")
-        logger.info(f"Sistema: {datetime.now().astimezone().tzinfo}")
-        logger.info(f"Target: {self.target_timezone}")
-        logger.info(f"Hora SP: {datetime.now(self.target_timezone)}")
-        logger.info(f"Hora UTC: {datetime.now(timezone.utc)}")
-        logger.info(f"=============================")
+        logger.info("=== INICIALIZAÇÃO TIMEZONE ===")
+        logger.info("Sistema: %s", datetime.now().astimezone().tzinfo)
+        logger.info("Target: %s", self.target_timezone)
+        logger.info("Hora SP: %s", datetime.now(self.target_timezone))
+        logger.info("Hora UTC: %s", datetime.now(timezone.utc))
+        logger.info("=============================")
 
         if not all([self.whapi_api_key, self.gemini_api_key]):
             raise ValueError("Chaves API não configuradas no .env")
 
+        # Whapi desconecta acima de ~20 envios/s; todos os envios passam por esta fila
+        self._whapi_queue = DelayQueue(burst_limit=18, time_limit_ms=1000)
+        # Sessão HTTP reaproveitada (keep-alive) para evitar novo handshake TLS a cada chamada à Whapi
+        self._whapi_session = requests.Session()
+        whapi_adapter = HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=50,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+        )
+        self._whapi_session.mount("https://", whapi_adapter)
+        # POST de mensagens só é repetido em 429 (a mensagem não foi aceita), respeitando Retry-After;
+        # 5xx num POST pode já ter entregue a mensagem, então não repete para não duplicar
+        # Só a thread da DelayQueue envia, e sempre para o mesmo host: uma conexão keep-alive basta
+        whapi_send_adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=1,
+            max_retries=Retry(total=4, backoff_factor=0.5, status_forcelist=[429],
+                              allowed_methods=frozenset(["POST"]), respect_retry_after_header=True,
+                              raise_on_status=False)
+        )
+        self._whapi_session.mount("https://gate.whapi.cloud/messages/", whapi_send_adapter)
+        self._whapi_session.headers.update({
+            "Authorization": f"Bearer {self.whapi_api_key}",
+            "Accept": "application/json"
+        })
+
         self.setup_apis()
-        self.pending_reminder_sessions: Dict[str, Dict[str, Any]] = {}
-        self.pending_cancellation_sessions: Dict[str, Dict[str, Any]] = {}
+        # Sessões em ordem de última interação (mais antiga primeiro), limitadas a MAX_PENDING_SESSIONS.
+        # Ficam no processo: o deploy roda um único worker do gunicorn (ver Dockerfile)
+        self.pending_reminder_sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.pending_cancellation_sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Webhook e thread do bot acessam as sessões: leituras/remoções usam get()/pop() (atômicos),
+        # e o que é verificar-e-agir (varredura de expiradas) acontece sob este lock
+        self._sessions_lock = threading.Lock()
+        # Cache LRU do último resumo por chat_id: (time.monotonic() da leitura/escrita, resumo).
+        # Evita reler conversation_summaries a cada mensagem; expira após SUMMARY_CACHE_TTL_SECONDS
+        self._summary_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._summary_cache_lock = threading.Lock()
+        # Conteúdo original -> conteúdo refinado pelo Gemini (o prompt não depende do chat)
+        self._refined_content_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._refined_content_lock = threading.Lock()
+        self._refinement_skipped_count = 0 # Contadores para acompanhar a taxa de acerto do atalho
+        self._refinement_gemini_count = 0
+        # IDs de mensagens sabidamente processadas, evita a leitura em processed_messages
+        self._processed_ids_cache: "OrderedDict[str, float]" = OrderedDict()
+        self._processed_ids_lock = threading.Lock()
+        # Histórico não resumido por chat: (timestamp da última mensagem lida, mensagens, profundidade)
+        self._history_cache: "OrderedDict[str, Tuple[datetime, List[Dict[str, Any]], int]]" = OrderedDict()
+        self._history_cache_lock = threading.Lock()
+        # Geração do histórico por chat, incrementada a cada invalidação: uma leitura iniciada antes dela não volta ao cache
+        self._history_generation: Dict[str, int] = {}
+        # Resumos rodam em segundo plano, fora do caminho crítico da resposta
+        self._summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="Summarizer")
+        self._summary_in_flight = set()
+        self._summary_in_flight_lock = threading.Lock()
+        # Migração de last_reengagement_attempt em contextos antigos (ver _backfill_last_reengagement_attempt)
+        self._reengagement_backfill_done = False
+        # Chats pendentes de um mesmo ciclo processados em paralelo; 'processing' (transacional) evita duplicidade
+        self._pending_chats_executor = ThreadPoolExecutor(max_workers=self.PENDING_CHATS_MAX_WORKERS,
+                                                          thread_name_prefix="PendingChat")
+        # Escritas independentes no Firestore disparadas em paralelo no recebimento de mensagens
+        self._io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="FirestoreIO")
+        # Heap (reminder_time_utc, reminder_id) dos lembretes ativos: a query de lembretes devidos só roda
+        # quando o primeiro da fila vence. Carregado do Firestore na primeira varredura, após erro e a cada
+        # REMINDER_HEAP_RELOAD_SECONDS (time.monotonic() da última carga; None = precisa carregar).
+        self._reminder_heap: List[Tuple[datetime, str]] = []
+        self._reminder_heap_loaded_at: Optional[float] = None
+        self._reminder_heap_lock = threading.Lock()
+
+    def _cache_summary(self, chat_id: str, summary: str):
+        """Atualiza o cache LRU de resumos, descartando o mais antigo quando cheio."""
+        with self._summary_cache_lock:
+            self._summary_cache[chat_id] = (time.monotonic(), summary)
+            self._summary_cache.move_to_end(chat_id)
+            while len(self._summary_cache) > self.SUMMARY_CACHE_MAX_ENTRIES:
+                self._summary_cache.popitem(last=False)
+
+    def _get_previous_summary(self, chat_id: str, cache: Optional[RequestCache] = None) -> str:
+        """Retorna o resumo atual do chat, usando o cache em memória antes de ler o Firestore."""
+        with self._summary_cache_lock:
+            cached_entry = self._summary_cache.get(chat_id)
+            if cached_entry is not None:
+                if time.monotonic() - cached_entry[0] < self.SUMMARY_CACHE_TTL_SECONDS:
+                    self._summary_cache.move_to_end(chat_id)
+                    return cached_entry[1]
+                del self._summary_cache[chat_id] # Expirado: relê do Firestore
+        summary_ref = self.db.collection("conversation_summaries").document(chat_id)
+        summary_doc = cache.get_or_fetch(summary_ref) if cache else summary_ref.get()
+        previous_summary = summary_doc.get("summary") if summary_doc.exists else ""
+        self._cache_summary(chat_id, previous_summary)
+        return previous_summary
+
+    def _schedule_summarization(self, chat_id: str):
+        """Agenda _summarize_chat_history_if_needed em segundo plano, no máximo uma execução por chat.
+           Não recebe o RequestCache da interação: ele não é thread-safe e só vale até o fim dela.
+        """
+        with self._summary_in_flight_lock:
+            if chat_id in self._summary_in_flight:
+                return
+            self._summary_in_flight.add(chat_id)
+
+        def run_summarization():
+            try:
+                self._summarize_chat_history_if_needed(chat_id)
+            finally:
+                with self._summary_in_flight_lock:
+                    self._summary_in_flight.discard(chat_id)
+
+        self._summary_executor.submit(run_summarization)
 
     def _get_pending_messages(self, chat_id: str) -> Dict[str, Any]:
         """Obtém mensagens pendentes para um chat"""
@@ -199,32 +636,36 @@ class WhatsAppGeminiBot:
         message_payload deve conter: type, content, original_caption, mimetype, timestamp, message_id
         """
         doc_ref = self.db.collection("pending_messages").document(chat_id)
-        # Usar transação para garantir consistência ao adicionar mensagens
-        @firestore.transactional
-        def update_in_transaction(transaction, doc_ref, new_message, user_from_name):
-            snapshot = doc_ref.get(transaction=transaction)
-            existing_data = snapshot.to_dict() if snapshot.exists else {}
-            
-            messages = existing_data.get('messages', [])
-            messages.append(new_message)
-
-            transaction.set(doc_ref, {
-                'messages': messages,
-                'last_update': datetime.now(timezone.utc), # Sempre atualiza o timestamp do documento
-                'processing': existing_data.get('processing', False),
-                'from_name': user_from_name
-            }, merge=True) # Merge para não sobrescrever 'processing' se já estiver lá
-
-        update_in_transaction(self.db.transaction(), doc_ref, message_payload, from_name)
+        # ArrayUnion é atômico no campo, dispensando a transação (leitura + escrita).
+        # O message_id no payload garante que mensagens idênticas não sejam deduplicadas.
+        update_data = {
+            'messages': firestore.ArrayUnion([message_payload]),
+            'last_update': firestore.SERVER_TIMESTAMP, # Sempre atualiza o timestamp do documento
+            'from_name': from_name
+        }
+        try:
+            doc_ref.update(update_data) # Não toca em 'processing' se já estiver lá
+        except NotFound:
+            # Primeiro pendente do chat: a busca por pendentes filtra por processing == False.
+            # create() falha se outro webhook criou o documento nesse meio tempo; aí basta o update.
+            try:
+                doc_ref.create({**update_data, 'processing': False})
+            except AlreadyExists:
+                doc_ref.update(update_data)
 
     def _detect_reminder_in_gemini_response(self, response_text: str) -> Dict[str, Any]:
         """
         Detecta se a resposta do Gemini indica que um lembrete deve ser criado.
         Retorna detalhes extraídos se encontrado.
         """
+        # Filtro barato por substring antes do regex robusto
+        response_lower = response_text.lower()
+        if not any(literal in response_lower for literal in self.GEMINI_REMINDER_CONFIRMATION_LITERALS):
+            return {"found": False}
+
         # Usar regex robusto ao invés de lista simples
-        if re.search(self.GEMINI_REMINDER_CONFIRMATION_REGEX, response_text, re.IGNORECASE):
-            logger.info(f"Padrão de confirmação de lembrete detectado na resposta do Gemini")
+        if self.GEMINI_REMINDER_CONFIRMATION_RE.search(response_text):
+            logger.info("Padrão de confirmação de lembrete detectado na resposta do Gemini")
             return self._extract_reminder_from_gemini_response(response_text)
 
         return {"found": False}
@@ -240,41 +681,36 @@ class WhatsAppGeminiBot:
             "recurrence": "none"
         }
 
-        # Padrões melhorados para extrair conteúdo
-        content_patterns = [
-            # Entre aspas
-            r'"([^"]+)"',
-            r"'([^']+)'",
-            # Após palavras-chave de lembrete
-            r'lembrete\\s+(?:de\\s+|para\\s+|sobre\\s+)?([^\\.!?,]+?)(?:\\s+(?:às|as|para|hoje|amanhã|em)\\s+|\\.|\\!|\\?|,|$)',
-            r'(?:lembrar|avisar|alertar)\\s+(?:de\\s+|para\\s+|sobre\\s+|que\\s+)?([^\\.!?,]+?)(?:\\s+(?:às|as|para|hoje|amanhã|em)\\s+|\\.|\\!|\\?|,|$)',
-            # Padrão específico para "X às Y"
-            r'(?:para\\s+)?(.+?)\\s+(?:às|as)\\s+\\d{1,2}(?::\\d{2})?',
-            # Conteúdo antes de indicadores de tempo
-            r'(?:de\\s+|para\\s+)?(.+?)\\s+(?:hoje|amanhã|depois)',
-        ]
-
-        for pattern in content_patterns:
-            match = re.search(pattern, response_text, re.IGNORECASE)
+        # Padrões melhorados para extrair conteúdo (pré-compilados em REMINDER_CONTENT_RES)
+        response_lower = response_text.lower()
+        for literals, pattern in self.REMINDER_CONTENT_RES:
+            if not any(literal in response_lower for literal in literals):
+                continue # O padrão não pode casar; evita varrer o texto à toa
+            match = pattern.search(response_text)
             if match:
                 content = match.group(1).strip()
-                content = re.sub(r'\\s+', ' ', content)  # Normalizar espaços
-                stopwords = ['o', 'a', 'de', 'para', 'que', 'lembrete', 'agendado', 'está', 'foi']
+                content = _WHITESPACE_RE.sub(' ', content)  # Normalizar espaços
                 content_words = content.split()
                 if len(content_words) > 3:
-                    content_words = [w for w in content_words if w.lower() not in stopwords]
+                    content_words = [w for w in content_words if w.lower() not in self.REMINDER_CONTENT_STOPWORDS]
                     content = ' '.join(content_words)
 
                 if content and len(content) > 2:
                     details["content"] = content
-                    logger.debug(f"Conteúdo extraído da resposta do Gemini: '{content}'")
+                    logger.debug("Conteúdo extraído da resposta do Gemini: '%s'", content)
                     break
         
-        # Extrair data/hora usando dateutil.parser diretamente na resposta do Gemini
+        # Extrair data/hora: primeiro pelo caminho rápido (hora + hoje/amanhã), senão dateutil.parser
         parsed_dt = None
         try:
             now_local = datetime.now(self.target_timezone)
-            
+
+            parsed_dt = self._fast_parse_gemini_datetime(response_text, now_local)
+            if parsed_dt:
+                details["datetime_obj"] = parsed_dt.astimezone(timezone.utc)
+                logger.debug("Data/hora extraída da RESPOSTA DO GEMINI (caminho rápido): %s (UTC: %s)", parsed_dt, details['datetime_obj'])
+                return self._detect_gemini_recurrence(response_text, details)
+
             # Não aplicar _clean_text_for_parsing aqui, pois a resposta do Gemini
             # pode ter formatos de data (ex: "7 de junho") que o parser pode entender
             # e a limpeza do _clean_text_for_parsing (voltada para input do usuário) poderia interferir.
@@ -286,38 +722,98 @@ class WhatsAppGeminiBot:
             )
 
             if parsed_dt_naive.tzinfo is None:
-                parsed_dt = self.target_timezone.localize(parsed_dt_naive)
+                parsed_dt = parsed_dt_naive.replace(tzinfo=self.target_timezone)
             else:
                 parsed_dt = parsed_dt_naive.astimezone(self.target_timezone)
 
             if parsed_dt:
                 details["datetime_obj"] = parsed_dt.astimezone(timezone.utc)
-                logger.debug(f"Data/hora extraída da RESPOSTA DO GEMINI (via dateutil): {parsed_dt} (UTC: {details['datetime_obj']})")
+                logger.debug("Data/hora extraída da RESPOSTA DO GEMINI (via dateutil): %s (UTC: %s)", parsed_dt, details['datetime_obj'])
 
         except (ValueError, TypeError, dateutil_parser.ParserError) as e:
-            logger.debug(f"Não foi possível extrair data/hora da resposta do Gemini ('{response_text}') com dateutil_parser: {e}. datetime_obj permanecerá None.")
+            logger.debug("Não foi possível extrair data/hora da resposta do Gemini ('%s') com dateutil_parser: %s. datetime_obj permanecerá None.", response_text, e)
             # Se datetime_obj for None, a lógica em _process_pending_messages
             # recorrerá a _extract_reminder_details_from_text(USER_INPUT) como fallback.
         
-        # Detectar recorrência (lógica original mantida)
-        for phrase, recurrence_type in self.RECURRENCE_KEYWORDS.items():
-            if normalizar_texto(phrase) in normalizar_texto(response_text):
+        return self._detect_gemini_recurrence(response_text, details)
+
+    def _fast_parse_gemini_datetime(self, response_text: str, now_local: datetime) -> Optional[datetime]:
+        """
+        Interpreta "às HH[:MM]" e "hoje/amanhã/depois de amanhã" por regex, sem o dateutil fuzzy.
+        Retorna None (para cair no dateutil) se nada for encontrado ou se houver uma data explícita.
+        """
+        time_match = self.GEMINI_TIME_RE.search(response_text)
+        day_match = self.GEMINI_DAY_OFFSET_RE.search(response_text)
+        if not (time_match or day_match) or self.GEMINI_EXPLICIT_DATE_RE.search(response_text):
+            return None
+
+        hour, minute = 9, 0 # Mesmo horário padrão usado com o dateutil
+        if time_match:
+            hour = int(time_match.group(1))
+            minute = int(time_match.group(2) or 0)
+            if hour > 23 or minute > 59:
+                return None
+
+        target_date = now_local.date()
+        if day_match:
+            target_date += timedelta(days=self.GEMINI_DAY_OFFSETS[day_match.group(1).lower()])
+
+        return datetime(target_date.year, target_date.month, target_date.day, hour, minute, tzinfo=self.target_timezone)
+
+    def _detect_gemini_recurrence(self, response_text: str, details: Dict[str, Any]) -> Dict[str, Any]:
+        """Detecta recorrência na resposta do Gemini (texto e frases normalizados uma única vez)."""
+        normalized_response = normalizar_texto(response_text)
+        for normalized_phrase, recurrence_type in self.RECURRENCE_KEYWORDS_NORMALIZED.items():
+            if normalized_phrase in normalized_response:
                 details["recurrence"] = recurrence_type
-                logger.debug(f"Recorrência detectada na resposta do Gemini: {recurrence_type}")
+                logger.debug("Recorrência detectada na resposta do Gemini: %s", recurrence_type)
                 break
-            
+
         return details
 
 
-    def _delete_pending_messages(self, chat_id: str):
-        """Remove mensagens processadas"""
+    def _delete_pending_messages(self, chat_id: str, processed_message_ids: Optional[List[str]] = None):
+        """
+        Remove mensagens processadas. Com processed_message_ids, remove só essas (em transação): mensagens que
+        chegaram durante o processamento continuam pendentes, com 'processing' liberado para o próximo ciclo.
+        """
         doc_ref = self.db.collection("pending_messages").document(chat_id)
-        doc_ref.delete()
+        if processed_message_ids is None:
+            doc_ref.delete()
+            return
+
+        processed_ids = set(processed_message_ids)
+
+        @firestore.transactional
+        def remove_processed(transaction, doc_ref_trans):
+            snapshot = doc_ref_trans.get(transaction=transaction)
+            if not snapshot.exists:
+                return
+            remaining = [msg for msg in (snapshot.get('messages') or []) if msg.get('message_id') not in processed_ids]
+            if remaining:
+                transaction.update(doc_ref_trans, {'messages': remaining, 'processing': False})
+            else:
+                transaction.delete(doc_ref_trans)
+
+        remove_processed(self.db.transaction(), doc_ref)
+
+    def _remember_processed_id(self, message_id: str):
+        """Registra o ID no cache LRU de mensagens processadas."""
+        with self._processed_ids_lock: # Também chamado pelas threads de _io_executor
+            self._processed_ids_cache[message_id] = time.time()
+            self._processed_ids_cache.move_to_end(message_id)
+            while len(self._processed_ids_cache) > self.PROCESSED_IDS_CACHE_MAX_ENTRIES:
+                self._processed_ids_cache.popitem(last=False)
 
     def _message_exists(self, message_id: str) -> bool:
-        """Verifica se a mensagem já foi processada (Firestore)"""
+        """Verifica se a mensagem já foi processada (cache em memória, depois Firestore)"""
+        if message_id in self._processed_ids_cache:
+            return True
         doc_ref = self.db.collection("processed_messages").document(message_id)
-        return doc_ref.get().exists
+        exists = doc_ref.get(field_paths=[]).exists # Projeção vazia: só metadados, sem os campos do documento
+        if exists:
+            self._remember_processed_id(message_id)
+        return exists
 
     def _deactivate_reminder_in_db(self, reminder_id: str) -> bool:
         """Marks a specific reminder as inactive in Firestore and adds a cancelled_at timestamp."""
@@ -331,6 +827,27 @@ class WhatsAppGeminiBot:
         except Exception as e:
             logger.error(f"Erro ao desativar lembrete {reminder_id}: {e}", exc_info=True)
             return False
+
+    def _deactivate_reminders_in_db(self, reminder_ids: List[str]) -> int:
+        """Desativa vários lembretes com um commit por lote (no máximo 500 escritas cada). Retorna quantos foram desativados."""
+        deactivated = 0
+        for start in range(0, len(reminder_ids), self.FIRESTORE_BATCH_MAX_WRITES):
+            chunk = reminder_ids[start:start + self.FIRESTORE_BATCH_MAX_WRITES]
+            batch = self.db.batch()
+            for reminder_id in chunk:
+                batch.update(self.db.collection("reminders").document(reminder_id), {
+                    "is_active": False,
+                    "cancelled_at": firestore.SERVER_TIMESTAMP
+                })
+            try:
+                batch.commit()
+                deactivated += len(chunk)
+            except Exception as e:
+                # O lote é atômico: se um documento falhar (ex.: já removido), tenta um a um para cancelar os demais
+                logger.warning(f"Falha ao desativar {len(chunk)} lembretes em lote ({e}); tentando individualmente.")
+                deactivated += sum(1 for reminder_id in chunk if self._deactivate_reminder_in_db(reminder_id))
+        return deactivated
+
     def _get_active_reminders(self, chat_id: str, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
         """Fetches active reminders for a user, ordered by time.
            If limit is None, fetches all active reminders.
@@ -341,6 +858,7 @@ class WhatsAppGeminiBot:
                 .where(filter=FieldFilter("chat_id", "==", chat_id))
                 .where(filter=FieldFilter("is_active", "==", True))
                 .order_by("reminder_time_utc", direction=firestore.Query.ASCENDING)
+                .select(["reminder_time_utc", "content", "recurrence", "chat_id", "is_active"]) # Campos usados pelos chamadores
             )
             if limit is not None:
                 query = query_base.limit(limit)
@@ -365,70 +883,150 @@ class WhatsAppGeminiBot:
             logger.error(f"Erro ao buscar lembretes ativos para {chat_id}: {e}", exc_info=True)
             return []
 
-    def _save_message(self, message_id: str, chat_id: str, text: str, from_name: str, msg_type: str = "text"):
-        """Armazena a mensagem no Firestore"""
+    def _save_message(self, message_id: str, chat_id: str, text: str, from_name: str, msg_type: str = "text", batch=None):
+        """Armazena a mensagem no Firestore. Se batch for informado, apenas adiciona a escrita ao lote."""
         doc_ref = self.db.collection("processed_messages").document(message_id)
-        doc_ref.set({
+        message_data = {
             "chat_id": chat_id,
             "text_content": text, # Pode ser descrição de mídia
             "message_type": msg_type,
             "from_name": from_name,
             "processed_at": firestore.SERVER_TIMESTAMP
-        })
-
-    def _save_conversation_history(self, chat_id: str, message_text: str, is_bot: bool):
-        """Armazena o histórico da conversa no Firestore."""
+        }
+        if batch is not None:
+            batch.set(doc_ref, message_data)
+        else:
+            doc_ref.set(message_data)
+        self._remember_processed_id(message_id)
+
+    def _save_conversation_history(self, chat_id: str, message_text: str, is_bot: bool, batch=None,
+                                   count_unsummarized: bool = True):
+        """Armazena o histórico da conversa no Firestore. Se batch for informado, apenas adiciona as escritas ao lote
+           (duas: a mensagem e o contador unsummarized_count do contexto).
+           count_unsummarized=False deixa o incremento do contador para o chamador (que já grava o contexto).
+        """
         try:
             # Armazena mensagens do usuário e do bot para contexto completo
             col_ref = self.db.collection("conversation_history")
-            col_ref.add({
+            history_data = {
                 "chat_id": chat_id,
                 "message_text": message_text,
                 "is_bot": is_bot, # Adicionado para diferenciar no build_context_prompt
                 "timestamp": firestore.SERVER_TIMESTAMP,
                 "summarized": False
-            })
+            }
+            commit_here = batch is None
+            if commit_here:
+                batch = self.db.batch()
+            batch.set(col_ref.document(), history_data)
+            if count_unsummarized:
+                # Contador lido por _summarize_chat_history_if_needed no lugar de consultar o histórico.
+                # Intencional: chats que só usaram o fluxo de lembretes também têm histórico a resumir, então
+                # ganham um contexto só com o contador (sem last_updated, ficam fora da query de reengajamento)
+                batch.set(self.db.collection("conversation_contexts").document(chat_id),
+                          {"unsummarized_count": firestore.Increment(1)}, merge=True)
+            if commit_here:
+                batch.commit()
         except Exception as e:
             logger.error(f"Erro ao salvar histórico para o chat {chat_id}: {e}")
 
+    def _save_message_and_history(self, message_id: str, chat_id: str, text: str, from_name: str):
+        """Registra a mensagem processada e o histórico do usuário em um único commit."""
+        batch = self.db.batch()
+        self._save_message(message_id, chat_id, text, from_name, "text", batch=batch)
+        self._save_conversation_history(chat_id, text, False, batch=batch)
+        batch.commit()
+
+    def _history_entry_from_doc(self, doc) -> Optional[Dict[str, Any]]:
+        """Converte um documento de conversation_history no formato usado nos prompts (ou None se inválido)."""
+        data = doc.to_dict()
+        doc_timestamp = data.get('timestamp')
+        # Ensure timestamp is a datetime object before calling .timestamp()
+        if isinstance(doc_timestamp, datetime):
+            history_timestamp = doc_timestamp.timestamp()
+        elif doc_timestamp is None: # Handle missing timestamp if necessary
+            history_timestamp = None 
+            logger.warning(f"Documento {doc.id} sem timestamp no histórico.")
+        else: # If it's already a float or int (e.g. from older data)
+            try:
+                history_timestamp = float(doc_timestamp)
+            except (ValueError, TypeError):
+                logger.warning(f"Timestamp inválido no documento {doc.id}: {doc_timestamp}")
+                history_timestamp = None
+
+        if 'message_text' not in data:
+            logger.warning(f"Documento ignorado (campo 'message_text' ausente): {doc.id}")
+            return None
+        return {
+            'message_text': data['message_text'],
+            'is_bot': data.get('is_bot', False), # Adicionado
+            'timestamp': history_timestamp # Armazena como Unix timestamp (float)
+        }
+
+    def _invalidate_history_cache(self, chat_id: str):
+        """Descarta o histórico em cache do chat (ex: após marcar mensagens como resumidas)."""
+        with self._history_cache_lock:
+            self._history_cache.pop(chat_id, None)
+            self._history_generation[chat_id] = self._history_generation.get(chat_id, 0) + 1
+
+    def _store_history_cache(self, chat_id: str, generation: int, entry: Tuple[datetime, List[Dict[str, Any]], int]):
+        """Guarda o histórico lido no cache LRU, a menos que o chat tenha sido invalidado durante a leitura."""
+        with self._history_cache_lock:
+            if self._history_generation.get(chat_id, 0) != generation:
+                return
+            self._history_cache[chat_id] = entry
+            self._history_cache.move_to_end(chat_id)
+            while len(self._history_cache) > self.HISTORY_CACHE_MAX_CHATS:
+                self._history_cache.popitem(last=False)
+
     def _get_conversation_history(self, chat_id: str, limit: int = 100) -> List[Dict[str, Any]]:
-        """Obtém histórico ordenado cronologicamente, excluindo mensagens já resumidas."""
+        """
+        Obtém histórico ordenado cronologicamente, excluindo mensagens já resumidas.
+        O histórico fica em cache por chat; nas chamadas seguintes só as mensagens
+        posteriores ao último timestamp visto são lidas (cursor por timestamp).
+        """
+        if limit <= 0: # O resumo já cobre o histórico, nada a buscar
+            return []
         try:
-            query = (
+            base_query = (
                 self.db.collection("conversation_history")
                 .where(filter=FieldFilter("chat_id", "==", chat_id))
                 .where(filter=FieldFilter("summarized", "==", False))
-                .order_by("timestamp", direction=firestore.Query.ASCENDING) # ASCENDING para ordem cronológica
-                .limit_to_last(limit) # limit_to_last para pegar as mais recentes
             )
+
+            with self._history_cache_lock:
+                cached = self._history_cache.get(chat_id)
+                generation = self._history_generation.get(chat_id, 0)
+            if cached and limit <= cached[2]:
+                last_timestamp, entries, depth = cached
+                # Apenas o delta desde a última leitura. Requer o índice composto em conversation_history:
+                #   chat_id ASC, summarized ASC, timestamp ASC
+                new_docs = (
+                    base_query
+                    .where(filter=FieldFilter("timestamp", ">", last_timestamp))
+                    .order_by("timestamp", direction=firestore.Query.ASCENDING)
+                    .limit(depth)
+                    .get()
+                )
+                if len(new_docs) < depth: # Senão pode haver mais mensagens novas: recarrega tudo abaixo
+                    new_entries = [entry for entry in map(self._history_entry_from_doc, new_docs) if entry]
+                    entries = (entries + new_entries)[-depth:]
+                    if new_docs:
+                        last_timestamp = new_docs[-1].get('timestamp')
+                    self._store_history_cache(chat_id, generation, (last_timestamp, entries, depth))
+                    return entries[-limit:]
+
+            # As mais recentes primeiro, com limite no servidor (sem limit_to_last), revertidas abaixo.
+            # Requer o índice composto em conversation_history:
+            #   chat_id ASC, summarized ASC, timestamp DESC
+            query = base_query.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit)
             docs = query.get() 
 
-            history = []
-            for doc in docs:
-                data = doc.to_dict()
-                doc_timestamp = data.get('timestamp')
-                # Ensure timestamp is a datetime object before calling .timestamp()
-                if isinstance(doc_timestamp, datetime):
-                    history_timestamp = doc_timestamp.timestamp()
-                elif doc_timestamp is None: # Handle missing timestamp if necessary
-                    history_timestamp = None 
-                    logger.warning(f"Documento {doc.id} sem timestamp no histórico.")
-                else: # If it's already a float or int (e.g. from older data)
-                    try:
-                        history_timestamp = float(doc_timestamp)
-                    except (ValueError, TypeError):
-                        logger.warning(f"Timestamp inválido no documento {doc.id}: {doc_timestamp}")
-                        history_timestamp = None
-                        
+            history = [entry for entry in map(self._history_entry_from_doc, reversed(docs)) if entry] # Reverter para ordem cronológica
 
-                if 'message_text' in data:
-                    history.append({
-                        'message_text': data['message_text'],
-                        'is_bot': data.get('is_bot', False), # Adicionado
-                        'timestamp': history_timestamp # Armazena como Unix timestamp (float)
-                    })
-                else:
-                    logger.warning(f"Documento ignorado (campo 'message_text' ausente): {doc.id}")
+            last_timestamp = docs[0].get('timestamp') if docs else None
+            if isinstance(last_timestamp, datetime):
+                self._store_history_cache(chat_id, generation, (last_timestamp, history, limit))
             return history
         except Exception as e:
             logger.error(f"Erro ao buscar histórico: {e}")
@@ -446,41 +1044,107 @@ class WhatsAppGeminiBot:
         """Configura as conexões com as APIs"""
         try:
             self.client = genai.Client(api_key=self.gemini_api_key)
-            
-            self.model_config = types.GenerateContentConfig(
-                system_instruction=self.gemini_context,
-                temperature=0.55
-            )
+            self._gemini_cache_names: Dict[str, str] = {}
+            self.refresh_gemini_context_cache()
 
             self.test_whapi_connection()
         except Exception as e:
             logger.error(f"Erro na configuração das APIs: {e}")
             raise
 
-    def update_conversation_context(self, chat_id: str, user_message: str, bot_response: str):
+    def _ensure_context_cache(self, key: str, tools: Optional[List[Tool]] = None) -> Optional[str]:
+        """
+        Renova (ou cria) o cache de contexto do Gemini com a system_instruction e as tools.
+        Retorna o nome do cache, ou None se não for possível usá-lo (ex: contexto abaixo do
+        mínimo de tokens exigido pela API), caso em que a system_instruction vai em cada chamada.
+        """
+        if not self.gemini_context:
+            return None
+        ttl = f"{self.GEMINI_CACHE_TTL_SECONDS}s"
+        cache_name = self._gemini_cache_names.get(key)
+        if cache_name:
+            try:
+                self.client.caches.update(name=cache_name, config=types.UpdateCachedContentConfig(ttl=ttl))
+                return cache_name
+            except Exception as e:
+                logger.warning(f"Não foi possível renovar o cache de contexto '{key}' ({cache_name}): {e}. Criando um novo.")
+        try:
+            cached_content = self.client.caches.create(
+                model=self.gemini_model_name,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=self.gemini_context,
+                    tools=tools,
+                    ttl=ttl
+                )
+            )
+            self._gemini_cache_names[key] = cached_content.name
+            logger.info("Cache de contexto do Gemini '%s' criado: %s", key, cached_content.name)
+            return cached_content.name
+        except Exception as e:
+            logger.info("Cache de contexto do Gemini '%s' indisponível, enviando system_instruction em cada chamada: %s", key, e)
+            self._gemini_cache_names.pop(key, None)
+            return None
+
+    def refresh_gemini_context_cache(self):
+        """(Re)monta as configs do Gemini apontando para o cache de contexto, quando disponível."""
+        cache_name = self._ensure_context_cache("default")
+        if cache_name:
+            self.model_config = types.GenerateContentConfig(cached_content=cache_name, temperature=0.55)
+        else:
+            self.model_config = types.GenerateContentConfig(
+                system_instruction=self.gemini_context,
+                temperature=0.55
+            )
+        # A API não aceita tools junto com cached_content, então a busca tem um cache próprio
+        self._search_cache_name = self._ensure_context_cache("google_search", tools=[self.GOOGLE_SEARCH_TOOL])
+        self._gemini_cache_refreshed_at = time.monotonic()
+
+    def _search_config(self, temperature: float) -> GenerateContentConfig:
+        """Config para chamadas com Google Search, usando o cache de contexto quando disponível."""
+        if self._search_cache_name:
+            return GenerateContentConfig(
+                cached_content=self._search_cache_name,
+                response_modalities=["TEXT"],
+                temperature=temperature
+            )
+        return GenerateContentConfig(
+            tools=[self.GOOGLE_SEARCH_TOOL],
+            response_modalities=["TEXT"],
+            system_instruction=self.gemini_context,
+            temperature=temperature
+        )
+
+    def update_conversation_context(self, chat_id: str, user_message: str, bot_response: str, cache: Optional[RequestCache] = None):
         """Atualiza o contexto (histórico) diretamente no Firestore"""
         try:
-            self._save_conversation_history(chat_id, user_message, False) # Mensagem do usuário
+            # Histórico do usuário e contexto gravados em um único commit
+            batch = self.db.batch()
+            self._save_conversation_history(chat_id, user_message, False, batch=batch, count_unsummarized=False) # Mensagem do usuário
             
             context_ref = self.db.collection("conversation_contexts").document(chat_id)
-            context_ref.set({
+            batch.set(context_ref, {
+                "unsummarized_count": firestore.Increment(1),
                 "last_updated": firestore.SERVER_TIMESTAMP,
                 "last_user_message": user_message, # O user_message aqui é o texto consolidado
-                "last_bot_response": bot_response
+                "last_bot_response": bot_response,
+                # Nova interação do usuário: qualquer tentativa de reengajamento anterior deixa de importar.
+                # Mantém o campo sempre presente para a query composta de _check_inactive_chats.
+                "last_reengagement_attempt": self.REENGAGEMENT_NEVER_ATTEMPTED
             }, merge=True)
+            batch.commit()
+            if cache:
+                cache.invalidate(context_ref)
         except Exception as e:
             logger.error(f"Erro ao atualizar contexto: {e}")
 
-    def build_context_prompt(self, chat_id: str, current_prompt_text: str, current_message_timestamp: datetime, from_name: Optional[str] = None) -> str:
+    def build_context_prompt(self, chat_id: str, current_prompt_text: str, current_message_timestamp: datetime, from_name: Optional[str] = None, cache: Optional[RequestCache] = None) -> str:
         """Constrói o prompt com histórico formatado corretamente, incluindo o resumo."""
         try:
             user_display_name = from_name if from_name else "Usuário"
 
-            summary_ref = self.db.collection("conversation_summaries").document(chat_id)
-            summary_doc = summary_ref.get()
-            summary = summary_doc.get("summary") if summary_doc.exists else ""
+            summary = self._get_previous_summary(chat_id, cache)
 
-            history = self._get_conversation_history(chat_id, limit=25) # Limite menor para prompt
+            history = self._get_conversation_history(chat_id, limit=self.CONTEXT_HISTORY_LIMIT) # Limite menor para prompt
 
             current_timestamp_iso = current_message_timestamp.strftime('%Y-%m-%d %H:%M:%S %Z')
 
@@ -523,9 +1187,8 @@ class WhatsAppGeminiBot:
 
     def test_whapi_connection(self):
         try:
-            response = requests.get(
+            response = self._whapi_session.get(
                 "https://gate.whapi.cloud/settings", # Removida barra final se não necessária
-                headers={"Authorization": f"Bearer {self.whapi_api_key}"},
                 timeout=10
             )
             response.raise_for_status()
@@ -541,16 +1204,15 @@ class WhatsAppGeminiBot:
             logger.warning("Mensagem sem ID recebida, ignorando.")
             return
 
-        if self._message_exists(message_id) and not self.pending_reminder_sessions.get(message.get('chat_id')):
-            logger.info(f"Mensagem {message_id} já processada e não há sessão de lembrete pendente, ignorando.")
-            return
-
         chat_id = message.get('chat_id')
-        if self._message_exists(message_id) and \
-            not self.pending_reminder_sessions.get(chat_id) and \
-            not self.pending_cancellation_sessions.get(chat_id):
-             logger.info(f"Mensagem {message_id} já processada e não há sessão pendente, ignorando.")
-             return
+        already_processed = self._message_exists(message_id) # Uma única verificação por mensagem
+        in_reminder_session = self._get_live_session(
+            self.pending_reminder_sessions, chat_id, self.REMINDER_SESSION_TIMEOUT_SECONDS) is not None
+        in_cancellation_session = self._get_live_session(
+            self.pending_cancellation_sessions, chat_id, self.REMINDER_CANCELLATION_SESSION_TIMEOUT_SECONDS) is not None
+        if already_processed and not (in_reminder_session or in_cancellation_session):
+            logger.info("Mensagem %s já processada e não há sessão pendente, ignorando.", message_id)
+            return
         from_name = message.get('from_name', 'Desconhecido')
         msg_type_whapi = message.get('type', 'text')
         caption = message.get('caption')
@@ -566,23 +1228,20 @@ class WhatsAppGeminiBot:
         
         # --- Reminder and Cancellation Flow Logic ---
         # Manter apenas as sessões pendentes e cancelamento
-        if chat_id in self.pending_reminder_sessions:
-            self._save_message(message_id, chat_id, text_body, from_name, "text")
-            self._save_conversation_history(chat_id, text_body, False)
+        if in_reminder_session:
+            self._save_message_and_history(message_id, chat_id, text_body, from_name)
             self._handle_pending_reminder_interaction(chat_id, text_body, message_id)
             return 
 
-        if chat_id in self.pending_cancellation_sessions: 
-            self._save_message(message_id, chat_id, text_body, from_name, "text")
-            self._save_conversation_history(chat_id, text_body, False)
+        if in_cancellation_session: 
+            self._save_message_and_history(message_id, chat_id, text_body, from_name)
             self._handle_pending_cancellation_interaction(chat_id, text_body, message_id)
             return 
 
         # Manter apenas cancelamento direto (não criação)
         if self._is_cancel_reminder_request(text_body):
-            logger.info(f"Requisição de cancelamento de lembrete detectada para '{text_body}'")
-            self._save_message(message_id, chat_id, text_body, from_name, "text")
-            self._save_conversation_history(chat_id, text_body, False)
+            logger.info("Requisição de cancelamento de lembrete detectada para '%s'", text_body)
+            self._save_message_and_history(message_id, chat_id, text_body, from_name)
             self._initiate_reminder_cancellation(chat_id, text_body, message_id)
             return 
 
@@ -593,27 +1252,27 @@ class WhatsAppGeminiBot:
         # --- End Reminder and Cancellation Flow Logic ---
 
         # If not a reminder flow, proceed with standard message processing (Gemini, etc.)
-        if self._message_exists(message_id): # Re-check, as reminder flow might have saved it
-             logger.info(f"Mensagem {message_id} já processada (após checagem de lembrete), ignorando para fluxo Gemini.")
+        if already_processed:
+             logger.info("Mensagem %s já processada (após checagem de lembrete), ignorando para fluxo Gemini.", message_id)
              return
 
         # Lógica para mídia (imagem, áudio, etc.)
         media_url = None
         if msg_type_whapi == 'image' and 'image' in message:
             media_url = message['image'].get('link')
-            logger.info(f"Imagem recebida: {media_url}")
+            logger.info("Imagem recebida: %s", media_url)
         elif msg_type_whapi in ['audio', 'ptt'] and 'audio' in message:
             media_url = message['audio'].get('link')
-            logger.info(f"audio recebido: {media_url}")
+            logger.info("audio recebido: %s", media_url)
         elif msg_type_whapi == 'video' and 'video' in message:
             media_url = message['video'].get('link')
-            logger.info(f"video recebido: {media_url}")
+            logger.info("video recebido: %s", media_url)
         elif msg_type_whapi == 'document' and 'document' in message:
             media_url = message['document'].get('link')
-            logger.info(f"Documento recebido: {media_url}")
+            logger.info("Documento recebido: %s", media_url)
         elif msg_type_whapi == 'voice' and 'voice' in message:
             media_url = message['voice'].get('link')
-            logger.info(f"Voice recebida: {media_url}")
+            logger.info("Voice recebida: %s", media_url)
 
         # Decidir tipo processado internamente e conteúdo principal
         processed_type_internal = 'text'
@@ -637,133 +1296,147 @@ class WhatsAppGeminiBot:
                 content_to_store = media_url
             elif caption:
                 content_to_store = caption
-                logger.info(f"Mídia tipo {msg_type_whapi} com caption, tratando como texto '{caption}'. URL: {media_url}")
+                logger.info("Mídia tipo %s com caption, tratando como texto '%s'. URL: %s", msg_type_whapi, caption, media_url)
             else:
-                logger.info(f"Mídia tipo {msg_type_whapi} sem caption, ignorando mídia. URL: {media_url}")
+                logger.info("Mídia tipo %s sem caption, ignorando mídia. URL: %s", msg_type_whapi, media_url)
                 # não altera content_to_store nem o tipo se não tem caption
 
         text_for_processed_log = caption or text_body or f"[{processed_type_internal} recebida]"
-        self._save_message(message_id, chat_id, text_for_processed_log, from_name, msg_type_whapi)
+        # O registro em processed_messages não depende da fila pendente: as duas escritas
+        # são feitas em paralelo, e ambas concluem antes de retornar.
+        save_future = self._io_executor.submit(
+            self._save_message, message_id, chat_id, text_for_processed_log, from_name, msg_type_whapi
+        )
 
         if processed_type_internal == 'text' and not content_to_store.strip():
-            logger.info(f"Mensagem de texto vazia ou mídia não suportada sem caption para {chat_id}, ignorando.")
+            save_future.result()
+            logger.info("Mensagem de texto vazia ou mídia não suportada sem caption para %s, ignorando.", chat_id)
             return
 
+        received_at = datetime.now(timezone.utc)
         pending_payload = {
             'type': processed_type_internal,
             'content': content_to_store,
             'original_caption': caption,
             'mimetype': mimetype,
-            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'timestamp': received_at.isoformat(),
+            'timestamp_ms': int(received_at.timestamp() * 1000), # Chave numérica de ordenação do lote
             'message_id': message_id,
             'link': media_url
         }
 
-        self._save_pending_message(chat_id, pending_payload, from_name) # Passar from_name aqui
-        logger.info(f"Mensagem de {from_name} ({chat_id}) adicionada à fila pendente. Tipo: {processed_type_internal}.")
+        try:
+            self._save_pending_message(chat_id, pending_payload, from_name) # Passar from_name aqui
+        finally:
+            save_future.result()
+        logger.info("Mensagem de %s (%s) adicionada à fila pendente. Tipo: %s.", from_name, chat_id, processed_type_internal)
 
     def _handle_pending_cancellation_interaction(self, chat_id: str, text: str, message_id: str):
         """Handles user's choice when cancelling a reminder from a list."""
-        if chat_id not in self.pending_cancellation_sessions:
+        session = self._get_live_session(
+            self.pending_cancellation_sessions, chat_id, self.REMINDER_CANCELLATION_SESSION_TIMEOUT_SECONDS)
+        if session is None:
             logger.warning(f"Nenhuma sessão de cancelamento pendente para {chat_id}")
             # Optionally send a message if this state is reached unexpectedly
-            # self.send_whatsapp_message(chat_id, "Desculpe, não encontrei uma solicitação de cancelamento ativa.", reply_to=message_id)
+            # self._enqueue_send(chat_id, "Desculpe, não encontrei uma solicitação de cancelamento ativa.", reply_to=message_id)
             return
 
-        session = self.pending_cancellation_sessions[chat_id]
-        session["last_interaction"] = datetime.now(timezone.utc)
+        self._touch_session(self.pending_cancellation_sessions, chat_id, session)
         user_input_normalized = normalizar_texto(text.strip())
 
         original_message_id_session = session.get("original_message_id", message_id)
 
-        if user_input_normalized in ["cancelar", "cancela", "nenhum", "nao"]:
-            del self.pending_cancellation_sessions[chat_id]
+        if user_input_normalized in self.SESSION_CANCEL_WORDS:
+            self.pending_cancellation_sessions.pop(chat_id, None)
             response_text = "Ok, nenhum lembrete foi cancelado."
-            self.send_whatsapp_message(chat_id, response_text, reply_to=original_message_id_session)
+            self._enqueue_send(chat_id, response_text, reply_to=original_message_id_session)
             self._save_conversation_history(chat_id, response_text, True)
             return
 
         reminders_options = session.get("reminders_options", []) # Lista de dicionários com 'id' e 'text_summary'
 
         if user_input_normalized == "todos":
-            cancelled_count = 0
             if not reminders_options:
                  response_text = "Não há lembretes na lista para cancelar."
             else:
-                for opt in reminders_options: # Cancel only from the presented list
-                    if self._deactivate_reminder_in_db(opt["id"]):
-                        cancelled_count += 1
+                # Cancel only from the presented list
+                cancelled_count = self._deactivate_reminders_in_db([opt["id"] for opt in reminders_options])
                 if cancelled_count > 0:
                     response_text = f"{cancelled_count} lembrete(s) da lista foram cancelados."
                 else:
                     response_text = "Não foi possível cancelar os lembretes da lista. Tente novamente."
             
-            del self.pending_cancellation_sessions[chat_id]
-            self.send_whatsapp_message(chat_id, response_text, reply_to=original_message_id_session)
+            self.pending_cancellation_sessions.pop(chat_id, None)
+            self._enqueue_send(chat_id, response_text, reply_to=original_message_id_session)
             self._save_conversation_history(chat_id, response_text, True)
             return
 
-        # Handle single item case where user might say "sim" or "1"
-        if len(reminders_options) == 1 and user_input_normalized in ["sim", "1", "s"]:
-            reminder_to_cancel = reminders_options[0]
-            if self._deactivate_reminder_in_db(reminder_to_cancel["id"]):
-                response_text = f"Lembrete '{reminder_to_cancel['text_summary']}' foi cancelado."
-            else:
-                response_text = f"Não foi possível cancelar o lembrete '{reminder_to_cancel['text_summary']}'. Tente novamente."
-            del self.pending_cancellation_sessions[chat_id]
-            self.send_whatsapp_message(chat_id, response_text, reply_to=original_message_id_session)
-            self._save_conversation_history(chat_id, response_text, True)
+        # Handler escolhido ao criar a sessão (lista com um único lembrete ou com vários)
+        choice_handler = session.get("choice_handler", self._handle_numbered_cancel_choice)
+        choice_handler(chat_id, user_input_normalized, message_id, session)
+
+    def _cancel_chosen_reminder(self, chat_id: str, reminder_to_cancel: Dict[str, Any], reply_to: str):
+        """Cancels the chosen reminder from the list, closes the session and replies."""
+        if self._deactivate_reminder_in_db(reminder_to_cancel["id"]):
+            response_text = f"Lembrete '{reminder_to_cancel['text_summary']}' foi cancelado."
+        else:
+            response_text = f"Não foi possível cancelar o lembrete '{reminder_to_cancel['text_summary']}'. Tente novamente."
+        self.pending_cancellation_sessions.pop(chat_id, None)
+        self._enqueue_send(chat_id, response_text, reply_to=reply_to)
+        self._save_conversation_history(chat_id, response_text, True)
+
+    def _handle_single_cancel_choice(self, chat_id: str, user_input_normalized: str, message_id: str, session: Dict[str, Any]):
+        """Single reminder listed: "sim"/"1"/"s" cancels it without parsing an index."""
+        if user_input_normalized in self.SESSION_YES_WORDS:
+            self._cancel_chosen_reminder(
+                chat_id, session["reminders_options"][0], session.get("original_message_id", message_id)
+            )
             return
+        self._handle_numbered_cancel_choice(chat_id, user_input_normalized, message_id, session)
 
+    def _handle_numbered_cancel_choice(self, chat_id: str, user_input_normalized: str, message_id: str, session: Dict[str, Any]):
+        """Handles a 1-based index into the listed reminders."""
+        reminders_options = session.get("reminders_options", [])
         try:
             choice_index = int(user_input_normalized) - 1 # User input is 1-based
             if 0 <= choice_index < len(reminders_options):
-                reminder_to_cancel = reminders_options[choice_index]
-                if self._deactivate_reminder_in_db(reminder_to_cancel["id"]):
-                    response_text = f"Lembrete '{reminder_to_cancel['text_summary']}' foi cancelado."
-                else:
-                    response_text = f"Não foi possível cancelar o lembrete '{reminder_to_cancel['text_summary']}'. Tente novamente."
-                del self.pending_cancellation_sessions[chat_id]
-                self.send_whatsapp_message(chat_id, response_text, reply_to=original_message_id_session)
-                self._save_conversation_history(chat_id, response_text, True)
+                self._cancel_chosen_reminder(
+                    chat_id, reminders_options[choice_index], session.get("original_message_id", message_id)
+                )
             else:
                 response_text = "Opção inválida. Por favor, digite o número de um lembrete da lista, 'todos' (para os listados) ou 'nenhum'."
-                self.send_whatsapp_message(chat_id, response_text, reply_to=message_id) # Reply to current message for correction
+                self._enqueue_send(chat_id, response_text, reply_to=message_id) # Reply to current message for correction
                 self._save_conversation_history(chat_id, response_text, True)
         except ValueError: # Not a number (and not "todos", "sim", "nao", etc.)
             response_text = "Não entendi sua escolha. Por favor, digite o número de um lembrete da lista, 'todos' (para os listados) ou 'nenhum'."
-            self.send_whatsapp_message(chat_id, response_text, reply_to=message_id) # Reply to current message for correction
+            self._enqueue_send(chat_id, response_text, reply_to=message_id) # Reply to current message for correction
             self._save_conversation_history(chat_id, response_text, True)
 
 
     def _initiate_reminder_cancellation(self, chat_id: str, text: str, message_id: str):
         """Handles the initial request to cancel reminders."""
-        logger.info(f"Iniciando cancelamento de lembrete para {chat_id} com texto: '{text}'")
+        logger.info("Iniciando cancelamento de lembrete para %s com texto: '%s'", chat_id, text)
 
-        if chat_id in self.pending_cancellation_sessions: # Clear any old session
-            del self.pending_cancellation_sessions[chat_id]
+        self.pending_cancellation_sessions.pop(chat_id, None) # Clear any old session
 
         normalized_text = normalizar_texto(text)
 
         # Check if user explicitly wants to cancel ALL reminders
-        if re.search(r'\btodos\b', normalized_text, re.IGNORECASE):
+        if self.CANCEL_ALL_RE.search(normalized_text):
             all_active_reminders = self._get_active_reminders(chat_id, limit=None) # Fetch all
             if not all_active_reminders:
                 response_text = "Você não possui lembretes ativos para cancelar."
-                self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
+                self._enqueue_send(chat_id, response_text, reply_to=message_id)
                 self._save_conversation_history(chat_id, response_text, True)
                 return
 
-            cancelled_count = 0
-            for reminder in all_active_reminders:
-                if self._deactivate_reminder_in_db(reminder["id"]):
-                    cancelled_count += 1
-            
+            cancelled_count = self._deactivate_reminders_in_db([reminder["id"] for reminder in all_active_reminders])
+
             if cancelled_count > 0:
                 response_text = f"{cancelled_count} lembrete(s) foram cancelados com sucesso."
             else:
                 response_text = "Não encontrei lembretes ativos ou não foi possível cancelá-los. Tente novamente."
-            self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
+            self._enqueue_send(chat_id, response_text, reply_to=message_id)
             self._save_conversation_history(chat_id, response_text, True)
             return
 
@@ -771,74 +1444,82 @@ class WhatsAppGeminiBot:
 
         if not active_reminders_for_listing:
             response_text = "Você não possui lembretes ativos para cancelar."
-            self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
+            self._enqueue_send(chat_id, response_text, reply_to=message_id)
             self._save_conversation_history(chat_id, response_text, True)
             return
 
-        options_for_session = []
-        response_parts = ["Você tem os seguintes lembretes ativos. Qual você gostaria de cancelar?"]
-        
-        for i, reminder in enumerate(active_reminders_for_listing):
-            dt_utc = reminder["reminder_time_utc"]
-            if isinstance(dt_utc, int) or isinstance(dt_utc, float): # Handle Firestore Timestamp as seconds
-                 dt_utc = datetime.fromtimestamp(dt_utc, tz=timezone.utc)
-            elif dt_utc.tzinfo is None: # Ensure dt_utc is timezone-aware
-                dt_utc = timezone.utc.localize(dt_utc)
-            
-            dt_local = dt_utc.astimezone(self.target_timezone)
-            
-            formatted_time = dt_local.strftime('%d/%m/%Y às %H:%M')
-            content_summary = reminder.get('content', 'Lembrete sem descrição')
-            if len(content_summary) > 50:
-                content_summary = content_summary[:47] + "..."
-            
-            summary = f"'{content_summary}' para {formatted_time}"
-            response_parts.append(f"{i+1}. {summary}")
-            options_for_session.append({"id": reminder["id"], "text_summary": summary})
-        
-        if len(active_reminders_for_listing) == 1:
-             response_parts = [f"Você tem um lembrete ativo:\n1. {options_for_session[0]['text_summary']}\n"]
-             response_parts.append("Digite '1' ou 'sim' para cancelá-lo, ou 'não'/'cancelar' para manter.")
+        options_for_session = [
+            {"id": reminder["id"], "text_summary": self._reminder_option_summary(reminder)}
+            for reminder in active_reminders_for_listing
+        ]
+
+        if len(options_for_session) == 1:
+            response_text = (
+                f"Você tem um lembrete ativo:\n1. {options_for_session[0]['text_summary']}\n\n"
+                "Digite '1' ou 'sim' para cancelá-lo, ou 'não'/'cancelar' para manter."
+            )
         else:
-            response_parts.append("\nDigite o número do lembrete para cancelar, 'todos' para cancelar os listados, ou 'nenhum'/'cancelar'.")
-        
-        response_text = "\n".join(response_parts)
+            response_text = (
+                "Você tem os seguintes lembretes ativos. Qual você gostaria de cancelar?\n"
+                + "\n".join(f"{i}. {opt['text_summary']}" for i, opt in enumerate(options_for_session, 1))
+                + "\n\nDigite o número do lembrete para cancelar, 'todos' para cancelar os listados, ou 'nenhum'/'cancelar'."
+            )
 
-        self.pending_cancellation_sessions[chat_id] = {
+        self._store_session(self.pending_cancellation_sessions, chat_id, {
             "state": self.REMINDER_STATE_AWAITING_CANCELLATION_CHOICE,
             "reminders_options": options_for_session,
+            "choice_handler": (
+                self._handle_single_cancel_choice if len(options_for_session) == 1 else self._handle_numbered_cancel_choice
+            ),
             "original_message_id": message_id,
-            "last_interaction": datetime.now(timezone.utc)
-        }
-        self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
+            "last_interaction": time.monotonic()
+        })
+        self._enqueue_send(chat_id, response_text, reply_to=message_id)
         self._save_conversation_history(chat_id, response_text, True)
 
+    def _reminder_option_summary(self, reminder: Dict[str, Any]) -> str:
+        """Resumo de um lembrete para a lista de cancelamento: conteúdo (até 50 caracteres) e horário local."""
+        dt_utc = reminder["reminder_time_utc"]
+        if isinstance(dt_utc, (int, float)): # Handle Firestore Timestamp as seconds
+            dt_utc = datetime.fromtimestamp(dt_utc, tz=timezone.utc)
+        elif dt_utc.tzinfo is None: # Ensure dt_utc is timezone-aware
+            dt_utc = dt_utc.replace(tzinfo=timezone.utc)
+
+        formatted_time = dt_utc.astimezone(self.target_timezone).strftime('%d/%m/%Y às %H:%M')
+        content = reminder.get('content', 'Lembrete sem descrição')
+        content_summary = content[:47] + "..." if len(content) > 50 else content
+        return f"'{content_summary}' para {formatted_time}"
+
     def _is_cancel_reminder_request(self, text: str) -> bool:
         """Checks if the text contains keywords indicating a reminder cancellation request."""
         if not text:
             return False
         # Normalize text for more reliable regex matching of keywords like "todos"
         normalized_text = normalizar_texto(text)
-        return bool(re.search(self.REMINDER_CANCEL_KEYWORDS_REGEX, normalized_text, re.IGNORECASE))
+        # Filtro por substring (busca em C, sem backtracking) antes do regex: a maioria das mensagens não é cancelamento
+        if not any(stem in normalized_text for stem in self.REMINDER_CANCEL_VERB_STEMS):
+            return False
+        return bool(self.REMINDER_CANCEL_KEYWORDS_RE.search(normalized_text))
 
     # --- Methods for Reminder Feature ---
     def _is_reminder_request(self, text: str) -> bool:
         """Checks if the text contains keywords indicating a reminder request."""
         if not text:
             return False
-        return bool(re.search(self.REMINDER_REQUEST_KEYWORDS_REGEX, text, re.IGNORECASE))
+        return bool(self.REMINDER_REQUEST_KEYWORDS_RE.search(text))
 
     def _clean_text_for_parsing(self, text: str) -> str:
         """Prepares text for date/time parsing by translating Portuguese day names."""
         processed_text = text.lower()
+        # Uma única leitura do relógio para o dia do mês e para hoje/amanhã
+        now_local = datetime.now(self.target_timezone)
+        tz_name = self.TARGET_TIMEZONE_NAME # Mesmo valor de target_timezone.key
 
         # Check for monthly day-specific pattern first
-        monthly_match = re.search(self.MONTHLY_DAY_SPECIFIC_REGEX, processed_text)
+        monthly_match = self.MONTHLY_DAY_SPECIFIC_RE.search(processed_text)
         if monthly_match:
             day_num = monthly_match.group(1) or monthly_match.group(2)  # One of the groups will match
             if day_num and 1 <= int(day_num) <= 31:
-                # Get current date in target timezone
-                now_local = datetime.now(self.target_timezone)
                 target_day = int(day_num)
 
                 # Calculate next occurrence of this day
@@ -854,38 +1535,75 @@ class WhatsAppGeminiBot:
 
                 # Replace the matched text with the actual date
                 date_str = next_date.strftime('%Y-%m-%d')
-                processed_text = re.sub(monthly_match.group(0), date_str, processed_text)
-                logger.info(f"Monthly day-specific pattern found. Converted to date: {date_str}")
+                processed_text = processed_text[:monthly_match.start()] + date_str + processed_text[monthly_match.end():]
+                logger.info("Monthly day-specific pattern found. Converted to date: %s", date_str)
 
-        # Continue with regular day name translations
-        for pt_day, en_day in self.PORTUGUESE_DAYS_FOR_PARSING.items():
-            processed_text = re.sub(r'\b' + pt_day + r'\b', en_day, processed_text)
+        # Continue with regular day name translations (single pass over the text)
+        processed_text = self.PORTUGUESE_DAYS_RE.sub(
+            lambda m: self.PORTUGUESE_DAYS_FOR_PARSING[m.group(1).lower()], processed_text
+        )
 
         # Handle "hoje", "amanhã", "depois de amanha"
-        now_in_target_tz = datetime.now(self.target_timezone)
-        today_date = now_in_target_tz.strftime('%Y-%m-%d')
-        tomorrow_date = (now_in_target_tz + timedelta(days=1)).strftime('%Y-%m-%d')
-        after_tomorrow_date = (now_in_target_tz + timedelta(days=2)).strftime('%Y-%m-%d')
+        today_date = now_local.strftime('%Y-%m-%d')
+        tomorrow_date = (now_local + timedelta(days=1)).strftime('%Y-%m-%d')
+        after_tomorrow_date = (now_local + timedelta(days=2)).strftime('%Y-%m-%d')
 
         # Add timezone info to the date replacements
-        processed_text = re.sub(r'\bhoje\b', f"{today_date} {self.target_timezone.zone}", processed_text, flags=re.IGNORECASE)
-        processed_text = re.sub(r'\bamanhã\b', f"{tomorrow_date} {self.target_timezone.zone}", processed_text, flags=re.IGNORECASE)
-        processed_text = re.sub(r'\bdepois de amanhã\b', f"{after_tomorrow_date} {self.target_timezone.zone}", processed_text, flags=re.IGNORECASE)
+        processed_text = self.PARSE_HOJE_RE.sub(f"{today_date} {tz_name}", processed_text)
+        # "depois de amanhã" antes de "amanhã", senão sobraria "depois de <amanhã>"
+        processed_text = self.PARSE_DEPOIS_DE_AMANHA_RE.sub(f"{after_tomorrow_date} {tz_name}", processed_text)
+        processed_text = self.PARSE_AMANHA_RE.sub(f"{tomorrow_date} {tz_name}", processed_text)
 
         # Convert various time formats to standard format
         # "HH e MM" -> "HH:MM"
-        processed_text = re.sub(r'(\d{1,2})\s*e\s*(\d{1,2})', r'\1:\2', processed_text)
+        processed_text = self.PARSE_HOUR_E_MINUTE_RE.sub(r'\1:\2', processed_text)
         # "as HH" -> "às HH:00"
-        processed_text = re.sub(r'\b(?:as|às)\s+(\d{1,2})(?!\d|:)\b', r'\1:00', processed_text, flags=re.IGNORECASE)
+        processed_text = self.PARSE_AS_HOUR_RE.sub(r'\1:00', processed_text)
         # Add seconds if not present
-        processed_text = re.sub(r'(\d{1,2}:\d{2})(?!:\d{2})', r'\1:00', processed_text)
+        processed_text = self.PARSE_HHMM_WITHOUT_SECONDS_RE.sub(r'\1:00', processed_text)
 
         # "próxima segunda" -> "next monday"
-        processed_text = re.sub(r'próxima\s+', 'next ', processed_text, flags=re.IGNORECASE)
-        processed_text = re.sub(r'próximo\s+', 'next ', processed_text, flags=re.IGNORECASE)
+        processed_text = self.PARSE_PROXIMO_RE.sub('next ', processed_text)
 
         return processed_text
 
+    def _fast_parse_cleaned_datetime(self, cleaned_text: str, default: datetime) -> Optional[Tuple[datetime, List[str]]]:
+        """
+        Interpreta por regex o formato produzido por _clean_text_for_parsing (AAAA-MM-DD e/ou HH:MM[:SS]).
+        Retorna (datetime, tokens restantes) como o dateutil com fuzzy_with_tokens, ou None quando o texto
+        tem algo que só o dateutil entenderia (outros números, dias da semana, meses, "next", am/pm...).
+        """
+        text = cleaned_text.replace(self.TARGET_TIMEZONE_NAME, " ")
+        date_matches = list(self.FAST_DATE_RE.finditer(text))
+        time_matches = list(self.FAST_TIME_RE.finditer(text))
+        if len(date_matches) > 1 or len(time_matches) > 1 or not (date_matches or time_matches):
+            return None
+
+        remaining = text
+        for match in sorted(date_matches + time_matches, key=lambda m: m.start(), reverse=True):
+            remaining = remaining[:match.start()] + " " + remaining[match.end():]
+        remaining_tokens = remaining.split()
+
+        info = self.DATEUTIL_PARSER_INFO
+        for token in remaining_tokens:
+            if any(char.isdigit() for char in token) or token.lower() == "next" or \
+                    info.jump(token) or info.weekday(token) is not None or info.month(token) is not None or \
+                    info.ampm(token) is not None or info.hms(token) is not None or info.pertain(token) or \
+                    info.utczone(token) or info.tzoffset(token) is not None:
+                return None
+
+        replacements = {}
+        if date_matches:
+            year, month, day = (int(group) for group in date_matches[0].groups())
+            replacements.update(year=year, month=month, day=day)
+        if time_matches:
+            hour, minute, second = time_matches[0].groups()
+            replacements.update(hour=int(hour), minute=int(minute), second=int(second or 0))
+        try:
+            return default.replace(**replacements), remaining_tokens
+        except ValueError: # Data/hora inválida: deixa o dateutil decidir
+            return None
+
     def _extract_reminder_details_from_text(self, text: str, chat_id: str) -> Dict[str, Any]:
         """
         Extracts content, datetime, and recurrence from text with improved accuracy.
@@ -900,17 +1618,19 @@ class WhatsAppGeminiBot:
             "original_datetime_str": None
         }
 
-        logger.info(f"Extracting reminder details from text: '{text}'")
+        logger.info("Extracting reminder details from text: '%s'", text)
 
         # 1. Initial cleanup: remove reminder keywords to isolate payload
-        payload_text = re.sub(self.REMINDER_REQUEST_KEYWORDS_REGEX, "", text, flags=re.IGNORECASE).strip()
-        logger.debug(f"After removing keywords: '{payload_text}'")
+        payload_text = self.REMINDER_REQUEST_KEYWORDS_RE.sub("", text).strip()
+        logger.debug("After removing keywords: '%s'", payload_text)
 
-        # Remove common leading words/prepositions that might precede the actual content
-        for word in self.leading_words_to_strip_normalized:
-            pattern = r"^\s*" + re.escape(word) + r"\s+"
-            payload_text = re.sub(pattern, "", normalizar_texto(payload_text), flags=re.IGNORECASE).strip()
-        logger.debug(f"After removing leading words: '{payload_text}'")
+        # Remove common leading words/prepositions that might precede the actual content.
+        # As tabelas são normalizadas (sem acento), então a busca roda numa cópia dobrada caractere a caractere
+        # (_ACCENT_FOLD_TABLE mantém o comprimento) e o mesmo offset é cortado do texto original:
+        # o conteúdo salvo e as expressões de data ("amanhã", "próxima terça") preservam os acentos.
+        leading_match = self.LEADING_WORDS_RE.match(payload_text.translate(_ACCENT_FOLD_TABLE))
+        payload_text = payload_text[leading_match.end():].strip()
+        logger.debug("After removing leading words: '%s'", payload_text)
 
         if not payload_text:
             logger.info("No payload text after initial cleanup")
@@ -919,62 +1639,66 @@ class WhatsAppGeminiBot:
         text_to_parse = payload_text
 
         # 2. Check for monthly day-specific pattern first
-        monthly_match = re.search(self.MONTHLY_DAY_SPECIFIC_REGEX, text_to_parse)
+        monthly_match = self.MONTHLY_DAY_SPECIFIC_RE.search(text_to_parse)
         if monthly_match:
             day_num = monthly_match.group(1) or monthly_match.group(2)  # One of the groups will match
             if day_num and 1 <= int(day_num) <= 31:
                 details["recurrence"] = "monthly"
                 details["day_of_month"] = int(day_num)
-                logger.info(f"Found monthly day-specific pattern. Day: {day_num}")
+                logger.info("Found monthly day-specific pattern. Day: %s", day_num)
                 # Remove the matched pattern from text_to_parse
-                text_to_parse = re.sub(monthly_match.group(0), "", text_to_parse).strip()
+                text_to_parse = (text_to_parse[:monthly_match.start()] + text_to_parse[monthly_match.end():]).strip()
         else:
             # 3. Extract other recurrence patterns if no monthly day-specific pattern
-            found_recurrence_phrase = ""
-            for phrase, key in self.RECURRENCE_KEYWORDS.items():
-                normalized_phrase = normalizar_texto(phrase)
-                normalized_text = normalizar_texto(text_to_parse)
-                match = re.search(r'\b' + re.escape(normalized_phrase) + r'\b', normalized_text, re.IGNORECASE)
-                if match:
-                    original_phrase_match = re.search(r'\b' + re.escape(phrase) + r'\b', text_to_parse, re.IGNORECASE)
-                    if original_phrase_match and len(original_phrase_match.group(0)) > len(found_recurrence_phrase):
-                        found_recurrence_phrase = original_phrase_match.group(0)
-                        details["recurrence"] = key
-                        logger.debug(f"Found recurrence: {key} from phrase '{found_recurrence_phrase}'")
+            # One scan for every phrase (on the accent-folded copy: "todo mês" -> "todo mes"); the longest phrase wins
+            recurrence_matches = list(self.RECURRENCE_PHRASES_RE.finditer(text_to_parse.translate(_ACCENT_FOLD_TABLE)))
+            found_recurrence_phrase = max((match.group(0).lower() for match in recurrence_matches), key=len, default="")
 
             if found_recurrence_phrase:
-                text_to_parse = text_to_parse.replace(found_recurrence_phrase, "").strip()
-                logger.debug(f"After removing recurrence: '{text_to_parse}'")
+                details["recurrence"] = self.RECURRENCE_KEYWORDS[found_recurrence_phrase]
+                logger.debug("Found recurrence: %s from phrase '%s'", details['recurrence'], found_recurrence_phrase)
+                # Remove every occurrence of that phrase, cutting the matched offsets out of the original text
+                for match in reversed(recurrence_matches):
+                    if match.group(0).lower() == found_recurrence_phrase:
+                        text_to_parse = text_to_parse[:match.start()] + text_to_parse[match.end():]
+                text_to_parse = text_to_parse.strip()
+                logger.debug("After removing recurrence: '%s'", text_to_parse)
 
         # 4. Parse DateTime
         cleaned_for_datetime = self._clean_text_for_parsing(text_to_parse)
         try:
             now_local = datetime.now(self.target_timezone)
-            logger.info(f"=== DEBUG TIMEZONE ===")
-            logger.info(f"Sistema timezone: {datetime.now().astimezone().tzinfo}")
-            logger.info(f"Target timezone: {self.target_timezone}")
-            logger.info(f"Now local (São Paulo): {now_local}")
-            logger.info(f"Now UTC: {datetime.now(timezone.utc)}")
-            logger.info(f"Texto para parsing: '{cleaned_for_datetime}'")
-            logger.info(f"==================")
-            parsed_dt_naive, non_datetime_tokens = dateutil_parser.parse(
-                cleaned_for_datetime,
-                fuzzy_with_tokens=True,
-                dayfirst=True,
-                default=now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-            )
+            # Diagnóstico de timezone só quando DEBUG está ativo (evita datetime.now()/str() a cada mensagem)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("=== DEBUG TIMEZONE ===")
+                logger.debug("Sistema timezone: %s", datetime.now().astimezone().tzinfo)
+                logger.debug("Target timezone: %s", self.target_timezone)
+                logger.debug("Now local (São Paulo): %s", now_local)
+                logger.debug("Now UTC: %s", now_local.astimezone(timezone.utc))
+                logger.debug("Texto para parsing: '%s'", cleaned_for_datetime)
+                logger.debug("==================")
+            parse_default = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+            fast_parsed = self._fast_parse_cleaned_datetime(cleaned_for_datetime, parse_default)
+            if fast_parsed:
+                parsed_dt_naive, non_datetime_tokens = fast_parsed
+            else:
+                parsed_dt_naive, non_datetime_tokens = dateutil_parser.parse(
+                    cleaned_for_datetime,
+                    fuzzy_with_tokens=True,
+                    dayfirst=True,
+                    default=parse_default
+                )
 
-            only_time_provided = all(
-                token.strip().lower() not in cleaned_for_datetime.lower()
-                for token in ['today', 'tomorrow', 'next', 'monday', 'tuesday', 'wednesday',
-                            'thursday', 'friday', 'saturday', 'sunday']
-            ) and not any(
-                re.search(r'\d{1,2}[-/]\d{1,2}', token)
+            # "hoje"/"amanhã"/"todo dia N" já chegam aqui como data AAAA-MM-DD
+            only_time_provided = self.DAY_WORDS_EN.isdisjoint(
+                self.WORD_TOKEN_RE.findall(cleaned_for_datetime.lower())
+            ) and not self.FAST_DATE_RE.search(cleaned_for_datetime) and not any(
+                self.DAY_MONTH_FRAGMENT_RE.search(token)
                 for token in non_datetime_tokens
             )
 
             if parsed_dt_naive.tzinfo is None:
-                parsed_dt = self.target_timezone.localize(parsed_dt_naive, is_dst=None)
+                parsed_dt = parsed_dt_naive.replace(tzinfo=self.target_timezone)
             else:
                 parsed_dt = parsed_dt_naive.astimezone(self.target_timezone)
 
@@ -982,7 +1706,7 @@ class WhatsAppGeminiBot:
                 details["time_explicitly_provided"] = True
                 if parsed_dt.time() < now_local.time():
                     parsed_dt = parsed_dt + timedelta(days=1)
-                    logger.info(f"Only time provided and was past current time. Adjusted to next day: {parsed_dt}")
+                    logger.info("Only time provided and was past current time. Adjusted to next day: %s", parsed_dt)
 
             # For monthly reminders with day_of_month, ensure correct date
             if details["recurrence"] == "monthly" and details["day_of_month"]:
@@ -1010,48 +1734,48 @@ class WhatsAppGeminiBot:
                 parsed_dt = target_datetime
 
             details["datetime_obj"] = parsed_dt.astimezone(timezone.utc)
-            logger.debug(f"Final parsed datetime (UTC): {details['datetime_obj']}")
+            logger.debug("Final parsed datetime (UTC): %s", details['datetime_obj'])
 
-            content_parts = [token.strip() for token in non_datetime_tokens if token.strip()]
-            initial_content = " ".join(content_parts).strip()
-            logger.debug(f"Initial content from non-datetime tokens: '{initial_content}'")
+            # O nome do timezone (inserido junto das datas) e o "next" de "próxima terça" não são conteúdo
+            content_words = " ".join(non_datetime_tokens).replace(self.TARGET_TIMEZONE_NAME, " ").split()
+            initial_content = " ".join(word for word in content_words if word.lower() != "next")
+            logger.debug("Initial content from non-datetime tokens: '%s'", initial_content)
 
         except (ValueError, TypeError) as e:
-            logger.info(f"DateTime parsing failed: {e}")
+            logger.info("DateTime parsing failed: %s", e)
             initial_content = text_to_parse
 
         # 5. Clean up content
         if initial_content:
             content_words = initial_content.split()
-            while content_words and any(
-                normalizar_texto(content_words[-1]) == word
-                for word in self.trailing_phrases_to_strip_normalized
-            ):
+            while content_words and normalizar_texto(content_words[-1]) in self.trailing_phrases_to_strip_normalized:
                 content_words.pop()
-                logger.debug(f"Removed trailing word, remaining: '{' '.join(content_words)}'")
+                logger.debug("Removed trailing word, remaining: '%s'", ' '.join(content_words))
 
             cleaned_content = " ".join(content_words).strip()
-            cleaned_content = re.sub(self.REMINDER_REQUEST_KEYWORDS_REGEX, "", cleaned_content, flags=re.IGNORECASE).strip()
+            cleaned_content = self.REMINDER_REQUEST_KEYWORDS_RE.sub("", cleaned_content).strip()
 
-            if cleaned_content and not any(
-                normalizar_texto(cleaned_content) == word
-                for word in self.trailing_phrases_to_strip_normalized + self.leading_words_to_strip_normalized
-            ):
+            if cleaned_content and normalizar_texto(cleaned_content) not in self.filler_words_normalized:
                 details["content"] = cleaned_content
-                logger.info(f"Final extracted content: '{cleaned_content}'")
+                logger.info("Final extracted content: '%s'", cleaned_content)
             else:
                 logger.info("Content was invalid or only contained common words")
                 details["content"] = None
 
         return details
 
+    def _format_reminder_confirmation(self, datetime_str: str, content: str) -> str:
+        """Monta uma confirmação de lembrete a partir de um template sorteado (já pré-dividido)."""
+        values = {"datetime_str": datetime_str, "content": content}
+        parts = random.choice(self.REMINDER_CONFIRMATION_PARTS)
+        return "".join(literal + values[field_name] if field_name else literal for literal, field_name in parts)
+
     def _initiate_reminder_creation(self, chat_id: str, text: str, message_id: str):
         """Starts the process of creating a new reminder."""
-        logger.info(f"Initiating reminder creation for chat {chat_id} from text: {text}")
+        logger.info("Initiating reminder creation for chat %s from text: %s", chat_id, text)
         
         # Clean up any previous stale session for this chat_id
-        if chat_id in self.pending_reminder_sessions:
-            del self.pending_reminder_sessions[chat_id]
+        self.pending_reminder_sessions.pop(chat_id, None)
 
         extracted_details = self._extract_reminder_details_from_text(text, chat_id)
         
@@ -1065,7 +1789,7 @@ class WhatsAppGeminiBot:
             "datetime_obj": datetime_obj_utc,
             "recurrence": recurrence,
             "original_message_id": message_id,
-            "last_interaction": datetime.now(timezone.utc)
+            "last_interaction": time.monotonic()
         }
 
         if not content:
@@ -1074,7 +1798,7 @@ class WhatsAppGeminiBot:
             session_data["state"] = self.REMINDER_STATE_AWAITING_DATETIME
 
         if session_data["state"]:
-            self.pending_reminder_sessions[chat_id] = session_data
+            self._store_session(self.pending_reminder_sessions, chat_id, session_data)
             self._ask_for_missing_reminder_info(chat_id, session_data)
         else:
             # All details found
@@ -1088,25 +1812,24 @@ class WhatsAppGeminiBot:
             datetime_local = datetime_obj_utc.astimezone(self.target_timezone)
             datetime_local_str = datetime_local.strftime('%d/%m/%Y às %H:%M')
 
-            confirmation_template = random.choice(self.REMINDER_CONFIRMATION_TEMPLATES)
-            response_text = confirmation_template.format(datetime_str=datetime_local_str, content=refined_content)
+            response_text = self._format_reminder_confirmation(datetime_local_str, refined_content)
             if recurrence != "none":
                 response_text += f" (Recorrência: {recurrence})"
-            self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
+            self._enqueue_send(chat_id, response_text, reply_to=message_id)
             self._save_conversation_history(chat_id, response_text, True)
 
 
     def _handle_pending_reminder_interaction(self, chat_id: str, text: str, message_id: str):
         """Handles user's response when the bot is waiting for more reminder info."""
-        if chat_id not in self.pending_reminder_sessions:
-            logger.warning(f"No pending reminder session for {chat_id} in _handle_pending_reminder_interaction")
+        session = self._get_live_session(self.pending_reminder_sessions, chat_id, self.REMINDER_SESSION_TIMEOUT_SECONDS)
+        if session is None:
+            logger.warning("No pending reminder session for %s in _handle_pending_reminder_interaction", chat_id)
             return
 
-        session = self.pending_reminder_sessions[chat_id]
-        session["last_interaction"] = datetime.now(timezone.utc)
+        self._touch_session(self.pending_reminder_sessions, chat_id, session)
 
-        if text.lower().strip() in ["cancelar", "cancela"]:
-            del self.pending_reminder_sessions[chat_id]
+        if text.lower().strip() in self.REMINDER_CREATION_CANCEL_WORDS:
+            self.pending_reminder_sessions.pop(chat_id, None)
             response_text = "Criação de lembrete cancelada."
             self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
             self._save_conversation_history(chat_id, response_text, True)
@@ -1125,49 +1848,50 @@ class WhatsAppGeminiBot:
 
         elif current_state == self.REMINDER_STATE_AWAITING_DATETIME:
             try:
-                import pytz
-                sp_tz = pytz.timezone('America/Sao_Paulo')
-                now_local = datetime.now(sp_tz)
+                now_local = datetime.now(self.target_timezone)
 
-                # ADICIONAR LOGS DE DEBUG:
-                logger.info(f"=== DEBUG PARSING DATETIME ===")
-                logger.info(f"Input text: '{text}'")
-                logger.info(f"Now local (SP): {now_local}")
-                logger.info(f"Now UTC: {datetime.now(timezone.utc)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("=== DEBUG PARSING DATETIME ===")
+                    logger.debug("Input text: '%s'", text)
+                    logger.debug("Now local (SP): %s", now_local)
+                    logger.debug("Now UTC: %s", now_local.astimezone(timezone.utc)) # Mesmo instante, sem nova leitura do relógio
 
                 cleaned_text = self._clean_text_for_parsing(text)
 
-                # Parse with default to start of current day
-                parsed_dt_naive = dateutil_parser.parse(
-                    cleaned_text,
-                    fuzzy=True,
-                    dayfirst=True,
-                    default=now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-                )
+                # Parse with default to start of current day (regex fast path first)
+                parse_default = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+                fast_parsed = self._fast_parse_cleaned_datetime(cleaned_text, parse_default)
+                if fast_parsed:
+                    parsed_dt_naive = fast_parsed[0]
+                else:
+                    parsed_dt_naive = dateutil_parser.parse(
+                        cleaned_text,
+                        fuzzy=True,
+                        dayfirst=True,
+                        default=parse_default
+                    )
 
                 # Check if only time was provided
-                only_time_provided = all(
-                    token.strip().lower() not in cleaned_text.lower()
-                    for token in ['hoje', 'amanha', 'amanhã', 'proximo', 'próximo', 'segunda', 'terça', 'quarta',
-                                'quinta', 'sexta', 'sabado', 'sábado', 'domingo']
-                ) and not re.search(r'\d{1,2}[-/]\d{1,2}', cleaned_text)
+                only_time_provided = self.DAY_WORDS_PT.isdisjoint(
+                    self.WORD_TOKEN_RE.findall(cleaned_text.lower())
+                ) and not self.DAY_MONTH_FRAGMENT_RE.search(cleaned_text)
 
                 # Localize the parsed datetime
                 if parsed_dt_naive.tzinfo is None:
-                    parsed_dt = self.target_timezone.localize(parsed_dt_naive, is_dst=None)
+                    parsed_dt = parsed_dt_naive.replace(tzinfo=self.target_timezone)
                 else:
                     parsed_dt = parsed_dt_naive.astimezone(self.target_timezone)
 
                 # If only time was provided and it's before current time
                 if only_time_provided and parsed_dt.time() < now_local.time():
                     parsed_dt = parsed_dt + timedelta(days=1)
-                    logger.info(f"Only time was provided and it was past current time. Adjusted to next day: {parsed_dt}")
+                    logger.info("Only time was provided and it was past current time. Adjusted to next day: %s", parsed_dt)
 
                 session["datetime_obj"] = parsed_dt.astimezone(timezone.utc)
                 session["state"] = ""
 
             except (ValueError, TypeError) as e:
-                logger.info(f"Could not parse datetime from user input '{text}': {e}")
+                logger.info("Could not parse datetime from user input '%s': %s", text, e)
                 response_text = (
                     "Não consegui entender a data/hora. Por favor, tente de novo usando um dos formatos:\n"
                     "- hoje às 14:30\n"
@@ -1179,7 +1903,7 @@ class WhatsAppGeminiBot:
                 self._save_conversation_history(chat_id, response_text, True)
                 return
             except Exception as e_general:
-                logger.error(f"Erro inesperado ao parsear data/hora '{text}': {e_general}", exc_info=True)
+                logger.error("Erro inesperado ao parsear data/hora '%s': %s", text, e_general, exc_info=True)
                 response_text = "Ocorreu um erro ao processar a data/hora. Por favor, tente novamente."
                 self.send_whatsapp_message(chat_id, response_text, reply_to=message_id)
                 self._save_conversation_history(chat_id, response_text, True)
@@ -1197,7 +1921,7 @@ class WhatsAppGeminiBot:
             content_to_refine = session["content"]
             refined_content = self._refine_reminder_content_with_gemini(content_to_refine, chat_id)
             if not refined_content:
-                logger.warning(f"Refinamento do conteúdo do lembrete '{content_to_refine}' falhou ou retornou vazio. Usando conteúdo original.")
+                logger.warning("Refinamento do conteúdo do lembrete '%s' falhou ou retornou vazio. Usando conteúdo original.", content_to_refine)
                 refined_content = content_to_refine
 
             self._save_reminder_to_db(
@@ -1212,27 +1936,18 @@ class WhatsAppGeminiBot:
             dt_local = dt_obj_utc.astimezone(self.target_timezone)
             datetime_local_str = dt_local.strftime('%d/%m/%Y às %H:%M')
 
-            confirmation_template = random.choice(self.REMINDER_CONFIRMATION_TEMPLATES)
-            response_text = confirmation_template.format(datetime_str=datetime_local_str, content=refined_content)
+            response_text = self._format_reminder_confirmation(datetime_local_str, refined_content)
             if session.get("recurrence", "none") != "none":
                 response_text += f" (Recorrência: {session['recurrence']})"
             
             self.send_whatsapp_message(chat_id, response_text, reply_to=session["original_message_id"])
             self._save_conversation_history(chat_id, response_text, True)
-            if chat_id in self.pending_reminder_sessions: # Clean up session
-                del self.pending_reminder_sessions[chat_id]
+            self.pending_reminder_sessions.pop(chat_id, None) # Clean up session
 
     def _ask_for_missing_reminder_info(self, chat_id: str, session_data: Dict[str, Any]):
         """Asks the user for the next piece of missing information."""
         state = session_data["state"]
-        question = ""
-        if state == self.REMINDER_STATE_AWAITING_CONTENT:
-            question = "Ok! Qual é o conteúdo do lembrete? (O que devo te lembrar?)"
-        elif state == self.REMINDER_STATE_AWAITING_DATETIME:
-            question = "Entendido. Para quando devo agendar este lembrete? (Ex: amanhã às 10h, 25/12/2024 15:00, hoje 18:30)"
-        elif state == self.REMINDER_STATE_AWAITING_RECURRENCE: # Optional: not currently triggered unless logic changes
-            question = "Este lembrete deve se repetir? (Ex: diariamente, semanalmente, ou não)"
-        
+        question = self._STATE_QUESTIONS.get(state)
         if question:
             self.send_whatsapp_message(chat_id, question, reply_to=session_data["original_message_id"])
             self._save_conversation_history(chat_id, question, True)
@@ -1246,30 +1961,48 @@ class WhatsAppGeminiBot:
             logger.warning(f"Conteúdo original do lembrete está vazio para {chat_id}. Não refinando.")
             return ""
 
-        prompt = (
-            "Transforme a seguinte frase em um lembrete conciso e acionável. Extraia a tarefa principal. "
-            "Por exemplo, de 'r la pelas horas que preciso separar umas roupas pra minha sogra?' extraia 'separar umas roupas para a sogra'. "
-            "De 'me lembra de comprar leite horas' extraia 'comprar leite'.\n\n"
-            f"Frase original: '{original_content}'\n\n"
-            "Lembrete conciso:"
-        )
+        # Chave sem diferença de maiúsculas/espaços: "Comprar  leite" e "comprar leite" geram o mesmo lembrete
+        cache_key = ' '.join(original_content.lower().split())
+        with self._refined_content_lock:
+            cached_refinement = self._refined_content_cache.get(cache_key)
+            if cached_refinement is not None:
+                self._refined_content_cache.move_to_end(cache_key)
+        if cached_refinement is not None:
+            logger.info("Conteúdo do lembrete refinado (cache): '%s'", cached_refinement)
+            return cached_refinement
+
+        words = normalizar_texto(original_content).split()
+        skip_refinement = len(words) <= self.REMINDER_REFINEMENT_SKIP_MAX_WORDS and \
+            self.REMINDER_REFINEMENT_FILLER_WORDS.isdisjoint(words)
+        with self._refined_content_lock:
+            if skip_refinement:
+                self._refinement_skipped_count += 1
+            else:
+                self._refinement_gemini_count += 1
+            skipped, refined = self._refinement_skipped_count, self._refinement_gemini_count
+        if skip_refinement:
+            logger.info("Conteúdo do lembrete já conciso, sem refinamento: '%s' (atalhos: %s, chamadas ao Gemini: %s)",
+                        original_content.strip(), skipped, refined)
+            return original_content.strip()
+
         try:
-            logger.info(f"Refinando conteúdo do lembrete para {chat_id} com Gemini. Original: '{original_content}'")
+            logger.info("Refinando conteúdo do lembrete para %s com Gemini. Original: '%s'", chat_id, original_content)
             response = self.client.models.generate_content(
                 model=self.gemini_model_name,
-                contents=[prompt],
+                contents=[self.REMINDER_REFINEMENT_INSTRUCTION + f"Frase original: '{original_content}'\n\nLembrete conciso:"],
                 config=self.model_config
             )
 
-            refined_text = ""
-            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'text'):
-                        refined_text += part.text
-            refined_text = refined_text.strip()
+            refined_text = self._extract_text(response)
 
             if refined_text:
-                logger.info(f"Conteúdo do lembrete refinado: '{refined_text}'")
+                logger.info("Conteúdo do lembrete refinado: '%s'", refined_text)
+                # Só refinamentos bem-sucedidos entram no cache; falhas voltam a tentar na próxima vez
+                with self._refined_content_lock:
+                    self._refined_content_cache[cache_key] = refined_text
+                    self._refined_content_cache.move_to_end(cache_key)
+                    while len(self._refined_content_cache) > self.REFINED_CONTENT_CACHE_MAX_ENTRIES:
+                        self._refined_content_cache.popitem(last=False)
                 return refined_text
             else:
                 logger.warning(f"Gemini retornou conteúdo refinado vazio para '{original_content}'. Usando original.")
@@ -1287,7 +2020,7 @@ class WhatsAppGeminiBot:
             if reminder_time_utc.tzinfo is None:
                 # Se não tem timezone, erro - deve ser corrigido antes
                 logger.error(f"reminder_time_utc sem timezone! Assumindo São Paulo.")
-                reminder_time_sp = self.target_timezone.localize(reminder_time_utc)
+                reminder_time_sp = reminder_time_utc.replace(tzinfo=self.target_timezone)
                 reminder_time_utc = reminder_time_sp.astimezone(timezone.utc)
             elif reminder_time_utc.tzinfo != timezone.utc:
                 # Converter para UTC se não estiver
@@ -1312,10 +2045,11 @@ class WhatsAppGeminiBot:
 
             doc_ref = self.db.collection("reminders").document()
             doc_ref.set(reminder_payload)
+            self._schedule_reminder(reminder_time_utc, doc_ref.id)
 
             # Log com horário local para clareza
             reminder_time_local = reminder_time_utc.astimezone(self.target_timezone)
-            logger.info(f"Lembrete salvo para {chat_id}: {content} @ {reminder_time_local.strftime('%d/%m/%Y %H:%M %Z')} (UTC: {reminder_time_utc.strftime('%Y-%m-%d %H:%M:%S')})")
+            logger.info("Lembrete salvo para %s: %s @ %s (UTC: %s)", chat_id, content, reminder_time_local.strftime('%d/%m/%Y %H:%M %Z'), reminder_time_utc.strftime('%Y-%m-%d %H:%M:%S'))
 
         except Exception as e:
             logger.error(f"Erro ao salvar lembrete para {chat_id}: {e}", exc_info=True)
@@ -1337,33 +2071,121 @@ class WhatsAppGeminiBot:
         elif recurrence == "yearly":
             next_occurrence = base_time + relativedelta(years=1)
         
-        # Ensure it's in the future from the actual last_occurrence_utc time
-        # This handles cases where adding interval might still be in the past if original time was late in day
-        if next_occurrence and next_occurrence <= last_occurrence_utc:
-             # If adding the interval didn't push it past the current time (e.g. monthly on 31st to Feb)
-             # or if base_time + interval is still <= last_occurrence_utc (should not happen with timedelta > 0)
-             # Re-evaluate based on current time to ensure it's truly next
-             now_utc = datetime.now(timezone.utc)
-             while next_occurrence <= now_utc: # Keep adding interval until it's in the future
-                if recurrence == "daily": next_occurrence += timedelta(days=1)
-                elif recurrence == "weekly": next_occurrence += timedelta(weeks=1)
-                elif recurrence == "monthly": next_occurrence += relativedelta(months=1)
-                elif recurrence == "yearly": next_occurrence += relativedelta(years=1)
-                else: break # Should not happen
+        # Ensure it's in the future: if the bot was down (or the sweep ran late), jump straight to the
+        # first occurrence after now instead of sending once for every missed interval
+        now_utc = datetime.now(timezone.utc)
+        if next_occurrence and next_occurrence <= now_utc:
+            if recurrence in self.RECURRENCE_FIXED_STRIDES:
+                stride = self.RECURRENCE_FIXED_STRIDES[recurrence]
+                next_occurrence += ((now_utc - next_occurrence) // stride + 1) * stride
+            else:
+                # Monthly/yearly: counted from base_time so a short month doesn't drift the day (31 -> 28 -> 28...)
+                stride_months = self.RECURRENCE_MONTH_STRIDES[recurrence]
+                months_behind = (now_utc.year - base_time.year) * 12 + (now_utc.month - base_time.month)
+                strides = max(1, months_behind // stride_months)
+                next_occurrence = base_time + relativedelta(months=strides * stride_months)
+                while next_occurrence <= now_utc: # At most a couple of steps (day/time within the month)
+                    strides += 1
+                    next_occurrence = base_time + relativedelta(months=strides * stride_months)
 
         return next_occurrence
 
 
+    def _schedule_reminder(self, reminder_time_utc: datetime, reminder_id: str):
+        """Adds the reminder's next due time to the in-memory heap."""
+        with self._reminder_heap_lock:
+            heapq.heappush(self._reminder_heap, (reminder_time_utc, reminder_id))
+
+    def _load_reminder_heap(self):
+        """Rebuilds the heap from the active reminders in Firestore (only the due time is read)."""
+        query = (
+            self.db.collection("reminders")
+            .where(filter=FieldFilter("is_active", "==", True))
+            .select(["reminder_time_utc"])
+        )
+        entries = []
+        for doc in query.stream():
+            reminder_time_utc = doc.get("reminder_time_utc")
+            if reminder_time_utc is None:
+                continue
+            if reminder_time_utc.tzinfo is None:
+                reminder_time_utc = reminder_time_utc.replace(tzinfo=timezone.utc)
+            entries.append((reminder_time_utc, doc.id))
+        with self._reminder_heap_lock:
+            # Mantém o que foi agendado enquanto a query rodava, sem duplicar o que já estava no heap
+            entries = list(set(entries).union(self._reminder_heap))
+            heapq.heapify(entries)
+            self._reminder_heap = entries
+            self._reminder_heap_loaded_at = time.monotonic()
+        logger.info("%s lembretes ativos carregados para agendamento.", len(entries))
+
+    def _reminder_heap_is_stale(self) -> bool:
+        """True when the heap was never loaded, was invalidated, or is older than REMINDER_HEAP_RELOAD_SECONDS."""
+        loaded_at = self._reminder_heap_loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at >= self.REMINDER_HEAP_RELOAD_SECONDS
+
+    def _has_due_reminders(self, now_utc: datetime) -> bool:
+        """True when a sweep has work to do (heap needs (re)loading, or its first entry is due)."""
+        with self._reminder_heap_lock:
+            return self._reminder_heap_is_stale() or bool(self._reminder_heap and self._reminder_heap[0][0] <= now_utc)
+
+    def _pop_due_reminders_from_heap(self, now_utc: datetime) -> bool:
+        """Removes the due entries from the heap. Returns False when nothing is due (no query needed)."""
+        with self._reminder_heap_lock:
+            if not self._reminder_heap or self._reminder_heap[0][0] > now_utc:
+                return False
+            while self._reminder_heap and self._reminder_heap[0][0] <= now_utc:
+                heapq.heappop(self._reminder_heap)
+            return True
+
     def _check_and_send_due_reminders(self):
         """Checks Firestore for due reminders and sends them."""
         now_utc = datetime.now(timezone.utc)
+        try:
+            if self._reminder_heap_is_stale():
+                self._load_reminder_heap()
+        except Exception as e:
+            logger.error(f"Erro ao carregar lembretes ativos para agendamento: {e}", exc_info=True)
+            return
+        if not self._pop_due_reminders_from_heap(now_utc):
+            return
+
+        # Atualizações dos lembretes e histórico vão em lotes; o envio no WhatsApp fica fora do lote.
+        # O lote é gravado à medida que os envios terminam (antes de esperar o próximo, ou ao encher),
+        # para que uma queda no meio da varredura não reenvie lembretes já entregues.
+        batch = self.db.batch()
+        batch_writes = 0
+
+        def flush_batch():
+            nonlocal batch, batch_writes
+            if not batch_writes:
+                return
+            # O lote é trocado antes do commit: se ele falhar, não é gravado de novo pelo tratamento de erro
+            pending_batch, batch, batch_writes = batch, self.db.batch(), 0
+            pending_batch.commit()
+
+        def commit_if_full(writes_to_add: int):
+            nonlocal batch_writes
+            if batch_writes + writes_to_add > self.FIRESTORE_BATCH_MAX_WRITES:
+                flush_batch()
+            batch_writes += writes_to_add
+
         try:
             reminders_query = (
                 self.db.collection("reminders")
                 .where(filter=FieldFilter("is_active", "==", True))
                 .where(filter=FieldFilter("reminder_time_utc", "<=", now_utc))
+                .select(self.DUE_REMINDER_FIELDS) # Só os campos usados no envio/reagendamento
             )
             due_reminders = reminders_query.stream()
+            # Todos os envios são enfileirados antes de aguardar qualquer resultado
+            scheduled_sends = []
+            malformed_reminders = [] # (referência, motivo): desativados no mesmo lote das demais atualizações
+            # Atributos usados a cada iteração ficam em variáveis locais
+            tz = self.target_timezone
+            choice = random.choice
+            enqueue_send = self._enqueue_send
+            message_templates = self.REMINDER_MESSAGE_TEMPLATES
 
             for reminder_doc in due_reminders:
                 reminder_data = reminder_doc.to_dict()
@@ -1374,12 +2196,12 @@ class WhatsAppGeminiBot:
                 if not chat_id:
                     logger.error(f"Lembrete ID {reminder_doc.id} não possui chat_id. Dados: {reminder_data}")
                     # Mark as inactive or log for investigation
-                    self.db.collection("reminders").document(reminder_doc.id).update({"is_active": False, "error_log": "Missing chat_id"})
+                    malformed_reminders.append((reminder_doc.reference, "Missing chat_id"))
                     continue
 
                 if not content: # Should not happen if saved correctly, but good to check
                     logger.error(f"Lembrete ID {reminder_doc.id} para chat {chat_id} não possui conteúdo. Dados: {reminder_data}")
-                    self.db.collection("reminders").document(reminder_doc.id).update({"is_active": False, "error_log": "Missing content"})
+                    malformed_reminders.append((reminder_doc.reference, "Missing content"))
                     continue
 
                 recurrence = reminder_data.get("recurrence", "none")
@@ -1392,37 +2214,36 @@ class WhatsAppGeminiBot:
                     reminder_time_utc = reminder_time_utc.replace(tzinfo=timezone.utc)
 
                 # Para o log, podemos mostrar a hora local do lembrete
-                reminder_time_local = reminder_time_utc.astimezone(self.target_timezone)
-                logger.info(f"Enviando lembrete ID {reminder_id} para {chat_id}: '{content}' agendado para {reminder_time_local.strftime('%d/%m/%Y %H:%M:%S %Z')}")
-                
-                
-                
+                reminder_time_local = reminder_time_utc.astimezone(tz)
+                logger.info("Enviando lembrete ID %s para %s: '%s' agendado para %s", reminder_id, chat_id, content, reminder_time_local.strftime('%d/%m/%Y %H:%M:%S %Z'))
 
-                # Listas de variações para cada parte da mensagem
-                saudacoes = ["Olá", "Ei", "Oii", "Oie", "Oi", "E aí"]
-                mensagens = ["estou passando para te lembrar", "só um lembrete rápido", "passando para avisar", "queria te lembrar", "lembrete importante"]
-                introducoes = ["Não esqueça de", "Lembre-se de", "Por favor, não esqueça de"]
-                despedidas = ["Até logo", "Até mais", "Até breve", "Tchau"]
-                emojis = ["🙂", "😊", "👍", "🌟", "✨", "🙌", "⏰"]
-
-                saudacao = random.choice(saudacoes)
-                mensagem = random.choice(mensagens)
-                introducao = random.choice(introducoes)
-                despedida = random.choice(despedidas)
-                emoji = random.choice(emojis)
-        
                 # A mensagem para o usuário não inclui a hora, então não precisa de conversão aqui.
                 # Mas se incluísse, seria:
                 # local_reminder_time_for_msg = reminder_time_utc.astimezone(self.target_timezone)
                 # message_to_send = f"Não esqueça de: {content} (agendado para {local_reminder_time_for_msg.strftime('%H:%M')})"
-                message_to_send = (f"{saudacao}, {mensagem}!\n\n"
-                                   f"{introducao}: {content}\n\n"
-                                   f"{despedida} {emoji}")
+                message_to_send = choice(message_templates).format_map({"content": content})
                 
-                success = self.send_whatsapp_message(chat_id, message_to_send, reply_to=None)
+                send_future = enqueue_send(chat_id, message_to_send, reply_to=None)
+                scheduled_sends.append((send_future, reminder_doc, reminder_data, message_to_send))
+
+            for reminder_ref, error_log in malformed_reminders:
+                commit_if_full(1)
+                batch.update(reminder_ref, {"is_active": False, "error_log": error_log})
+
+            for send_future, reminder_doc, reminder_data, message_to_send in scheduled_sends:
+                chat_id = reminder_data["chat_id"]
+                reminder_id = reminder_doc.id
+                recurrence = reminder_data.get("recurrence", "none")
+                reminder_time_utc = reminder_data["reminder_time_utc"]
+                if reminder_time_utc.tzinfo is None: # Garantir que é UTC
+                    reminder_time_utc = reminder_time_utc.replace(tzinfo=timezone.utc)
+
+                if not send_future.done():
+                    flush_batch() # Grava o que já foi entregue enquanto este envio ainda está na fila
 
-                if success:
-                    self._save_conversation_history(chat_id, message_to_send, True) # Log bot's reminder
+                if send_future.result():
+                    commit_if_full(3) # Histórico (mensagem + contador) e atualização do lembrete
+                    self._save_conversation_history(chat_id, message_to_send, True, batch=batch) # Log bot's reminder
                     
                     update_data = {"last_sent_at": firestore.SERVER_TIMESTAMP}
                     if recurrence == "none":
@@ -1434,43 +2255,74 @@ class WhatsAppGeminiBot:
                         next_occurrence_utc = self._get_next_occurrence(reminder_time_utc, recurrence, original_hour, original_minute)
                         if next_occurrence_utc:
                             update_data["reminder_time_utc"] = next_occurrence_utc
-                            next_occurrence_local = next_occurrence_utc.astimezone(self.target_timezone)
-                            logger.info(f"Lembrete {reminder_id} (recorrência: {recurrence}) reagendado para {next_occurrence_local.strftime('%Y-%m-%d %H:%M:%S %Z')} (UTC: {next_occurrence_utc.strftime('%Y-%m-%d %H:%M:%S %Z')})")
+                            self._schedule_reminder(next_occurrence_utc, reminder_id)
+                            next_occurrence_local = next_occurrence_utc.astimezone(tz)
+                            logger.info("Lembrete %s (recorrência: %s) reagendado para %s (UTC: %s)", reminder_id, recurrence, next_occurrence_local.strftime('%Y-%m-%d %H:%M:%S %Z'), next_occurrence_utc.strftime('%Y-%m-%d %H:%M:%S %Z'))
                         else:
                             update_data["is_active"] = False 
                             logger.warning(f"Não foi possível calcular próxima ocorrência para lembrete {reminder_id}. Desativando.")
                     
-                    self.db.collection("reminders").document(reminder_id).update(update_data)
+                    batch.update(reminder_doc.reference, update_data)
                 else:
                     logger.error(f"Falha ao enviar lembrete ID {reminder_id} para {chat_id}.")
+                    # Continua ativo no Firestore: nova tentativa depois de REMINDER_SEND_RETRY_SECONDS
+                    self._schedule_reminder(now_utc + timedelta(seconds=self.REMINDER_SEND_RETRY_SECONDS), reminder_id)
+
+            flush_batch()
 
         except Exception as e:
             logger.error(f"Erro ao verificar/enviar lembretes: {e}", exc_info=True)
+            # Entradas já retiradas do heap podem não ter sido tratadas: recarrega na próxima varredura
+            self._reminder_heap_loaded_at = None
+            # Lembretes já enviados nesta varredura não podem ficar ativos (seriam reenviados)
+            try:
+                flush_batch()
+            except Exception as e_commit:
+                logger.error(f"Erro ao gravar atualizações pendentes dos lembretes: {e_commit}", exc_info=True)
 
     def _cleanup_stale_pending_reminder_sessions(self):
         """Cleans up pending reminder and cancellation sessions that have timed out."""
-        now = datetime.now(timezone.utc)
-        # Clean reminder creation sessions
-        stale_reminder_sessions = []
-        for chat_id, session_data in self.pending_reminder_sessions.items():
-            last_interaction = session_data.get("last_interaction")
-            if last_interaction and (now - last_interaction).total_seconds() > self.REMINDER_SESSION_TIMEOUT_SECONDS:
-                stale_reminder_sessions.append(chat_id)
-
-        for chat_id in stale_reminder_sessions:
-            del self.pending_reminder_sessions[chat_id]
-
-        # Clean cancellation sessions
-        stale_cancellation_sessions = []
-        for chat_id, session_data in list(self.pending_cancellation_sessions.items()): # Iterate over a copy
-            last_interaction = session_data.get("last_interaction")
-            if last_interaction and (now - last_interaction).total_seconds() > self.REMINDER_CANCELLATION_SESSION_TIMEOUT_SECONDS:
-                stale_cancellation_sessions.append(chat_id)
-
-        for chat_id in stale_cancellation_sessions:
-            if chat_id in self.pending_cancellation_sessions:
-                b = 0
-            del self.pending_cancellation_sessions[chat_id]
+        now = time.monotonic() # last_interaction é time.monotonic(): só serve para medir inatividade
+        for sessions, timeout_seconds in (
+            (self.pending_reminder_sessions, self.REMINDER_SESSION_TIMEOUT_SECONDS), # Reminder creation sessions
+            (self.pending_cancellation_sessions, self.REMINDER_CANCELLATION_SESSION_TIMEOUT_SECONDS), # Cancellation sessions
+        ):
+            with self._sessions_lock:
+                # Ordered by last interaction: stop at the first session that is still fresh
+                while sessions:
+                    chat_id, session_data = next(iter(sessions.items()))
+                    last_interaction = session_data.get("last_interaction")
+                    if last_interaction and now - last_interaction <= timeout_seconds:
+                        break
+                    del sessions[chat_id]
+
+    def _get_live_session(self, sessions: "OrderedDict[str, Dict[str, Any]]", chat_id: str, timeout_seconds: int) -> Optional[Dict[str, Any]]:
+        """Returns the chat's session, dropping it on access if it has already expired (the sweep may not have run yet)."""
+        session = sessions.get(chat_id)
+        if session is None:
+            return None
+        last_interaction = session.get("last_interaction")
+        if last_interaction and time.monotonic() - last_interaction <= timeout_seconds:
+            return session
+        with self._sessions_lock:
+            if sessions.get(chat_id) is session: # May have been replaced meanwhile
+                del sessions[chat_id]
+        return None
+
+    def _store_session(self, sessions: "OrderedDict[str, Dict[str, Any]]", chat_id: str, session_data: Dict[str, Any]):
+        """Registers the session as the most recent one, evicting the oldest beyond MAX_PENDING_SESSIONS."""
+        with self._sessions_lock: # Não intercalar com a varredura de sessões expiradas
+            sessions[chat_id] = session_data
+            sessions.move_to_end(chat_id)
+            while len(sessions) > self.MAX_PENDING_SESSIONS:
+                sessions.popitem(last=False)
+
+    def _touch_session(self, sessions: "OrderedDict[str, Dict[str, Any]]", chat_id: str, session: Dict[str, Any]):
+        """Updates last_interaction and moves the session to the end (most recent)."""
+        with self._sessions_lock:
+            session["last_interaction"] = time.monotonic()
+            if sessions.get(chat_id) is session: # May have expired or been replaced meanwhile
+                sessions.move_to_end(chat_id)
 
     def _check_pending_messages(self, chat_id: str):
         """Verifica se deve processar as mensagens acumuladas para um chat específico."""
@@ -1512,11 +2364,12 @@ class WhatsAppGeminiBot:
                     snapshot = doc_ref_trans.get(transaction=transaction)
                     if snapshot.exists and not snapshot.get('processing'):
                         transaction.update(doc_ref_trans, {'processing': True, 'last_update': firestore.SERVER_TIMESTAMP})
-                        return True
-                    return False
+                        return snapshot.to_dict() # Exatamente o lote marcado: o processamento não relê o documento
+                    return None
 
-                if mark_as_processing(self.db.transaction(), doc_ref):
-                    self._process_pending_messages(chat_id)
+                pending_data = mark_as_processing(self.db.transaction(), doc_ref)
+                if pending_data is not None:
+                    self._process_pending_messages(chat_id, pending_data)
 
         except Exception as e:
             logger.error(f"Erro ao verificar mensagens pendentes para {chat_id}: {e}", exc_info=True)
@@ -1527,17 +2380,162 @@ class WhatsAppGeminiBot:
                  logger.error(f"Erro ao tentar resetar 'processing' para {chat_id}: {e_update}")
 
 
-    def _process_pending_messages(self, chat_id: str):
-        """Processa todas as mensagens acumuladas, incluindo mídias."""
+    def _process_single_pending(self, msg_data: Dict[str, Any], chat_id: str) -> List[str]:
+        """Converte uma mensagem pendente em textos para o prompt (mídias são baixadas e descritas pelo Gemini)."""
+        entries: List[str] = []
+        msg_type = msg_data['type']
+        content = msg_data['content'] # Texto ou media_url
+        original_caption = msg_data.get('original_caption')
+        mimetype = msg_data.get('mimetype')
+
+        if msg_type == 'text':
+            if content and content.strip():
+                entries.append(content.strip())
+        elif msg_type in ['audio', 'image', 'voice', 'video', 'document']:
+            media_url = content
+            if not mimetype:
+                # Tentar inferir mimetype da URL como último recurso (pouco confiável)
+                # Idealmente, Whapi sempre envia mimetype.
+                try:
+                    logger.info("Attempting to infer mimetype from URL: %s", media_url)
+                    url_path = media_url.split('?', 1)[0] # Remove query params
+                    file_ext = os.path.splitext(url_path)[1].lower()
+                    mimetype = _EXT_TO_MIME.get(file_ext) or mimetypes.guess_type(url_path)[0]
+                    if not mimetype:
+                        logger.warning(f"Mimetype não fornecido e não pôde ser inferido da URL: {media_url}")
+                except Exception:
+                    logger.warning(f"Falha ao tentar inferir mimetype da URL: {media_url}")
+
+            if not mimetype:
+                logger.error(f"Mimetype não disponível para mídia {media_url} do chat {chat_id}. Pulando mídia.")
+                entries.append(f"[Erro: Tipo de arquivo da mídia não identificado ({media_url})]")
+                if original_caption: entries.append(f"Legenda original: {original_caption}")
+                return entries
+
+            file_part_uploaded = None
+            try:
+                logger.info("Baixando e enviando mídia para Gemini: %s (mimetype: %s)", media_url, mimetype)
+
+                image_bytes, media_file = self._download_media(media_url)
+                if media_file is not None:
+                    # Arquivos grandes vão pela Files API (inline, o base64 estouraria o limite da requisição),
+                    # enviados direto do arquivo temporário, sem cópia em memória
+                    try:
+                        file_part_uploaded = self.client.files.upload(
+                            file=media_file,
+                            config=types.UploadFileConfig(mime_type=mimetype)
+                        )
+                    finally:
+                        media_file.close()
+                    image = self._wait_for_uploaded_file(file_part_uploaded)
+                else:
+                    # Arquivos pequenos seguem inline: uma requisição só, sem upload separado
+                    image = types.Part.from_bytes(data=image_bytes, mime_type=mimetype)
+
+                prompt_for_media = self.MEDIA_DESCRIPTION_PROMPTS.get(msg_type, self.MEDIA_DESCRIPTION_PROMPT)
+
+                # Gerar descrição/transcrição
+                media_desc_response = self.client.models.generate_content(
+                    model=self.gemini_model_name,
+                    contents=[prompt_for_media, image],
+                    config=self.model_config,
+                )
+                media_description = self._extract_text(media_desc_response)
+
+                if msg_type == 'audio':
+                    entry = f"O usuário enviou um audio"
+                    entry += f": [Conteúdo processado do audio: {media_description}], mantenha esse conteudo na resposta e envie entre *asteriscos*, abaixo disso um resumo também."
+                elif msg_type == 'image':
+                    entry = f"O usuário enviou uma imagem"
+                    entry += f": [Conteúdo processado da imagem: {media_description}]."
+                elif msg_type == 'voice':
+                    entry = f"O usuário enviou uma mensagem de voz"
+                    entry += f": [Conteúdo processado da mensagem de voz: {media_description}], responda normalmente como se fosse uma mensagem de texto."
+                elif msg_type == 'video':
+                    entry = f"O usuário enviou um video"
+                    entry += f": [Conteúdo processado do video: {media_description}]."
+                elif msg_type == 'document':
+                    entry = f"O usuário enviou um documento"
+                    entry += f": [Conteúdo processado do documento: {media_description}]."
+                entries.append(entry)
+
+            except requests.exceptions.RequestException as e_req:
+                logger.error(f"Erro de request ao baixar mídia {media_url} para {chat_id}: {e_req}")
+                entries.append(f"[Erro ao baixar {msg_type} ({media_url})]")
+                if original_caption: entries.append(f"Legenda original: {original_caption}")
+            except Exception as e_gemini:
+                logger.error(f"Erro ao processar mídia {media_url} com Gemini para {chat_id}: {e_gemini}", exc_info=True)
+                entries.append(f"[Erro ao processar {msg_type} com Gemini ({media_url})]")
+                if original_caption: entries.append(f"Legenda original: {original_caption}")
+            finally:
+                # Arquivos enviados pela Files API ficam até 48h ocupando a cota do projeto: apaga após o uso
+                if file_part_uploaded:
+                    try:
+                        self.client.files.delete(name=file_part_uploaded.name)
+                        logger.info("Arquivo %s removido do Gemini após o processamento.", file_part_uploaded.name)
+                    except Exception as e_delete:
+                        logger.warning(f"Falha ao tentar deletar arquivo {file_part_uploaded.name} no Gemini: {e_delete}")
+        return entries
+
+    def _wait_for_uploaded_file(self, uploaded_file):
+        """Espera o arquivo da Files API ficar ACTIVE (vídeos e áudios grandes passam um tempo em PROCESSING,
+           e usá-los antes disso falha com FAILED_PRECONDITION). Levanta RuntimeError se falhar ou demorar demais.
+        """
+        deadline = time.monotonic() + self.MEDIA_FILE_ACTIVE_TIMEOUT_SECONDS
+        while uploaded_file.state == types.FileState.PROCESSING:
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Arquivo {uploaded_file.name} ainda em processamento após {self.MEDIA_FILE_ACTIVE_TIMEOUT_SECONDS}s")
+            time.sleep(self.MEDIA_FILE_POLL_INTERVAL_SECONDS)
+            uploaded_file = self.client.files.get(name=uploaded_file.name)
+        if uploaded_file.state == types.FileState.FAILED:
+            raise RuntimeError(f"Processamento do arquivo {uploaded_file.name} falhou no Gemini: {uploaded_file.error}")
+        return uploaded_file
+
+    def _download_media(self, media_url: str) -> Tuple[Optional[bytes], Optional[Any]]:
+        """Baixa a mídia em blocos de MEDIA_DOWNLOAD_CHUNK_BYTES.
+           Retorna (bytes, None) se ela cabe inline, ou (None, arquivo temporário posicionado no início)
+           quando passa de MEDIA_INLINE_MAX_BYTES; o chamador fecha o arquivo.
+        """
+        buffer = io.BytesIO()
+        try:
+            # A sessão da Whapi já envia o token, caso as URLs de mídia sejam protegidas
+            with self._whapi_session.get(media_url, timeout=60, stream=True) as media_response:
+                media_response.raise_for_status()
+                for chunk in media_response.iter_content(chunk_size=self.MEDIA_DOWNLOAD_CHUNK_BYTES):
+                    if isinstance(buffer, io.BytesIO) and buffer.tell() + len(chunk) > self.MEDIA_INLINE_MAX_BYTES:
+                        # Grande demais para inline: o restante vai para disco
+                        spill_file = tempfile.TemporaryFile()
+                        spill_file.write(buffer.getbuffer())
+                        buffer = spill_file
+                    buffer.write(chunk)
+        except Exception:
+            buffer.close()
+            raise
+        if isinstance(buffer, io.BytesIO):
+            return buffer.getvalue(), None
+        buffer.seek(0)
+        return None, buffer
+
+    @staticmethod
+    def _pending_message_sort_key(msg: Dict[str, Any]) -> int:
+        """Epoch em ms da mensagem pendente; converte o ISO apenas para payloads gravados antes de timestamp_ms."""
+        timestamp_ms = msg.get('timestamp_ms')
+        if timestamp_ms is None:
+            timestamp_ms = int(datetime.fromisoformat(msg['timestamp']).timestamp() * 1000)
+        return timestamp_ms
+
+    def _process_pending_messages(self, chat_id: str, data: Optional[Dict[str, Any]] = None):
+        """Processa todas as mensagens acumuladas, incluindo mídias. data é o documento lido ao marcar 'processing'."""
         doc_ref = self.db.collection("pending_messages").document(chat_id)
+        request_cache = RequestCache() # Leituras do Firestore compartilhadas durante este turno
         try:
-            
-            doc = doc_ref.get() # Obter os dados mais recentes
-            if not doc.exists:
-                logger.warning(f"Documento de mensagens pendentes para {chat_id} não encontrado ao iniciar processamento.")
-                return
+            if data is None:
+                doc = doc_ref.get() # Obter os dados mais recentes
+                if not doc.exists:
+                    logger.warning(f"Documento de mensagens pendentes para {chat_id} não encontrado ao iniciar processamento.")
+                    return
+                data = doc.to_dict()
 
-            data = doc.to_dict()
             pending_msg_list = data.get('messages', [])
             user_from_name = data.get('from_name', 'Usuário') # Fallback para 'Usuário'
 
@@ -1547,9 +2545,9 @@ class WhatsAppGeminiBot:
                 return
 
             
-            # Ordenar por timestamp (string ISO guardada)
+            # Ordenar por timestamp (epoch em ms; mensagens antigas só têm a string ISO)
             try:
-                pending_msg_list.sort(key=lambda x: datetime.fromisoformat(x['timestamp']))
+                pending_msg_list.sort(key=self._pending_message_sort_key)
             except (TypeError, ValueError) as e_sort:
                 logger.error(f"Erro ao ordenar mensagens pendentes para {chat_id} por timestamp: {e_sort}. Usando ordem atual.")
 
@@ -1573,127 +2571,39 @@ class WhatsAppGeminiBot:
             processed_texts_for_gemini = []
             all_message_ids = [msg['message_id'] for msg in pending_msg_list]
 
-            for msg_data in pending_msg_list:
-                msg_type = msg_data['type']
-                content = msg_data['content'] # Texto ou media_url
-                original_caption = msg_data.get('original_caption')
-                mimetype = msg_data.get('mimetype')
-
-                if msg_type == 'text':
-                    if content and content.strip():
-                        processed_texts_for_gemini.append(content.strip())
-                elif msg_type in ['audio', 'image', 'voice', 'video', 'document']:
-                    media_url = content
-                    if not mimetype:
-                        # Tentar inferir mimetype da URL como último recurso (pouco confiável)
-                        # Idealmente, Whapi sempre envia mimetype.
-                        try:
-                            logger.info(f"Attempting to infer mimetype from URL: {media_url}")
-                            file_ext = os.path.splitext(media_url.split('?')[0])[1].lower() # Remove query params
-                            if file_ext == ".jpg" or file_ext == ".jpeg": mimetype = "image/jpeg"
-                            elif file_ext == ".png": mimetype = "image/png"
-                            elif file_ext == ".mp3": mimetype = "audio/mp3"
-                            elif file_ext == ".oga": mimetype = "audio/ogg" # Comum para PTT
-                            elif file_ext == ".opus": mimetype = "audio/opus"
-                            elif file_ext == ".wav": mimetype = "audio/wav"
-                            elif file_ext == ".mp4" or file_ext == "mp4": mimetype = "video/mp4"
-                            elif file_ext == ".pdf": mimetype = "application/pdf"
-                            else: logger.warning(f"Mimetype não fornecido e não pôde ser inferido da URL: {media_url}")
-                        except Exception:
-                            logger.warning(f"Falha ao tentar inferir mimetype da URL: {media_url}")
-                    
-                    if not mimetype:
-                        logger.error(f"Mimetype não disponível para mídia {media_url} do chat {chat_id}. Pulando mídia.")
-                        processed_texts_for_gemini.append(f"[Erro: Tipo de arquivo da mídia não identificado ({media_url})]")
-                        if original_caption: processed_texts_for_gemini.append(f"Legenda original: {original_caption}")
-                        continue
-                    
-                    file_part_uploaded = None
-                    try:
-                        logger.info(f"Baixando e enviando mídia para Gemini: {media_url} (mimetype: {mimetype})")
-                        
-                        # Cabeçalhos para request de mídia, Whapi pode exigir autenticação
-                        media_req_headers = {}
-                        if self.whapi_api_key: # Adicionar token se a Whapi proteger URLs de mídia
-                             media_req_headers['Authorization'] = f"Bearer {self.whapi_api_key}"
-                        
-                        media_response = requests.get(media_url, stream=True, timeout=60, headers=media_req_headers)
-                        media_response.raise_for_status()
-                        media_response.raw.decode_content = True
-
-                        image_bytes = requests.get(media_url).content
-                        image = types.Part.from_bytes(data=image_bytes, mime_type=mimetype)
+            # Mídias são independentes entre si: download + descrição rodam em paralelo.
+            # map() mantém a ordem das mensagens; textos não fazem I/O.
+            media_count = sum(1 for msg in pending_msg_list if msg['type'] != 'text')
+            if media_count > 1:
+                with ThreadPoolExecutor(max_workers=min(media_count, self.MEDIA_PROCESSING_MAX_WORKERS)) as executor:
+                    per_message_entries = list(executor.map(lambda msg: self._process_single_pending(msg, chat_id), pending_msg_list))
+            else:
+                per_message_entries = [self._process_single_pending(msg, chat_id) for msg in pending_msg_list]
+            for entries in per_message_entries:
+                processed_texts_for_gemini.extend(entries)
 
-                    
-                        prompt_for_media = "Descreva este arquivo de forma concisa e detalhada e retorne apenas a descrição, nada além disso, nenhuma palavra a mais."
-                        if msg_type == 'audio' or msg_type == 'voice':
-                            prompt_for_media = "Transcreva este audio, exatamente como está e me retorne apenas a transcriçao nenhuma palavra a mais, apenas a transcriçao."
-                        elif msg_type == 'document':
-                            prompt_for_media = "Descreva este arquivo pdf de forma concisa e objetiva. Anote todas as informações relevantes e me retorne apenas a descrição, nada além disso."
-                        
-                        # Gerar descrição/transcrição
-                        media_desc_response = self.client.models.generate_content(
-                            model=self.gemini_model_name,
-                            contents=[prompt_for_media, image],
-                            config=self.model_config,
-                        )
-                        media_description = media_desc_response.text.strip()
-                        
-                        if msg_type == 'audio':
-                            entry = f"O usuário enviou um audio"
-                            entry += f": [Conteúdo processado do audio: {media_description}], mantenha esse conteudo na resposta e envie entre *asteriscos*, abaixo disso um resumo também."
-                        elif msg_type == 'image':
-                            entry = f"O usuário enviou uma imagem"
-                            entry += f": [Conteúdo processado da imagem: {media_description}]."
-                        elif msg_type == 'voice':
-                            entry = f"O usuário enviou uma mensagem de voz"
-                            entry += f": [Conteúdo processado da mensagem de voz: {media_description}], responda normalmente como se fosse uma mensagem de texto."
-                        elif msg_type == 'video':
-                            entry = f"O usuário enviou um video"
-                            entry += f": [Conteúdo processado do video: {media_description}]."
-                        elif msg_type == 'document':
-                            entry = f"O usuário enviou um documento"
-                            entry += f": [Conteúdo processado do documento: {media_description}]."
-                        processed_texts_for_gemini.append(entry)
-
-                    except requests.exceptions.RequestException as e_req:
-                        logger.error(f"Erro de request ao baixar mídia {media_url} para {chat_id}: {e_req}")
-                        processed_texts_for_gemini.append(f"[Erro ao baixar {msg_type} ({media_url})]")
-                        if original_caption: processed_texts_for_gemini.append(f"Legenda original: {original_caption}")
-                    except Exception as e_gemini:
-                        logger.error(f"Erro ao processar mídia {media_url} com Gemini para {chat_id}: {e_gemini}", exc_info=True)
-                        processed_texts_for_gemini.append(f"[Erro ao processar {msg_type} com Gemini ({media_url})]")
-                        if original_caption: processed_texts_for_gemini.append(f"Legenda original: {original_caption}")
-                    finally:
-                        # Limpeza do arquivo no Gemini (se necessário e aplicável para genai.upload_file)
-                        # A documentação sugere que `genai.upload_file` é para uso único e os arquivos
-                        # são temporários. Se usar `client.files.create`, então `client.files.delete` seria necessário.
-                        # Por segurança, pode-se tentar deletar, mas pode dar erro se já foi limpo.
-                        if file_part_uploaded:
-                            try:
-                                # genai.delete_file(file_part_uploaded.name) # Descomentar se necessário
-                                logger.info(f"Arquivo {file_part_uploaded.name} processado. (Limpeza no Gemini geralmente automática para upload_file)")
-                            except Exception as e_delete:
-                                logger.warning(f"Falha ao tentar deletar arquivo {file_part_uploaded.name} no Gemini: {e_delete}")
-                                
             # Consolidar todos os textos processados
             full_user_input_text = "\n".join(processed_texts_for_gemini).strip()
-            logger.info(f"Texto completo do {user_from_name} processado: {full_user_input_text}")
+            logger.info("Texto completo do %s processado: %s", user_from_name, full_user_input_text)
 
             if not full_user_input_text:
-                logger.info(f"Nenhum texto processável após processar mensagens pendentes para {chat_id}. Limpando e saindo.")
-                self._delete_pending_messages(chat_id)
+                logger.info("Nenhum texto processável após processar mensagens pendentes para %s. Limpando e saindo.", chat_id)
+                self._delete_pending_messages(chat_id, all_message_ids)
                 return # Não há nada para responder
 
             
-            # Gerar resposta do Gemini
-            response_text = self.generate_gemini_response(full_user_input_text, chat_id, current_interaction_timestamp)
+            response_text = self._match_quick_reply(full_user_input_text)
+            if response_text:
+                logger.info("Mensagem trivial de %s respondida sem Gemini.", chat_id)
+            else:
+                # Gerar resposta do Gemini
+                response_text = self.generate_gemini_response(full_user_input_text, chat_id, current_interaction_timestamp, cache=request_cache)
 
             # NOVO: Verificar se a resposta do Gemini indica criação de lembrete
             reminder_details = self._detect_reminder_in_gemini_response(response_text)
             
             if reminder_details.get("found"):
-                logger.info(f"Lembrete detectado na resposta do Gemini para {chat_id}")
+                logger.info("Lembrete detectado na resposta do Gemini para %s", chat_id)
                 
                 # Se faltam detalhes, usar a mensagem original para complementar
                 if not reminder_details.get("content") or not reminder_details.get("datetime_obj"):
@@ -1711,7 +2621,7 @@ class WhatsAppGeminiBot:
                     datetime_utc = reminder_details["datetime_obj"]
                     if datetime_utc.tzinfo is None:
                         # Se não tem timezone, assumir São Paulo e converter para UTC
-                        datetime_sp = self.target_timezone.localize(datetime_utc)
+                        datetime_sp = datetime_utc.replace(tzinfo=self.target_timezone)
                         datetime_utc = datetime_sp.astimezone(timezone.utc)
                     elif datetime_utc.tzinfo != timezone.utc:
                         # Se tem timezone mas não é UTC, converter
@@ -1739,13 +2649,13 @@ class WhatsAppGeminiBot:
             # Enviar resposta ao WhatsApp
             last_message_id_to_reply = all_message_ids[-1] if all_message_ids else None
             if self.send_whatsapp_message(chat_id, response_text, reply_to=last_message_id_to_reply):
-                logger.info(f"Resposta enviada com sucesso para {chat_id}.")
+                logger.info("Resposta enviada com sucesso para %s.", chat_id)
             else:
                 logger.error(f"Falha ao enviar resposta para {chat_id}.")
 
             # Atualizar histórico e limpar mensagens pendentes
-            self.update_conversation_context(chat_id, full_user_input_text, response_text)
-            self._delete_pending_messages(chat_id) # Sucesso, deleta as pendentes
+            self.update_conversation_context(chat_id, full_user_input_text, response_text, cache=request_cache)
+            self._delete_pending_messages(chat_id, all_message_ids) # Sucesso, remove as pendentes deste lote
 
         except Exception as e:
             logger.error(f"ERRO CRÍTICO ao processar mensagens para {chat_id}: {e}", exc_info=True)
@@ -1755,17 +2665,52 @@ class WhatsAppGeminiBot:
             except Exception as e_update_fail:
                 logger.error(f"Falha ao resetar 'processing' para {chat_id} após erro: {e_update_fail}")
         finally:
-            # Garantir que o summarizer seja chamado se necessário, mesmo se houver falha no processamento principal
-            # (talvez não seja o melhor lugar, mas para garantir que rode)
-            self._summarize_chat_history_if_needed(chat_id)
+            # Garantir que o summarizer seja chamado se necessário, mesmo se houver falha no processamento principal.
+            # Roda em segundo plano: o resumo só é lido nos próximos turnos.
+            self._schedule_summarization(chat_id)
 
 
+    def _backfill_last_reengagement_attempt(self):
+        """
+        Migração única: o Firestore ignora documentos sem o campo de um filtro de desigualdade, então contextos
+        gravados antes de last_reengagement_attempt nunca apareceriam na query de _check_inactive_chats
+        (e um chat já inativo não tem um próximo turno que grave o campo).
+        Grava REENGAGEMENT_NEVER_ATTEMPTED neles; um documento em "migrations" evita repetir a varredura.
+        """
+        marker_ref = self.db.collection("migrations").document("last_reengagement_attempt_backfill")
+        if marker_ref.get(field_paths=[]).exists:
+            self._reengagement_backfill_done = True
+            return
+
+        batch = self.db.batch()
+        batch_writes = 0
+        backfilled = 0
+        contexts_query = self.db.collection("conversation_contexts").select(["last_reengagement_attempt"])
+        for doc_context in contexts_query.stream():
+            if "last_reengagement_attempt" in (doc_context.to_dict() or {}):
+                continue
+            if batch_writes >= self.FIRESTORE_BATCH_MAX_WRITES - 1: # Reserva espaço para o marcador
+                batch.commit()
+                batch = self.db.batch()
+                batch_writes = 0
+            batch.set(doc_context.reference, {"last_reengagement_attempt": self.REENGAGEMENT_NEVER_ATTEMPTED}, merge=True)
+            batch_writes += 1
+            backfilled += 1
+        batch.set(marker_ref, {"completed_at": firestore.SERVER_TIMESTAMP, "backfilled": backfilled})
+        batch.commit()
+        self._reengagement_backfill_done = True
+        logger.info("last_reengagement_attempt preenchido em %s contextos antigos.", backfilled)
+
     def _check_inactive_chats(self):
         """Verifica chats inativos para reengajamento inteligente."""
         try:
             logger.info("Verificando chats inativos para reengajamento...")
+            if not self._reengagement_backfill_done:
+                self._backfill_last_reengagement_attempt()
             # Limite de tempo para considerar um chat inativo
-            cutoff_reengagement = datetime.now(timezone.utc) - timedelta(seconds=self.REENGAGEMENT_TIMEOUT)
+            now = datetime.now(timezone.utc)
+            cutoff_reengagement = now - timedelta(seconds=self.REENGAGEMENT_TIMEOUT)
+            cutoff_last_attempt = now - timedelta(seconds=self.REENGAGEMENT_MIN_INTERVAL_SECONDS)
 
             # Consulta para encontrar o último timestamp por chat_id no histórico
             # Esta query pode ser complexa/ineficiente em Firestore para muitos chats.
@@ -1775,73 +2720,100 @@ class WhatsAppGeminiBot:
             # Obter todos os chat_ids distintos da coleção conversation_contexts
             # (onde armazenamos last_updated, o que pode servir de proxy)
             contexts_ref = self.db.collection("conversation_contexts")
-            # Order by last_updated and filter those older than cutoff
-            query = contexts_ref.where(filter=FieldFilter("last_updated", "<", cutoff_reengagement)).stream()
+            # Filtra no servidor os chats inativos sem reengajamento nas últimas 23 horas
+            # (índice composto em last_updated + last_reengagement_attempt).
+            # Apenas o ID do documento é usado, então projetar somente "last_updated"
+            query = (
+                contexts_ref
+                .where(filter=FieldFilter("last_updated", "<", cutoff_reengagement))
+                .where(filter=FieldFilter("last_reengagement_attempt", "<", cutoff_last_attempt))
+                .select(["last_updated"])
+                .stream()
+            )
 
-            processed_chats_for_reengagement = set()
+            candidate_ids = [doc_context.id for doc_context in query]
+            if not candidate_ids:
+                return
 
-            for doc_context in query:
-                chat_id = doc_context.id
-                if chat_id in processed_chats_for_reengagement:
+            # Logs de reengajamento e resumos de todos os candidatos em uma única leitura em lote
+            logs_ref = self.db.collection("reengagement_logs")
+            summaries_ref = self.db.collection("conversation_summaries")
+            refs = [logs_ref.document(chat_id) for chat_id in candidate_ids] + \
+                   [summaries_ref.document(chat_id) for chat_id in candidate_ids]
+            last_sent_by_chat: Dict[str, datetime] = {}
+            summary_by_chat: Dict[str, str] = {}
+            for snapshot in self.db.get_all(refs):
+                if not snapshot.exists:
                     continue
-
-                # Verificar se já houve reengajamento recente
-                reengagement_log_ref = self.db.collection("reengagement_logs").document(chat_id)
-                reengagement_log_doc = reengagement_log_ref.get()
-                if reengagement_log_doc.exists:
-                    last_sent_reengagement = reengagement_log_doc.get("last_sent")
-                    # Não reenviar se já foi feito nas últimas N horas (ex: 23 horas para evitar spam diário)
-                    if (datetime.now(timezone.utc) - last_sent_reengagement) < timedelta(hours=23):
-                        logger.debug(f"Reengajamento recente para {chat_id}, pulando.")
+                snapshot_data = snapshot.to_dict()
+                if snapshot.reference.parent.id == "reengagement_logs":
+                    if snapshot_data.get("last_sent"):
+                        last_sent_by_chat[snapshot.id] = snapshot_data["last_sent"]
+                else:
+                    summary_by_chat[snapshot.id] = snapshot_data.get("summary") or ""
+
+            # Cada reengajamento espera por Firestore, Gemini e Whapi: os chats são processados em paralelo.
+            # _send_reengagement_message trata as próprias falhas, então um chat não interrompe os demais.
+            with ThreadPoolExecutor(max_workers=self.REENGAGEMENT_MAX_WORKERS, thread_name_prefix="Reengagement") as executor:
+                for chat_id in candidate_ids:
+                    last_sent = last_sent_by_chat.get(chat_id)
+                    if last_sent and last_sent >= cutoff_last_attempt:
+                        # O log registra envio recente mesmo que o contexto não tenha sido atualizado
+                        logger.debug(f"Reengajamento recente para {chat_id} (reengagement_logs), pulando.")
                         continue
-                
-                logger.info(f"Chat {chat_id} inativo. Tentando reengajamento inteligente.")
-                self._send_reengagement_message(chat_id)
-                processed_chats_for_reengagement.add(chat_id)
-                time.sleep(1) # Pequeno delay para não sobrecarregar APIs
+                    logger.info("Chat %s inativo. Tentando reengajamento inteligente.", chat_id)
+                    executor.submit(self._send_reengagement_message, chat_id, summary_by_chat.get(chat_id, ""))
 
         except Exception as e:
             logger.error(f"Erro ao verificar chats inativos: {e}", exc_info=True)
 
-    def _send_reengagement_message(self, chat_id: str):
-        """Envia mensagem de reengajamento gerada pelo Gemini com base no histórico."""
+    def _claim_reengagement(self, reengagement_log_ref) -> Optional[Dict[str, Any]]:
+        """
+        Reserva o reengajamento do chat de forma atômica (marca last_sent antes de enviar).
+        Retorna os dados anteriores do log se a reserva foi feita, ou None se já houve envio recente.
+        """
+        @firestore.transactional
+        def claim_in_transaction(transaction, log_ref):
+            snapshot = log_ref.get(transaction=transaction)
+            previous_log = snapshot.to_dict() if snapshot.exists else {}
+            last_sent = previous_log.get("last_sent")
+            if last_sent and (datetime.now(timezone.utc) - last_sent) < timedelta(seconds=self.REENGAGEMENT_MIN_INTERVAL_SECONDS):
+                return None
+            transaction.set(log_ref, {"last_sent": firestore.SERVER_TIMESTAMP}, merge=True)
+            return previous_log
+
+        return claim_in_transaction(self.db.transaction(), reengagement_log_ref)
+
+    def _release_reengagement_claim(self, reengagement_log_ref, previous_log: Dict[str, Any]):
+        """Desfaz a reserva de _claim_reengagement quando o envio falha, permitindo nova tentativa."""
+        try:
+            reengagement_log_ref.set({"last_sent": previous_log.get("last_sent") or firestore.DELETE_FIELD}, merge=True)
+        except Exception as e:
+            logger.error(f"Erro ao liberar reserva de reengajamento {reengagement_log_ref.id}: {e}")
+
+    def _send_reengagement_message(self, chat_id: str, summary_text: Optional[str] = None):
+        """Envia mensagem de reengajamento gerada pelo Gemini com base no histórico.
+           summary_text: resumo já lido pelo chamador (ex: em lote); se None, é buscado aqui.
+        """
+        reengagement_log_ref = self.db.collection("reengagement_logs").document(chat_id)
+        previous_log = None
         try:
-            
-            # Obter resumo (se houver) e histórico recente
-            summary_ref = self.db.collection("conversation_summaries").document(chat_id)
-            summary_doc = summary_ref.get()
-            summary_text = summary_doc.get("summary") if summary_doc.exists else ""
+            # Reserva atômica: evita envios duplicados se outro worker processar o mesmo chat
+            previous_log = self._claim_reengagement(reengagement_log_ref)
+            if previous_log is None:
+                logger.debug(f"Reengajamento recente para {chat_id}, pulando.")
+                return
 
-            history_list = self._get_conversation_history(chat_id, limit=25) # Últimas 10 trocas
+            # Obter resumo (se não veio do chamador) e histórico recente em paralelo: o resumo vai para o pool
+            # de I/O compartilhado enquanto esta thread lê o histórico (sem criar um pool por chamada)
+            summary_future = self._io_executor.submit(self._get_previous_summary, chat_id) if summary_text is None else None
+            history_list = self._get_conversation_history(chat_id, 25) # Últimas 10 trocas
+            if summary_future is not None:
+                summary_text = summary_future.result()
             
-            history_parts_reengagement = []
-            for msg in history_list:
-                role = "Usuário" if not msg.get('is_bot', False) else "Assistente"
-                history_parts_reengagement.append(f"{role}: {msg['message_text']}")
-            history_str_reengagement = "\n".join(history_parts_reengagement)
-
-            reengagement_instruction = (
-                "O usuário deste chat não interage há algum tempo (cerca de 36 horas ou mais). "
-                "Seu objetivo é gerar uma mensagem de reengajamento curta, amigável e personalizada, focando em despertar o interesse do usuário e incentivá-lo a retomar a conversa. "
-                "Siga as seguintes diretrizes, priorizando as opções de reengajamento mais relevantes e interessantes:"
-                "\n\n"
-                "1. **Análise do histórico:** Primeiramente, examine o histórico de conversa do usuário e/ou o resumo da conversa (se disponível). "
-                "   - **Tópico recente:** Se houver um tópico recente claramente definido, comece por perguntar se ele ainda precisa de ajuda ou se gostaria de continuar a discussão sobre esse assunto. "
-                "   - **Interesses inferidos:** Tente identificar interesses ou temas recorrentes no histórico de conversa. Use esses insights para sugerir tópicos relacionados ou informações adicionais que possam ser do seu interesse."
-                "\n\n"
-                "2. **Pesquisa web para assuntos relacionados:** Se o histórico de conversa permitir a identificação de tópicos ou interesses, faça uma pesquisa web para encontrar notícias recentes, curiosidades ou desenvolvimentos relevantes sobre esses temas. "
-                "   - Apresente uma breve e intrigante informação encontrada, convidando o usuário a explorar mais."
-                "\n\n"
-                "3. **Criatividade e assuntos aleatórios:** Se não houver histórico de conversa substancial ou se os interesses do usuário não forem claros, use sua criatividade para puxar um assunto aleatório, mas que seja potencialmente interessante. "
-                "   - Você pode: "
-                "     - Mencionar uma notícia popular ou um evento atual (se relevante e não sensível). "
-                "     - Fazer uma pergunta curiosa sobre um tema geral (tecnologia, ciência, cultura, etc.). "
-                "     - Sugerir uma nova funcionalidade ou capacidade do Gemini (se aplicável). "
-                "\n\n"
-                "4. **Abertura geral:** Se as opções acima não se aplicarem ou não forem eficazes, ou se você precisar de uma alternativa mais genérica, envie uma saudação amigável perguntando simplesmente como pode ser útil hoje ou como o usuário está. "
-                "\n\n"
-                "5. **Tom e concisão:** Mantenha a mensagem concisa, natural e convidativa. Evite parecer robótico ou excessivamente formal. O objetivo é reaquecer a interação de forma orgânica. "
-                "   - Exemplo de saudação amigável: 'Oi! Já faz um tempinho que não conversamos. Como posso te ajudar hoje?'"
+            history_str_reengagement = "\n".join(
+                f"{'Assistente' if msg.get('is_bot', False) else 'Usuário'}: {msg['message_text']}"
+                for msg in history_list
             )
 
             context_for_reengagement_prompt = ""
@@ -1853,23 +2825,16 @@ class WhatsAppGeminiBot:
             if not context_for_reengagement_prompt: # Sem histórico ou resumo
                  context_for_reengagement_prompt = "Não há histórico de conversa anterior com este usuário.\n"
 
-            full_reengagement_prompt = reengagement_instruction + context_for_reengagement_prompt + "\nMensagem de reengajamento gerada:"
-
-            logger.info(f"Gerando mensagem de reengajamento para {chat_id} com prompt: {full_reengagement_prompt[:300]}...")
+            full_reengagement_prompt = self.REENGAGEMENT_INSTRUCTION + context_for_reengagement_prompt + "\nMensagem de reengajamento gerada:"
 
-            google_search_tool = Tool(google_search=GoogleSearch())
+            logger.info("Gerando mensagem de reengajamento para %s com prompt: %s...", chat_id, full_reengagement_prompt[:300])
 
             reengagement_response = self.client.models.generate_content(
                 model=self.gemini_model_name,
                 contents=full_reengagement_prompt,
-                config=GenerateContentConfig(
-                    tools=[google_search_tool],
-                    response_modalities=["TEXT"],
-                    system_instruction=self.gemini_context,
-                    temperature=0.85
-                )
+                config=self._search_config(temperature=0.85)
             )
-            reengagement_message_text = reengagement_response.text.strip()
+            reengagement_message_text = self._extract_text(reengagement_response)
 
             if not reengagement_message_text or len(reengagement_message_text) < 10: # Validação mínima
                 logger.warning(f"Mensagem de reengajamento gerada para {chat_id} é muito curta ou vazia: '{reengagement_message_text}'. Usando fallback.")
@@ -1879,56 +2844,66 @@ class WhatsAppGeminiBot:
             # Envia a mensagem
             if self.send_whatsapp_message(chat_id, reengagement_message_text, reply_to=None):
                 # Registra o envio bem-sucedido
-                reengagement_log_ref = self.db.collection("reengagement_logs").document(chat_id)
                 reengagement_log_ref.set({
                     "last_sent": firestore.SERVER_TIMESTAMP,
                     "message_sent": reengagement_message_text,
-                    "prompt_used_hash": hash(full_reengagement_prompt) # Para debug, se necessário
+                    "prompt_used_hash": hash_texto(full_reengagement_prompt) # Para debug, se necessário
                 }, merge=True)
-                logger.info(f"Mensagem de reengajamento inteligente enviada para {chat_id}: {reengagement_message_text}")
+                self.db.collection("conversation_contexts").document(chat_id).update({
+                    "last_reengagement_attempt": firestore.SERVER_TIMESTAMP
+                })
+                logger.info("Mensagem de reengajamento inteligente enviada para %s: %s", chat_id, reengagement_message_text)
                 # Adiciona ao histórico do chat que o bot tentou reengajar
                 self._save_conversation_history(chat_id, reengagement_message_text, True)
             else:
                 logger.error(f"Falha ao enviar mensagem de reengajamento para {chat_id}.")
+                self._release_reengagement_claim(reengagement_log_ref, previous_log)
 
         except Exception as e:
             logger.error(f"Erro ao gerar/enviar mensagem de reengajamento para {chat_id}: {e}", exc_info=True)
+            if previous_log is not None:
+                self._release_reengagement_claim(reengagement_log_ref, previous_log)
+
+    def _match_quick_reply(self, text: str) -> Optional[str]:
+        """Retorna uma resposta pronta se o texto for uma mensagem trivial, ou None."""
+        for pattern, replies in self.QUICK_REPLY_RULES:
+            if pattern.match(text):
+                return random.choice(replies)
+        return None
+
+    @staticmethod
+    def _extract_text(response) -> str:
+        """Concatena as partes de texto do primeiro candidato da resposta do Gemini.
+           Ignora partes sem texto (ex: chamadas de ferramenta), ao contrário de response.text.
+        """
+        if not (response.candidates and response.candidates[0].content and response.candidates[0].content.parts):
+            return ""
+        return "".join(getattr(part, 'text', None) or "" for part in response.candidates[0].content.parts).strip()
 
-    def generate_gemini_response(self, current_input_text: str, chat_id: str, current_message_timestamp: datetime, from_name: Optional[str] = None) -> str:
+    def generate_gemini_response(self, current_input_text: str, chat_id: str, current_message_timestamp: datetime, from_name: Optional[str] = None, cache: Optional[RequestCache] = None) -> str:
         """Gera resposta do Gemini considerando o contexto completo e usando Google Search tool."""
         try:
             # current_input_text é o texto já processado (incluindo descrições de mídia)
-            full_prompt_with_history = self.build_context_prompt(chat_id, current_input_text, current_message_timestamp, from_name) # Passar from_name
+            full_prompt_with_history = self.build_context_prompt(chat_id, current_input_text, current_message_timestamp, from_name, cache=cache) # Passar from_name
             
-            google_search_tool = Tool(google_search=GoogleSearch())
-
             response = self.client.models.generate_content(
                 model=self.gemini_model_name,
                 contents=[full_prompt_with_history],
-                config=GenerateContentConfig(
-                    tools=[google_search_tool],
-                    response_modalities=["TEXT"],
-                    system_instruction=self.gemini_context,
-                    temperature=0.55
-                )
+                config=self._search_config(temperature=0.55)
             )
             
             # Para extrair o texto da resposta quando tools são usadas:
             # A API pode retornar partes diferentes. Precisamos do texto gerado.
-            generated_text = ""
-            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'text'):
-                        generated_text += part.text
+            generated_text = self._extract_text(response)
             
             # Log se houve uso de ferramenta (grounding)
             if response.candidates and response.candidates[0].grounding_metadata:
                  search_entry = response.candidates[0].grounding_metadata.search_entry_point
                  if search_entry:
-                      logger.info(f"Gemini usou Google Search.")
+                      logger.info("Gemini usou Google Search.")
 
 
-            return generated_text.strip() if generated_text else "Desculpe, não consegui processar sua solicitação no momento."
+            return generated_text if generated_text else "Desculpe, não consegui processar sua solicitação no momento."
 
         except Exception as e:
             logger.error(f"Erro na chamada ao Gemini para chat {chat_id}: {e}", exc_info=True)
@@ -1936,14 +2911,23 @@ class WhatsAppGeminiBot:
 
     def send_whatsapp_message(self, chat_id: str, text: str, reply_to: Optional[str]) -> bool:
         """Envia mensagem formatada para o WhatsApp"""
+        future = self._enqueue_send(chat_id, text, reply_to=reply_to)
+        if future is None:
+            return False
+        # Aguarda o resultado para manter o retorno síncrono
+        return future.result()
+
+    def _enqueue_send(self, chat_id: str, text: str, reply_to: Optional[str] = None) -> Optional[Future]:
+        """Enfileira a mensagem na fila com limite de taxa sem aguardar o envio (None se os dados forem inválidos)."""
         if not text or not chat_id:
             logger.error("Dados inválidos para envio de mensagem: chat_id ou texto ausente.")
-            return False
+            return None
 
         # Limitar tamanho da mensagem se necessário (WhatsApp tem limites)
         max_len = 4096 
         if len(text) > max_len:
-            logger.warning(f"Mensagem para {chat_id} excedeu {max_len} caracteres. Será truncada.")
+            # Formatação adiada pelo logging (%s): só acontece se o nível estiver habilitado
+            logger.warning("Mensagem para %s excedeu %d caracteres. Será truncada.", chat_id, max_len)
             text = text[:max_len-3] + "..."
 
         payload = {
@@ -1953,19 +2937,19 @@ class WhatsAppGeminiBot:
         if reply_to:
             payload["reply"] = reply_to # Whapi usa "reply" para o ID da mensagem a ser respondida
 
+        return self._whapi_queue.submit(self._post_whatsapp_message, chat_id, payload)
+
+    def _post_whatsapp_message(self, chat_id: str, payload: Dict[str, Any]) -> bool:
+        """Executa o POST para a Whapi. Chamado apenas pela thread da DelayQueue."""
         try:
-            response = requests.post(
+            # Authorization/Accept já estão na sessão; Content-Type é definido pelo parâmetro json
+            response = self._whapi_session.post(
                 "https://gate.whapi.cloud/messages/text",
-                headers={
-                    "Authorization": f"Bearer {self.whapi_api_key}",
-                    "Content-Type": "application/json",
-                    "Accept": "application/json" # Adicionado por boa prática
-                },
                 json=payload,
                 timeout=20 # Timeout aumentado um pouco
             )
 
-            logger.info(f"Resposta WHAPI (Status {response.status_code}): {response.text}")
+            logger.info("Resposta WHAPI (Status %s): %s", response.status_code, response.text)
             response.raise_for_status() # Levanta erro para status >= 400
             return True # Whapi costuma retornar 200 ou 201 para sucesso
 
@@ -1978,130 +2962,176 @@ class WhatsAppGeminiBot:
         
         return False
 
-    def _summarize_chat_history_if_needed(self, chat_id: str):
+    def _summarize_chat_history_if_needed(self, chat_id: str, cache: Optional[RequestCache] = None):
         """Verifica se é hora de resumir o histórico e o faz."""
         try:
-            # Contar mensagens não resumidas
-            query = (
-                self.db.collection("conversation_history")
-                .where(filter=FieldFilter("chat_id", "==", chat_id))
-                .where(filter=FieldFilter("summarized", "==", False))
-            )
-            # Contar documentos pode ser caro. Uma alternativa é buscar com limit.
-            # Se o número de documentos retornados atingir o limite, então resumir.
-            docs_to_check = list(query.limit(26).stream()) # Um a mais que o limite para saber se passou
-
-            if len(docs_to_check) < 25: # Limite para resumir
+            # O contador mantido em _save_conversation_history evita consultar o histórico a cada turno.
+            # Sem o campo (contextos anteriores ao contador), segue para a consulta, que ressincroniza o valor.
+            context_ref = self.db.collection("conversation_contexts").document(chat_id)
+            context_doc = context_ref.get(field_paths=["unsummarized_count"])
+            unsummarized_count = (context_doc.to_dict() or {}).get("unsummarized_count") if context_doc.exists else None
+            if unsummarized_count is not None and unsummarized_count < self.SUMMARY_CHUNK_MESSAGES:
                 return
-            
-            # Pegar as mensagens para resumir (as 100 mais antigas não resumidas)
+
+            # Uma única consulta conta e traz as mensagens: se vierem menos que o lote, ainda não é hora de resumir
+            # Requer o índice composto em conversation_history: chat_id ASC, summarized ASC, timestamp ASC
             query_summarize = (
                 self.db.collection("conversation_history")
                 .where(filter=FieldFilter("chat_id", "==", chat_id))
                 .where(filter=FieldFilter("summarized", "==", False))
                 .order_by("timestamp", direction=firestore.Query.ASCENDING) # Mais antigas primeiro
-                .limit(25) # Resumir em lotes
+                .select(["message_text", "is_bot", "timestamp"]) # Apenas os campos usados no resumo
+                .limit(self.SUMMARY_CHUNK_MESSAGES) # Resumir em lotes
             )
             docs_to_summarize = list(query_summarize.stream())
 
-            if not docs_to_summarize:
+            if unsummarized_count is None or len(docs_to_summarize) < self.SUMMARY_CHUNK_MESSAGES:
+                # Contador ausente ou acima do real (chegou até aqui com menos mensagens que o lote)
+                self._resync_unsummarized_count(context_ref, query_summarize)
+
+            if len(docs_to_summarize) < self.SUMMARY_CHUNK_MESSAGES: # Limite para resumir
                 return
 
-            logger.info(f"Gerando resumo para {len(docs_to_summarize)} mensagens do chat {chat_id}")
+            logger.info("Gerando resumo para %s mensagens do chat %s", len(docs_to_summarize), chat_id)
             
             # Concatenar mensagens para o prompt de resumo
             # Adicionar papel (Usuário/Assistente) para clareza no resumo
-            message_texts_for_summary = []
-            for doc in docs_to_summarize:
-                data = doc.to_dict()
-                role = "Usuário" if not data.get("is_bot") else "Assistente"
-                message_texts_for_summary.append(f"{role}: {data.get('message_text', '')}")
-            
-            full_text_for_summary = "\n".join(message_texts_for_summary)
-
-            summary_prompt = (
-                "Você é um assistente encarregado de resumir conversas. Abaixo está um trecho das interações do usuário. "
-                "Seu objetivo é criar um resumo conciso que capture os pontos principais, decisões tomadas, informações importantes compartilhadas (nomes, locais, datas, preferências, problemas, soluções), "
-                "e o sentimento geral ou intenção da conversa. O resumo será usado para dar contexto a futuras interações, use o minimo possível de palavras e seja vem objetivo.\n\n"
-                "CONVERSA:\n"
-                f"{full_text_for_summary}\n\n"
+            full_text_for_summary = "\n".join(
+                f"{'Assistente' if data.get('is_bot') else 'Usuário'}: {data.get('message_text', '')}"
+                for data in (doc.to_dict() for doc in docs_to_summarize)
             )
+
+            summary_prompt = self.SUMMARY_PROMPT_TEMPLATE.format(conversation=full_text_for_summary)
             
             # Gerar resumo com Gemini (sem tools aqui)
             response = self.client.models.generate_content(
-            model=self.gemini_model_name,
-            contents=summary_prompt,
-            config=self.model_config
-        )
-            summary = response.text.strip()
+                model=self.gemini_model_name,
+                contents=summary_prompt,
+                config=self.model_config
+            )
+            summary = self._extract_text(response)
 
             if not summary:
                 logger.warning(f"Resumo gerado para {chat_id} está vazio. Não será salvo.")
                 return
 
-            # Obter resumo anterior, se existir, para concatenar
+            # Obter resumo anterior (cache em memória, com fallback para o Firestore)
             summary_ref = self.db.collection("conversation_summaries").document(chat_id)
-            summary_doc = summary_ref.get()
-            previous_summary = summary_doc.get("summary") if summary_doc.exists else ""
+            previous_summary = self._get_previous_summary(chat_id, cache)
             
-            # Novo resumo = resumo anterior + novo resumo (ou lógica mais inteligente de merge)
-            # Por simplicidade, vamos apenas adicionar o novo. Para um sistema robusto, um resumo do resumo pode ser melhor.
-            # Ou, o Gemini poderia receber o resumo anterior e o novo trecho para gerar um resumo atualizado.
-            # Por ora:
+            # Novo resumo = resumo anterior + novo trecho. Se passar de MAX_SUMMARY_CHARS, o Gemini
+            # reescreve tudo em um único resumo atualizado, mantendo o tamanho limitado.
             updated_summary = f"{previous_summary}\n\n[Novo trecho resumido em {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M')}]:\n{summary}".strip()
+            if previous_summary and len(updated_summary) > self.MAX_SUMMARY_CHARS:
+                updated_summary = self._rewrite_summary_with_gemini(previous_summary, summary, chat_id) or updated_summary
 
-
-            summary_ref.set({
+            # Salvar o resumo e marcar as mensagens como resumidas em um único commit
+            batch = self.db.batch()
+            batch.set(summary_ref, {
                 "summary": updated_summary,
+                "summary_token_estimate": len(updated_summary) // 4, # Estimativa grosseira (~4 caracteres por token)
                 "last_updated": firestore.SERVER_TIMESTAMP,
                 "last_chunk_timestamp": docs_to_summarize[-1].get("timestamp") # Timestamp da última msg resumida neste lote
             }, merge=True)
-
-            # Marcar as mensagens como resumidas
-            batch = self.db.batch()
-            for doc_to_mark in docs_to_summarize:
-                batch.update(doc_to_mark.reference, {"summarized": True})
+            for doc in docs_to_summarize:
+                batch.update(doc.reference, {"summarized": True})
+            batch.set(context_ref, {"unsummarized_count": firestore.Increment(-len(docs_to_summarize))}, merge=True)
             batch.commit()
-            logger.info(f"{len(docs_to_summarize)} mensagens marcadas como resumidas para o chat {chat_id}. Novo resumo salvo.")
+            self._cache_summary(chat_id, updated_summary)
+            self._invalidate_history_cache(chat_id) # As mensagens resumidas saem do histórico
+            if cache:
+                cache.invalidate(summary_ref)
+            logger.info("%s mensagens marcadas como resumidas para o chat %s. Novo resumo salvo.", len(docs_to_summarize), chat_id)
 
         except Exception as e:
             logger.error(f"Erro ao gerar/salvar resumo para o chat {chat_id}: {e}", exc_info=True)
 
+    def _resync_unsummarized_count(self, context_ref, query_summarize):
+        """
+        Grava em unsummarized_count a contagem da consulta (limitada ao tamanho do lote), numa transação que também
+        lê o contexto: um Increment gravado por _save_conversation_history nesse meio tempo faz a transação
+        repetir com a contagem atualizada, em vez de ser sobrescrito.
+        """
+        @firestore.transactional
+        def resync_in_transaction(transaction):
+            context_ref.get(field_paths=["unsummarized_count"], transaction=transaction)
+            unsummarized_docs = list(query_summarize.stream(transaction=transaction))
+            transaction.set(context_ref, {"unsummarized_count": len(unsummarized_docs)}, merge=True)
+
+        resync_in_transaction(self.db.transaction())
+
+    def _rewrite_summary_with_gemini(self, previous_summary: str, new_chunk_summary: str, chat_id: str) -> str:
+        """Funde o resumo anterior com o resumo do novo trecho em um único resumo conciso.
+           Retorna string vazia em caso de falha (o chamador mantém a concatenação).
+        """
+        rewrite_prompt = (
+            "Você mantém o resumo de uma conversa. Abaixo está o resumo atual e o resumo de um novo trecho da conversa. "
+            "Produza um único resumo atualizado, conciso, que preserve as informações importantes (nomes, locais, datas, preferências, problemas, soluções) "
+            f"e descarte o que ficou irrelevante ou repetido. Use no máximo {self.MAX_SUMMARY_CHARS // 2} caracteres.\n\n"
+            f"RESUMO ATUAL:\n{previous_summary}\n\n"
+            f"NOVO TRECHO:\n{new_chunk_summary}\n\n"
+            "RESUMO ATUALIZADO:"
+        )
+        try:
+            response = self.client.models.generate_content(
+                model=self.gemini_model_name,
+                contents=rewrite_prompt,
+                config=self.model_config
+            )
+            rewritten = self._extract_text(response)
+            if rewritten:
+                logger.info("Resumo do chat %s reescrito: %s -> %s caracteres.", chat_id, len(previous_summary) + len(new_chunk_summary), len(rewritten))
+            return rewritten
+        except Exception as e:
+            logger.error(f"Erro ao reescrever resumo do chat {chat_id} com Gemini: {e}", exc_info=True)
+            return ""
+
+    def _start_periodic_task(self, name: str, task: Callable[[], None], interval_seconds: float) -> threading.Thread:
+        """Executa task em uma thread própria a cada interval_seconds (a primeira execução após o primeiro intervalo).
+           Uma execução lenta atrasa apenas a própria tarefa, não as demais.
+        """
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    task()
+                except Exception as e:
+                    logger.error(f"Erro na tarefa periódica {name}: {e}", exc_info=True)
+
+        thread = threading.Thread(target=loop, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def _run_due_reminder_sweep(self):
+        """Varre os lembretes devidos só quando o heap indica vencimento (consulta ao Firestore evitada no resto do tempo)."""
+        if self._has_due_reminders(datetime.now(timezone.utc)):
+            self._check_and_send_due_reminders()
+
+    def _refresh_gemini_context_cache_if_needed(self):
+        """Renova o cache de contexto do Gemini antes que o TTL expire."""
+        if time.monotonic() - self._gemini_cache_refreshed_at >= self.GEMINI_CACHE_TTL_SECONDS - self.GEMINI_CACHE_REFRESH_MARGIN_SECONDS:
+            self.refresh_gemini_context_cache()
 
     def run(self):
         """Inicia verificação periódica de mensagens pendentes e outras tarefas de manutenção."""
         try:
             logger.info("Iniciando loop principal de verificação do bot...")
-            last_reengagement_check = datetime.now(timezone.utc)
-            last_reengagement_check = datetime.now(timezone.utc)
-            last_reminder_check = datetime.now(timezone.utc) - timedelta(seconds=self.REMINDER_CHECK_INTERVAL_SECONDS) # Check soon after start
-            last_pending_reminder_cleanup = datetime.now(timezone.utc)
-            # last_summarization_check = datetime.now(timezone.utc) # _summarize_chat_history_if_needed é chamado após cada processamento
+
+            # Tarefas de manutenção rodam cada uma em sua thread, com seu próprio intervalo:
+            # um lote demorado de chats pendentes não atrasa a entrega de lembretes (e vice-versa).
+            self._start_periodic_task("ReminderSweep", self._run_due_reminder_sweep, self.PENDING_CHECK_INTERVAL)
+            # Verificar chats inativos para reengajamento
+            # self._start_periodic_task("ReengagementCheck", self._check_inactive_chats, self.REENGAGEMENT_CHECK_INTERVAL_SECONDS)
+            # Limpar sessões de criação de lembretes pendentes e expiradas (tão frequente quanto o timeout)
+            self._start_periodic_task("PendingSessionCleanup", self._cleanup_stale_pending_reminder_sessions,
+                                      self.REMINDER_SESSION_TIMEOUT_SECONDS)
+            self._start_periodic_task("GeminiCacheRefresh", self._refresh_gemini_context_cache_if_needed, self.PENDING_CHECK_INTERVAL)
+            # Resumo é chamado no _process_pending_messages
 
             while True:
                 try:
-                    now = datetime.now(timezone.utc)
-                    
-                    # 1. Verificar e processar chats com mensagens pendentes que atingiram timeout
+                    # Verificar e processar chats com mensagens pendentes que atingiram timeout
                     self._check_all_pending_chats_for_processing()
-
-                    # 2. Verificar chats inativos para reengajamento (ex: a cada hora)
-                    if (now - last_reengagement_check) >= timedelta(hours=1): # Ajuste o intervalo conforme necessidade
-                        #self._check_inactive_chats()
-                        last_reengagement_check = now
-                    
-                    # 3. Verificar e enviar lembretes devidos
-                    if (now - last_reminder_check) >= timedelta(seconds=self.REMINDER_CHECK_INTERVAL_SECONDS):
-                        self._check_and_send_due_reminders()
-                        last_reminder_check = now
-
-                    # 4. Limpar sessões de criação de lembretes pendentes e expiradas
-                    if (now - last_pending_reminder_cleanup) >= timedelta(seconds=self.REMINDER_SESSION_TIMEOUT_SECONDS): # Check as often as timeout
-                        self._cleanup_stale_pending_reminder_sessions()
-                        last_pending_reminder_cleanup = now
-                    
-                    # 5. Outras tarefas de manutenção (resumo é chamado no _process_pending_messages)
-
                 except Exception as e:
                     logger.error(f"Erro no ciclo principal de verificação do bot: {e}", exc_info=True)
 
@@ -2126,6 +3156,7 @@ class WhatsAppGeminiBot:
                 self.db.collection("pending_messages")
                 .where(filter=FieldFilter("processing", "==", False)) # Apenas os não marcados como 'processing'
                 .where(filter=FieldFilter("last_update", "<=", cutoff_for_pending)) # Que atingiram o timeout
+                .select(["last_update"]) # Apenas o ID é usado: não traz a lista de mensagens pendentes
             )
             
             # Limitar o número de chats processados por ciclo para evitar sobrecarga, se necessário
@@ -2135,11 +3166,10 @@ class WhatsAppGeminiBot:
             chats_to_process_ids = [doc.id for doc in docs]
 
             if chats_to_process_ids:
-                logger.info(f"Chats pendentes encontrados para processamento: {len(chats_to_process_ids)}. IDs: {chats_to_process_ids}")
-                for chat_id in chats_to_process_ids:
-                    # _check_pending_messages irá verificar novamente e marcar 'processing' com transação
-                    self._check_pending_messages(chat_id) 
-                    time.sleep(0.5) # Pequeno delay entre processamento de chats diferentes
+                logger.info("Chats pendentes encontrados para processamento: %s. IDs: %s", len(chats_to_process_ids), chats_to_process_ids)
+                # _check_pending_messages irá verificar novamente e marcar 'processing' com transação.
+                # Aguarda o ciclo inteiro antes da próxima consulta (concorrência limitada ao tamanho do pool)
+                list(self._pending_chats_executor.map(self._check_pending_messages, chats_to_process_ids))
             # else:
                 # logger.debug("Nenhum chat pendente atingiu o timeout de processamento neste ciclo.")
 
@@ -2155,20 +3185,33 @@ bot = WhatsAppGeminiBot()
 # bot_thread.start()
 
 if __name__ == "__main__":
+    import signal
     logger.info("Iniciando o bot WhatsAppGeminiBot em uma thread separada...")
     from threading import Thread
-    bot_thread = Thread(target=bot.run, name="BotWorkerThread", daemon=True)
+    # A thread principal fica bloqueada neste evento, sem polling: ele é sinalizado por SIGINT/SIGTERM
+    # ou quando a thread do bot termina (erro fatal).
+    stop_event = threading.Event()
+
+    def run_bot():
+        try:
+            bot.run()
+        finally:
+            stop_event.set()
+
+    def handle_stop_signal(signum, frame):
+        logger.info("Sinal %s recebido no script principal. Encerrando o bot...", signal.Signals(signum).name)
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_stop_signal)
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+
+    bot_thread = Thread(target=run_bot, name="BotWorkerThread", daemon=True)
     bot_thread.start()
     
-    # Este join() manteria o script principal rodando até a thread do bot terminar,
-    # o que só acontece com KeyboardInterrupt ou erro fatal na thread.
+    # Se este main.py é só para o worker do bot, aguardar aqui é apropriado.
     # Para um servidor que também roda Flask (webhook.py), o Flask app.run() seria o bloqueador principal.
-    # Se este main.py é só para o worker do bot, o join é apropriado.
     try:
-        while bot_thread.is_alive():
-            bot_thread.join(timeout=1.0) # Permite checar por interrupção
-    except KeyboardInterrupt:
-        logger.info("KeyboardInterrupt recebido no script principal. Encerrando o bot...")
+        stop_event.wait()
     except Exception as e:
         logger.error(f"Erro fatal no script principal ao aguardar o bot: {e}", exc_info=True)
     finally:
@@ -0,0 +1,23 @@
+import os
+import sys
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py cria o bot na importação (chaves no .env e teste de conexão com a Whapi)
+os.environ.setdefault("WHAPI_API_KEY", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+with mock.patch.object(requests.Session, "get"):
+    from main import WhatsAppGeminiBot  # noqa: E402
+
+
+@pytest.fixture
+def bot():
+    """Bot sem __init__ (não conecta em Whapi/Gemini/Firestore): só o estado usado pelo parsing."""
+    instance = WhatsAppGeminiBot.__new__(WhatsAppGeminiBot)
+    instance.target_timezone = ZoneInfo(WhatsAppGeminiBot.TARGET_TIMEZONE_NAME)
+    return instance
@@ -0,0 +1,18 @@
+def test_confirmation_without_quotes_has_no_content(bot):
+    details = bot._detect_reminder_in_gemini_response("Lembrete agendado para amanhã às 9h")
+    assert details["found"] is True
+    assert details["content"] is None # Cai no conteúdo extraído do texto do usuário
+
+
+def test_configured_confirmation_does_not_use_confirmation_words(bot):
+    details = bot._detect_reminder_in_gemini_response(
+        "Entendido! Seu lembrete para amanhã às 10h está configurado."
+    )
+    assert details["content"] is None
+
+
+def test_quoted_content_is_extracted(bot):
+    details = bot._detect_reminder_in_gemini_response(
+        'Pode deixar! Vou te lembrar de "pagar luz" amanhã às 9h.'
+    )
+    assert details["content"] == "pagar luz"
@@ -0,0 +1,25 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+def _with_history_cache(bot):
+    bot._history_cache = OrderedDict()
+    bot._history_cache_lock = threading.Lock()
+    bot._history_generation = {}
+    return bot
+
+
+def test_read_started_before_invalidation_is_not_cached(bot):
+    _with_history_cache(bot)
+    generation = bot._history_generation.get("chat", 0) # Leitura começa aqui
+    bot._invalidate_history_cache("chat") # Mensagens resumidas enquanto a leitura roda
+    bot._store_history_cache("chat", generation, (datetime.now(timezone.utc), [], 25))
+    assert "chat" not in bot._history_cache
+
+
+def test_read_without_invalidation_is_cached(bot):
+    _with_history_cache(bot)
+    entry = (datetime.now(timezone.utc), [], 25)
+    bot._store_history_cache("chat", bot._history_generation.get("chat", 0), entry)
+    assert bot._history_cache["chat"] == entry
@@ -0,0 +1,64 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import main
+
+SAO_PAULO = ZoneInfo("America/Sao_Paulo")
+FIXED_NOW = datetime(2026, 10, 16, 10, 11, tzinfo=SAO_PAULO) # Sexta-feira, depois das 9h
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return FIXED_NOW.astimezone(tz) if tz else FIXED_NOW.replace(tzinfo=None)
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(main, "datetime", FrozenDatetime)
+
+
+def local(details):
+    return details["datetime_obj"].astimezone(SAO_PAULO)
+
+
+def test_tomorrow_with_past_hour_is_not_pushed_another_day(bot):
+    details = bot._extract_reminder_details_from_text("me lembra amanhã às 9 de pagar a conta de luz", "chat")
+    assert local(details) == datetime(2026, 10, 17, 9, 0, tzinfo=SAO_PAULO)
+    assert details["time_explicitly_provided"] is False
+
+
+def test_day_after_tomorrow_with_past_hour(bot):
+    details = bot._extract_reminder_details_from_text("me lembra depois de amanhã as 9 de pagar a conta de luz", "chat")
+    assert local(details) == datetime(2026, 10, 18, 9, 0, tzinfo=SAO_PAULO)
+
+
+def test_only_past_hour_moves_to_next_day(bot):
+    details = bot._extract_reminder_details_from_text("me lembra de pagar a conta de luz às 9", "chat")
+    assert local(details) == datetime(2026, 10, 17, 9, 0, tzinfo=SAO_PAULO)
+    assert details["time_explicitly_provided"] is True
+
+
+def test_timezone_name_is_not_part_of_content(bot):
+    details = bot._extract_reminder_details_from_text("me lembra de pagar a conta de luz amanhã", "chat")
+    assert details["content"] == "pagar a conta de luz"
+    assert details["datetime_obj"].astimezone(SAO_PAULO).date() == datetime(2026, 10, 17).date()
+
+
+def test_next_weekday_does_not_leave_next_in_content(bot):
+    details = bot._extract_reminder_details_from_text("me lembra próxima terça às 15h de ligar pro banco", "chat")
+    assert "next" not in details["content"].split()
+    assert local(details).weekday() == 1 # Terça
+    assert local(details).date() > FIXED_NOW.date()
+
+
+def test_as_before_a_noun_is_not_a_time(bot):
+    assert bot._clean_text_for_parsing("pagar as 3 contas") == "pagar as 3 contas"
+    assert bot._clean_text_for_parsing("pagar as contas às 9") == "pagar as contas 9:00:00"
+
+
+def test_gemini_fast_path_skips_article_before_number(bot):
+    parsed = bot._fast_parse_gemini_datetime("Vou te lembrar de pagar as 3 contas amanhã às 9h.", FIXED_NOW)
+    assert parsed == datetime(2026, 10, 17, 9, 0, tzinfo=SAO_PAULO)
@@ -0,0 +1,28 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def _with_heap(bot, entries, loaded_at):
+    bot._reminder_heap = list(entries)
+    bot._reminder_heap_loaded_at = loaded_at
+    bot._reminder_heap_lock = threading.Lock()
+    return bot
+
+
+def test_fresh_heap_without_due_entries_skips_the_sweep(bot):
+    now = datetime.now(timezone.utc)
+    _with_heap(bot, [(now + timedelta(hours=1), "r1")], time.monotonic())
+    assert bot._has_due_reminders(now) is False
+
+
+def test_heap_is_reloaded_after_the_reload_interval(bot):
+    now = datetime.now(timezone.utc)
+    loaded_at = time.monotonic() - bot.REMINDER_HEAP_RELOAD_SECONDS - 1
+    _with_heap(bot, [(now + timedelta(hours=1), "r1")], loaded_at)
+    assert bot._has_due_reminders(now) is True
+
+
+def test_heap_never_loaded_needs_a_sweep(bot):
+    _with_heap(bot, [], None)
+    assert bot._has_due_reminders(datetime.now(timezone.utc)) is True
@@ -78,14 +78,14 @@ def handle_webhook():
             app.logger.warning(f"Webhook: formato de mensagem não esperado. Dados: {data}")
             return jsonify({'status': 'Formato de mensagem não esperado'}), 400
 
-        app.logger.info(f"Webhook recebeu {len(messages_to_process)} mensagem(ns).")
+        app.logger.info("Webhook recebeu %s mensagem(ns).", len(messages_to_process))
 
         for message_payload in messages_to_process:
             # Filtro principal: Ignorar mensagens enviadas pelo próprio bot ('from_me' == true)
             # Whapi usa strings 'true'/'false' ou booleans para from_me.
             from_me_val = message_payload.get('from_me', False)
             if str(from_me_val).lower() == 'true':
-                app.logger.info(f"Webhook: Mensagem de {message_payload.get('chat_id')} é do bot (from_me=true), ignorando.")
+                app.logger.info("Webhook: Mensagem de %s é do bot (from_me=true), ignorando.", message_payload.get('chat_id'))
                 continue
             
             # Ignorar tipos de mensagem que não são de usuário (eventos de grupo, etc.)
@@ -103,7 +103,7 @@ def handle_webhook():
                               message_payload.get('body') or 
                               message_payload.get('caption'))
                 if not text_check and msg_type not in ['image', 'audio', 'ptt', 'voice', 'video', 'document']: # Se não for mídia e não tiver texto
-                    app.logger.info(f"Webhook: Mensagem tipo '{msg_type}' sem conteúdo de texto claro, ignorando. ID: {message_payload.get('id')}")
+                    app.logger.info("Webhook: Mensagem tipo '%s' sem conteúdo de texto claro, ignorando. ID: %s", msg_type, message_payload.get('id'))
                     continue
 
             # Delega o processamento completo da mensagem (incluindo extração de tipo/conteúdo) ao bot